@@ -0,0 +1,102 @@
+"""Paint time of the GeomorphEye overlay passes: per-cell calls vs batched drawing.
+
+Runs headless (offscreen Qt platform) and renders into a QImage:
+
+    python benchmarks/bench_overlay_paint.py [cells ...]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qgis.core import QgsApplication, QgsRectangle
+from qgis.gui import QgsMapCanvas
+from PyQt5.QtCore import QPointF, Qt
+from PyQt5.QtGui import QColor, QImage, QPainter, QPen
+import numpy as np
+
+from geomorpheye.rasteroverlay import RasterOverlay
+from geomorpheye.analysis import NO_DIRECTION
+from geomorpheye.cellgrid import CellGrid
+
+
+def synthetic_grid(side, xRes=10.0, yRes=10.0, west=0.0, north=0.0):
+    rng = np.random.default_rng(42)
+    values = rng.random((side, side)) * 100
+    nodata = np.zeros((side, side), dtype=bool)
+    directions = rng.integers(1, 9, (side, side)).astype(np.uint8)
+    sinks = rng.random((side, side)) < 0.05
+    return CellGrid(west, north, xRes, yRes, 0, 0, values, nodata, directions, sinks)
+
+
+def legacy_cells(overlay, painter, geometry):
+    painter.setPen(QPen(QColor(overlay.cellBorderColorHex), 1))
+    for i in range(geometry.count):
+        painter.drawRect(geometry.cellRect(i))
+
+
+def legacy_flow(overlay, painter, geometry):
+    painter.setPen(QPen(QColor(overlay.flowLinesColorHex), 1))
+    painter.setBrush(QColor(overlay.flowLinesColorHex))
+    radii = np.hypot(geometry.flowEndX - geometry.centerX,
+                     geometry.flowEndY - geometry.centerY) / overlay.radiusRatio
+    hasFlow = ~geometry.sinks & (geometry.directions != NO_DIRECTION)
+    for i in np.flatnonzero(hasFlow).tolist():
+        center = QPointF(geometry.centerX[i], geometry.centerY[i])
+        painter.drawEllipse(center, radii[i], radii[i])
+        painter.drawLine(center, QPointF(geometry.flowEndX[i], geometry.flowEndY[i]))
+
+
+def legacy_sinks(overlay, painter, geometry):
+    painter.setPen(QPen(QColor(overlay.sinkColorHex), 1))
+    painter.setBrush(QColor(overlay.sinkColorHex))
+    radii = (geometry.right - geometry.left) / overlay.radiusRatio
+    for i in np.flatnonzero(geometry.sinks).tolist():
+        center = QPointF(geometry.centerX[i], geometry.centerY[i])
+        painter.drawEllipse(center, radii[i], radii[i])
+
+
+def time_pass(canvas, geometry, draw):
+    image = QImage(canvas.size(), QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    painter = QPainter(image)
+    start = time.perf_counter()
+    draw(painter, geometry)
+    elapsed = time.perf_counter() - start
+    painter.end()
+    return elapsed * 1000
+
+
+def main(cellCounts):
+    app = QgsApplication([], False)
+    app.initQgis()
+    canvas = QgsMapCanvas()
+    canvas.resize(1920, 1080)
+
+    print(f"{'cells':>10} {'pass':>8} {'per-cell ms':>12} {'batched ms':>12}")
+    for cellCount in cellCounts:
+        side = int(round(cellCount ** 0.5))
+        grid = synthetic_grid(side)
+        canvas.setExtent(QgsRectangle(grid.west, grid.south, grid.east, grid.north))
+        overlay = RasterOverlay(
+            canvas, grid, fontSize=10, borderColor="#000000", draw_pits=True, draw_flow=True,
+            draw_values=False, draw_cells=True, draw_colors=False, draw_colrow=False)
+        geometry = overlay.cellGeometry()
+        passes = [
+            ("cells", legacy_cells, overlay.drawCells),
+            ("flow", legacy_flow, overlay.drawFlow),
+            ("sinks", legacy_sinks, overlay.drawSinks),
+        ]
+        for name, legacy, batched in passes:
+            before = time_pass(canvas, geometry, lambda p, g: legacy(overlay, p, g))
+            after = time_pass(canvas, geometry, batched)
+            print(f"{side * side:>10} {name:>8} {before:>12.1f} {after:>12.1f}")
+        canvas.scene().removeItem(overlay)
+
+    app.exitQgis()
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [10_000, 100_000, 1_000_000])
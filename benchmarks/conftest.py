@@ -0,0 +1,82 @@
+"""Fixtures of the headless GeomorphEye benchmarks.
+
+Needs QGIS and pytest-benchmark; without them the suite is skipped. Run with
+
+    pytest benchmarks --benchmark-json=bench_output.json
+
+or --benchmark-autosave to keep one result file per commit under .benchmarks/
+and compare runs with `pytest-benchmark compare`. GEOMORPHEYE_BENCH_CELLS
+overrides the DEM sizes, e.g. GEOMORPHEYE_BENCH_CELLS=1000,100000.
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "testdata"))
+
+import generator
+
+# Collected only where QGIS and pytest-benchmark are installed.
+if importlib.util.find_spec("qgis") is None or importlib.util.find_spec("pytest_benchmark") is None:
+    collect_ignore_glob = ["test_*.py"]
+
+DEFAULT_CELLS = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+CANVAS_WIDTH = 1920
+CANVAS_HEIGHT = 1080
+
+
+def bench_cells():
+    cells = os.environ.get("GEOMORPHEYE_BENCH_CELLS")
+    if cells:
+        return [int(float(c)) for c in cells.split(",")]
+    return DEFAULT_CELLS
+
+
+def pytest_generate_tests(metafunc):
+    if "dem" in metafunc.fixturenames:
+        metafunc.parametrize("dem", bench_cells(), indirect=True, ids=lambda c: f"{c:.0e}")
+
+
+@pytest.fixture(scope="session")
+def qgis_app():
+    from qgis.core import QgsApplication
+
+    app = QgsApplication([], False)
+    app.initQgis()
+    yield app
+    app.exitQgis()
+
+
+@pytest.fixture(scope="session")
+def dem_folder(tmp_path_factory):
+    return tmp_path_factory.mktemp("dems")
+
+
+@pytest.fixture(scope="session")
+def dem(request, qgis_app, dem_folder):
+    """A square synthetic DEM of about the requested number of cells."""
+    from qgis.core import QgsRasterLayer
+
+    side = max(3, int(round(request.param ** 0.5)))
+    path = dem_folder / f"dem_{side}x{side}.tif"
+    if not path.exists():
+        values, nodata = generator.generate_dem(side, side, seed=1, pits=side, flats=side // 100,
+                                                holes=side // 200)
+        generator.write_dem(str(path), values, nodata)
+    layer = QgsRasterLayer(str(path), path.stem)
+    assert layer.isValid(), f"Could not load {path}"
+    return layer
+
+
+@pytest.fixture(scope="session")
+def canvas(qgis_app):
+    from qgis.gui import QgsMapCanvas
+
+    canvas = QgsMapCanvas()
+    canvas.resize(CANVAS_WIDTH, CANVAS_HEIGHT)
+    return canvas
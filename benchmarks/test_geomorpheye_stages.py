@@ -0,0 +1,153 @@
+"""Per-stage timings of the GeomorphEye hot path on synthetic DEMs.
+
+Each stage is timed on its own, over the whole DEM: the raster read, the D8/sink
+analysis, the flow accumulation, the hydrological conditioning, the terrain
+surfaces, the cell-model build and every RasterOverlay draw pass. The pan
+render times a repaint after a small pan, with and without reusing the last image.
+"""
+import pytest
+from qgis.core import QgsRectangle
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QPainter
+
+from geomorpheye.accumulation import flow_accumulation
+from geomorpheye.analysis import analyse_window, condition_window
+from geomorpheye.cellgrid import CellGrid, TERRAIN_SURFACES
+from geomorpheye.rasteroverlay import RasterOverlay
+from geomorpheye.rasterreader import read_block, read_window_with_halo
+
+DRAW_PASSES = ["drawColor", "drawCells", "drawFlow", "drawSinks", "drawValues"]
+# Conditioning runs on the visible window only, which never gets this large.
+MAX_CONDITION_CELLS = 1_000_000
+# Columns the view moves by in the pan render.
+PAN_COLS = 8
+
+
+def window_args(layer):
+    extent = layer.extent()
+    return (layer.dataProvider(), 1, extent, layer.rasterUnitsPerPixelX(),
+            layer.rasterUnitsPerPixelY(), layer.width(), layer.height())
+
+
+def build_grid(layer):
+    provider, band, extent, xRes, yRes, cols, rows = window_args(layer)
+    values, nodata = read_window_with_halo(provider, band, extent, xRes, yRes, cols, rows)
+    directions, sinks, _, _ = analyse_window(values, nodata)
+    return CellGrid(extent.xMinimum(), extent.yMaximum(), xRes, yRes, 0, 0,
+                    values[1:-1, 1:-1], nodata[1:-1, 1:-1], directions, sinks,
+                    paddedValues=values, paddedNodata=nodata)
+
+
+@pytest.fixture
+def overlay(dem, canvas):
+    grid = build_grid(dem)
+    canvas.setExtent(QgsRectangle(grid.west, grid.south, grid.east, grid.north))
+    overlay = RasterOverlay(
+        canvas, grid, fontSize=10, borderColor="#000000", draw_pits=True, draw_flow=True,
+        draw_values=True, draw_cells=True, draw_colors=True, draw_colrow=False)
+    yield overlay
+    canvas.scene().removeItem(overlay)
+
+
+def test_read(benchmark, dem):
+    provider, band, extent, _, _, cols, rows = window_args(dem)
+    values, _ = benchmark(read_block, provider, band, extent, cols, rows)
+    assert values.shape == (rows, cols)
+
+
+def test_analysis(benchmark, dem):
+    provider, band, extent, xRes, yRes, cols, rows = window_args(dem)
+    values, nodata = read_window_with_halo(provider, band, extent, xRes, yRes, cols, rows)
+    directions, _, _, _ = benchmark(analyse_window, values, nodata)
+    assert directions.shape == (rows, cols)
+
+
+def test_flow_accumulation(benchmark, dem):
+    provider, band, extent, xRes, yRes, cols, rows = window_args(dem)
+    values, nodata = read_window_with_halo(provider, band, extent, xRes, yRes, cols, rows)
+    directions, sinks, _, _ = analyse_window(values, nodata)
+    accumulation = benchmark(flow_accumulation, directions, nodata[1:-1, 1:-1], sinks)
+    assert accumulation.shape == (rows, cols)
+
+
+def test_conditioning(benchmark, dem):
+    if dem.width() * dem.height() > MAX_CONDITION_CELLS:
+        pytest.skip("larger than any conditioned window")
+    provider, band, extent, _, _, cols, rows = window_args(dem)
+    values, nodata = read_block(provider, band, extent, cols, rows)
+    filled, _, _ = benchmark(condition_window, values, nodata)
+    assert (filled[~nodata] >= values[~nodata]).all()
+
+
+def test_cell_model(benchmark, overlay):
+    grid = overlay.grid
+    values, nodata, directions, sinks = grid.values, grid.nodata, grid.directions, grid.sinks
+
+    def build():
+        overlay.grid = CellGrid(grid.west, grid.north, grid.xRes, grid.yRes, 0, 0,
+                                values, nodata, directions, sinks)
+        return overlay.cellGeometry()
+
+    geometry = benchmark(build)
+    assert geometry.count == int((~nodata).sum())
+
+
+@pytest.mark.parametrize("surface", TERRAIN_SURFACES)
+def test_terrain_surface(benchmark, dem, surface):
+    grid = build_grid(dem)
+
+    def compute():
+        grid._terrain.clear()
+        return grid.terrain(surface)
+
+    assert benchmark(compute).shape == (grid.rows, grid.cols)
+
+
+@pytest.mark.parametrize("drawPass", DRAW_PASSES)
+def test_draw_pass(benchmark, overlay, canvas, drawPass):
+    geometry = overlay.cellGeometry()
+    draw = getattr(overlay, drawPass)
+    image = QImage(canvas.size(), QImage.Format_ARGB32_Premultiplied)
+
+    def render():
+        image.fill(Qt.transparent)
+        painter = QPainter(image)
+        draw(painter, geometry)
+        painter.end()
+
+    benchmark(render)
+
+
+def sub_grid(grid, firstCol, endCol):
+    """The columns firstCol:endCol of a grid, as read for a view over them."""
+    return CellGrid(grid.west + firstCol * grid.xRes, grid.north, grid.xRes, grid.yRes, firstCol, 0,
+                    grid.values[:, firstCol:endCol], grid.nodata[:, firstCol:endCol],
+                    grid.directions[:, firstCol:endCol], grid.sinks[:, firstCol:endCol],
+                    paddedValues=grid.paddedValues[:, firstCol:endCol + 2],
+                    paddedNodata=grid.paddedNodata[:, firstCol:endCol + 2])
+
+
+@pytest.mark.parametrize("incremental", [True, False])
+def test_pan_render(benchmark, overlay, canvas, incremental):
+    grid = overlay.grid
+    if grid.cols <= 4 * PAN_COLS:
+        pytest.skip("too narrow to pan")
+    # Without the local colormap, whose range changes with the window and forces a full render.
+    overlay.setDrawAttributes(True, True, False, True, False, False)
+    before = sub_grid(grid, 0, grid.cols - PAN_COLS)
+    after = sub_grid(grid, PAN_COLS, grid.cols)
+    image = QImage(canvas.size(), QImage.Format_ARGB32_Premultiplied)
+
+    def show(view):
+        canvas.setExtent(QgsRectangle(view.west, view.south, view.east, view.north))
+        overlay.updateData(view)
+        painter = QPainter(image)
+        overlay.paint(painter, None, None)
+        painter.end()
+
+    def setup():
+        show(before)
+        if not incremental:
+            overlay._imageState = None
+
+    benchmark.pedantic(show, args=(after,), setup=setup, rounds=5)
@@ -7,6 +7,18 @@ rm -rf ./releases
 # Define plugin folders
 PLUGINS=("featurenavigator" "rasterfromvectorfieldloader" "geomorpheye" "klabclient")
 
+# Modules shared by several plugins: the canonical copies live in ./shared and
+# are copied into every plugin that uses them.
+SHARED_MODULES=("geotransform.py:geomorpheye klabclient")
+
+python3 -m doctest shared/*.py
+for entry in "${SHARED_MODULES[@]}"; do
+    module="${entry%%:*}"
+    for plugin in ${entry#*:}; do
+        cp "shared/$module" "$plugin/$module"
+    done
+done
+
 # Create releases directory
 RELEASE_DIR="releases"
 mkdir -p "$RELEASE_DIR"
@@ -0,0 +1,275 @@
+"""Qt-free D8 flow accumulation and flow tracing for GeomorphEye.
+
+Accumulation counts, for every cell, the valid cells that drain through it,
+itself included. It is computed per tile and cached with it (FlowGraph); the
+accumulation of a window of tiles is then stitched from the cached tiles by
+passing the flow across the tile borders (stitch_accumulation), instead of
+walking every cell of the window again.
+
+Flow stops at sinks, whose direction points to a higher neighbour. Cells on
+direction cycles, which an unconditioned surface can have on flats, are
+stops too: they get the flow of the cells draining into them, but do not pass
+it on. Cycles crossing tile borders are found while stitching and stopped the
+same way, so the stitched accumulation equals that of the whole window.
+"""
+import numpy as np
+
+from .analysis import D8_OFFSETS, NO_DIRECTION
+
+# Row and col offset of the downstream cell, indexed by direction code.
+D8_DROW = np.zeros(9, dtype=np.int64)
+D8_DCOL = np.zeros(9, dtype=np.int64)
+for _dRow, _dCol, _code in D8_OFFSETS:
+    D8_DROW[_code] = _dRow
+    D8_DCOL[_code] = _dCol
+
+
+def flow_codes(directions, nodata, sinks=None):
+    """The directions with NO_DIRECTION where there is no data and at sinks."""
+    stops = nodata if sinks is None else nodata | sinks
+    return np.where(stops, NO_DIRECTION, directions).astype(np.uint8)
+
+
+def downstream_targets(directions, nodata):
+    """(rows, cols) of the cell every cell flows to, in window coordinates.
+
+    The targets may be outside the window; cells without a direction point to
+    themselves.
+    """
+    rows, cols = directions.shape
+    codes = np.where(nodata, NO_DIRECTION, directions)
+    targetRows = np.arange(rows)[:, np.newaxis] + D8_DROW[codes]
+    targetCols = np.arange(cols)[np.newaxis, :] + D8_DCOL[codes]
+    return targetRows, targetCols
+
+
+def downstream_indexes(directions, nodata):
+    """Flat index of the downstream cell of every cell, -1 where the flow stops or leaves the window."""
+    rows, cols = directions.shape
+    targetRows, targetCols = downstream_targets(directions, nodata)
+    inside = (directions != NO_DIRECTION) & ~nodata & \
+        (targetRows >= 0) & (targetRows < rows) & (targetCols >= 0) & (targetCols < cols)
+    target = np.where(inside, targetRows * cols + targetCols, 0)
+    inside &= ~nodata.ravel()[target.ravel()].reshape(rows, cols)
+    return np.where(inside, target, -1).ravel()
+
+
+def topological_levels(down, valid):
+    """Order the cells of a flow graph so that every cell comes before its downstream cell.
+
+    Kahn's algorithm, one NumPy step per level: level 0 are the cells nothing
+    flows into, level k + 1 the cells whose upstream cells are all in levels <= k.
+    Returns (order, levelStarts): the cells of level k are
+    order[levelStarts[k]:levelStarts[k + 1]].
+    """
+    hasDown = down >= 0
+    indegree = np.bincount(down[hasDown], minlength=down.size)
+    frontier = np.flatnonzero(valid & (indegree == 0))
+    levels = []
+    while frontier.size:
+        levels.append(frontier)
+        targets = down[frontier]
+        targets, counts = np.unique(targets[targets >= 0], return_counts=True)
+        indegree[targets] -= counts
+        frontier = targets[indegree[targets] == 0]
+    sizes = [level.size for level in levels]
+    order = np.concatenate(levels) if levels else np.empty(0, dtype=np.int64)
+    levelStarts = np.concatenate([[0], np.cumsum(sizes, dtype=np.int64)])
+    return order.astype(np.int32), levelStarts
+
+
+class FlowGraph():
+    """Flow graph and local accumulation of a window (usually a tile).
+
+    codes are the directions the flow follows (see flow_codes); down[i] is the
+    flat index of the cell cell i drains into, -1 where the flow stops or
+    leaves the window; exitOf[i] is the cell where the flow of cell i stops or
+    leaves the window. Cells on direction cycles, which Kahn's algorithm
+    never reaches, become stops; stops marks further cells to stop at.
+    """
+
+    def __init__(self, directions, nodata, sinks=None, stops=None):
+        self.shape = directions.shape
+        valid = ~nodata.ravel()
+        if stops is not None:
+            sinks = stops if sinks is None else sinks | stops
+        self.codes = flow_codes(directions, nodata, sinks)
+        self.down = downstream_indexes(self.codes, nodata).astype(np.int32)
+        self.order, self.levelStarts = topological_levels(self.down, valid)
+        if self.order.size < np.count_nonzero(valid):
+            reached = np.zeros(self.down.size, dtype=bool)
+            reached[self.order] = True
+            onCycle = valid & ~reached
+            self.codes.ravel()[onCycle] = NO_DIRECTION
+            self.down[onCycle] = -1
+            self.order, self.levelStarts = topological_levels(self.down, valid)
+        self.accumulation = self.propagate(valid.astype(np.float64))
+
+        self.exitOf = np.arange(self.down.size, dtype=np.int32)
+        for start, end in zip(self.levelStarts[-2::-1], self.levelStarts[:0:-1]):
+            cells = self.order[start:end]
+            cells = cells[self.down[cells] >= 0]
+            self.exitOf[cells] = self.exitOf[self.down[cells]]
+
+        self.nbytes = self.codes.nbytes + self.down.nbytes + self.order.nbytes + \
+            self.levelStarts.nbytes + self.accumulation.nbytes + self.exitOf.nbytes
+
+    def propagate(self, weights):
+        """Pass the flat weights downstream: every cell gets its weight plus all upstream weights."""
+        total = weights.copy()
+        for start, end in zip(self.levelStarts[:-1], self.levelStarts[1:]):
+            cells = self.order[start:end]
+            cells = cells[self.down[cells] >= 0]
+            np.add.at(total, self.down[cells], total[cells])
+        return total
+
+
+def flow_accumulation(directions, nodata, sinks=None):
+    """Accumulation of a single window, as a (rows, cols) float64 array."""
+    return FlowGraph(directions, nodata, sinks).accumulation.reshape(directions.shape)
+
+
+def border_links(tiles, flows, tileSize):
+    """Links of the flow leaving a tile into another tile of the set.
+
+    Returns (nodeCells, linkFrom, linkTo): nodeCells lists the (tile key,
+    cell) of every border node, the exit cells and the cells where the flow
+    entering a tile stops or leaves it; link i goes from node linkFrom[i] to
+    the (tile key, entry cell, node of its exit cell) linkTo[i].
+    """
+    nodeIndex = {}
+    nodeCells = []
+    linkFrom = []
+    linkTo = []
+
+    def node(key, cell):
+        index = nodeIndex.get((key, cell))
+        if index is None:
+            index = nodeIndex[(key, cell)] = len(nodeCells)
+            nodeCells.append((key, cell))
+        return index
+
+    for key, tile in tiles.items():
+        flow = flows[key]
+        leaving = np.flatnonzero((flow.down < 0) & (flow.codes.ravel() != NO_DIRECTION))
+        if leaving.size == 0:
+            continue
+        targetRows, targetCols = downstream_targets(flow.codes, tile.nodata)
+        globalRows = targetRows.ravel()[leaving] + key[0] * tileSize
+        globalCols = targetCols.ravel()[leaving] + key[1] * tileSize
+        for cell, globalRow, globalCol in zip(leaving.tolist(), globalRows.tolist(), globalCols.tolist()):
+            targetKey = (globalRow // tileSize, globalCol // tileSize)
+            target = tiles.get(targetKey)
+            if target is None:
+                continue
+            entry = (globalRow % tileSize) * tileSize + globalCol % tileSize
+            if target.nodata.flat[entry]:
+                continue
+            linkFrom.append(node(key, cell))
+            linkTo.append((targetKey, entry, node(targetKey, int(flows[targetKey].exitOf[entry]))))
+    return nodeCells, linkFrom, linkTo
+
+
+def node_levels(nodeCount, linkFrom, linkTo):
+    """(nodeDown, order, levelStarts) of the graph of the border nodes, see topological_levels."""
+    nodeDown = np.full(nodeCount, -1, dtype=np.int64)
+    nodeDown[linkFrom] = [downNode for _, _, downNode in linkTo]
+    return (nodeDown,) + topological_levels(nodeDown, np.ones(nodeCount, dtype=bool))
+
+
+def stitch_accumulation(tiles, tileSize):
+    """Accumulation over a set of adjacent tiles, from their cached flow graphs.
+
+    tiles maps (tileRow, tileCol) to objects with directions, sinks, nodata
+    and flow (a FlowGraph) attributes. The flow leaving a tile into another
+    tile of the set is resolved on the graph of the tile border cells only,
+    then added along the downstream paths of the cells it enters. Border
+    nodes on a cycle mark a direction cycle across tiles: the graphs of the
+    tiles it passes are then rebuilt with its cells as stops.
+
+    Returns a dict of (tileSize, tileSize) float64 accumulations by tile key.
+    """
+    flows = {key: tile.flow for key, tile in tiles.items()}
+    nodeCells, linkFrom, linkTo = border_links(tiles, flows, tileSize)
+    if not linkFrom:
+        return {key: flow.accumulation.reshape(flow.shape) for key, flow in flows.items()}
+
+    nodeDown, order, levelStarts = node_levels(len(nodeCells), linkFrom, linkTo)
+    if order.size < len(nodeCells):
+        # Every cell on a cycle lies on the path from an entry cell of the cycle to its exit.
+        onCycle = np.ones(len(nodeCells), dtype=bool)
+        onCycle[order] = False
+        stops = {}
+        for fromNode, (targetKey, entry, _) in zip(linkFrom, linkTo):
+            if onCycle[fromNode]:
+                down = flows[targetKey].down
+                mask = stops.setdefault(targetKey, np.zeros(down.size, dtype=bool))
+                cell = entry
+                while cell >= 0:
+                    mask[cell] = True
+                    cell = int(down[cell])
+        for key, mask in stops.items():
+            tile = tiles[key]
+            flows[key] = FlowGraph(tile.directions, tile.nodata, tile.sinks, mask.reshape(tile.nodata.shape))
+        nodeCells, linkFrom, linkTo = border_links(tiles, flows, tileSize)
+        if not linkFrom:
+            return {key: flow.accumulation.reshape(flow.shape) for key, flow in flows.items()}
+        nodeDown, order, levelStarts = node_levels(len(nodeCells), linkFrom, linkTo)
+
+    # Total flow out of every border node: its local accumulation plus what enters upstream of it.
+    nodeFlow = np.array([flows[key].accumulation[cell] for key, cell in nodeCells], dtype=np.float64)
+    for start, end in zip(levelStarts[:-1], levelStarts[1:]):
+        nodes = order[start:end]
+        nodes = nodes[nodeDown[nodes] >= 0]
+        np.add.at(nodeFlow, nodeDown[nodes], nodeFlow[nodes])
+
+    inflows = {}
+    for fromNode, (targetKey, entry, _) in zip(linkFrom, linkTo):
+        seeds = inflows.setdefault(targetKey, {})
+        seeds[entry] = seeds.get(entry, 0.0) + nodeFlow[fromNode]
+
+    accumulations = {}
+    for key, flow in flows.items():
+        accumulation = flow.accumulation
+        if key in inflows:
+            weights = np.zeros(flow.down.size)
+            entries = np.fromiter(inflows[key].keys(), dtype=np.int64)
+            weights[entries] = np.fromiter(inflows[key].values(), dtype=np.float64)
+            accumulation = accumulation + flow.propagate(weights)
+        accumulations[key] = accumulation.reshape(flow.shape)
+    return accumulations
+
+
+def downstream_path(directions, nodata, sinks, row, col):
+    """(rows, cols) index arrays of the flow path from a cell until it stops or leaves the window."""
+    down = downstream_indexes(flow_codes(directions, nodata, sinks), nodata)
+    cols = directions.shape[1]
+    path = []
+    seen = set()
+    cell = row * cols + col
+    while cell >= 0 and cell not in seen:
+        seen.add(cell)
+        path.append(cell)
+        cell = int(down[cell])
+    path = np.array(path, dtype=np.int64)
+    return path // cols, path % cols
+
+
+def upstream_mask(directions, nodata, sinks, row, col):
+    """Mask of the cells of the window that drain through a cell, the cell included."""
+    down = downstream_indexes(flow_codes(directions, nodata, sinks), nodata)
+    # Upstream neighbours of every cell, grouped by downstream cell.
+    upstreamOrder = np.argsort(down, kind="stable")
+    starts = np.searchsorted(down[upstreamOrder], np.arange(down.size + 1))
+
+    mask = np.zeros(down.size, dtype=bool)
+    start = row * directions.shape[1] + col
+    mask[start] = True
+    stack = [start]
+    while stack:
+        cell = stack.pop()
+        for upstream in upstreamOrder[starts[cell]:starts[cell + 1]].tolist():
+            if not mask[upstream]:
+                mask[upstream] = True
+                stack.append(upstream)
+    return mask.reshape(directions.shape)
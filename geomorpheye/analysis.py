@@ -0,0 +1,415 @@
+"""Qt-free raster analysis used by GeomorphEye.
+
+All functions work on halo-padded NumPy windows: a (rows + 2, cols + 2) array of
+values and a boolean nodata mask of the same shape, as returned by the raster
+reader. Results are given for the inner (rows, cols) cells. The hydrological
+conditioning functions instead take the window itself and treat its border as
+an outlet.
+"""
+from collections import deque
+import heapq
+
+import numpy as np
+
+# Direction codes of the eight neighbours, as drawn by RasterOverlay.drawFlow:
+#   4 3 2
+#   5 . 1
+#   6 7 8
+# The order of this table is also the tie-break order of the steepest descent.
+NO_DIRECTION = 0
+D8_OFFSETS = (
+    # (row offset, col offset, direction code)
+    (-1, -1, 4), (-1, 0, 3), (-1, 1, 2),
+    ( 0, -1, 5),             ( 0, 1, 1),
+    ( 1, -1, 6), ( 1, 0, 7), ( 1, 1, 8),
+)
+D8_CODES = np.array([code for _, _, code in D8_OFFSETS], dtype=np.uint8)
+
+ELEV_MIN_START =  99999999999
+ELEV_MAX_START = -99999999999
+
+
+def neighbour_stack(padded):
+    """Return the eight neighbour planes of a halo-padded array, shape (8, rows, cols)."""
+    rows = padded.shape[0] - 2
+    cols = padded.shape[1] - 2
+    return np.stack([
+        padded[1 + dRow:1 + dRow + rows, 1 + dCol:1 + dCol + cols]
+        for dRow, dCol, _ in D8_OFFSETS
+    ])
+
+
+def analyse_window(values, nodata):
+    """Compute D8 steepest directions and sinks for a halo-padded window.
+
+    Returns (directions, sinks, elevMin, elevMax):
+      * directions: uint8 codes 1-8 towards the lowest valid neighbour, the first one
+        in D8_OFFSETS order on ties, NO_DIRECTION if no neighbour is valid
+      * sinks: True where no valid neighbour is lower, unless the value equals more
+        than one neighbour
+      * elevMin, elevMax: range of the valid inner values
+
+    Directions and sinks are only meaningful where the inner cell is valid.
+    """
+    center = values[1:-1, 1:-1]
+    valid = ~nodata[1:-1, 1:-1]
+
+    neighbours = neighbour_stack(values)
+    neighbourValid = ~neighbour_stack(nodata)
+
+    lower = (neighbourValid & (neighbours < center)).any(axis=0)
+    equalCount = (neighbourValid & (neighbours == center)).sum(axis=0)
+    sinks = valid & ~lower & (equalCount <= 1)
+
+    lowest = np.where(neighbourValid, neighbours, np.inf).min(axis=0)
+    isLowest = neighbourValid & (neighbours == lowest)
+    directions = D8_CODES[isLowest.argmax(axis=0)]
+    directions[~(valid & neighbourValid.any(axis=0))] = NO_DIRECTION
+
+    elevMin, elevMax = value_range(center, ~valid)
+    return directions, sinks, elevMin, elevMax
+
+
+def value_range(values, nodata):
+    """Return (elevMin, elevMax) of the valid values, the start sentinels if none is valid."""
+    validValues = values[~nodata]
+    if validValues.size == 0:
+        return ELEV_MIN_START, ELEV_MAX_START
+    return (min(ELEV_MIN_START, float(validValues.min())),
+            max(ELEV_MAX_START, float(validValues.max())))
+
+
+def aggregate_window(values, nodata, factor, method="mean"):
+    """Aggregate factor x factor blocks of cells into one cell.
+
+    The shape of values must be a multiple of factor. method is "mean" or "min";
+    nodata cells are ignored and a block without valid cells becomes nodata.
+    Returns (values, nodata) of the aggregated grid.
+    """
+    rows = values.shape[0] // factor
+    cols = values.shape[1] // factor
+    blockValues = values.reshape(rows, factor, cols, factor)
+    blockValid = ~nodata.reshape(rows, factor, cols, factor)
+
+    validCount = blockValid.sum(axis=(1, 3))
+    aggregatedNodata = validCount == 0
+    if method == "min":
+        aggregated = np.where(blockValid, blockValues, np.inf).min(axis=(1, 3))
+    else:
+        total = np.where(blockValid, blockValues, 0.0).sum(axis=(1, 3))
+        aggregated = total / np.maximum(validCount, 1)
+    aggregated[aggregatedNodata] = np.nan
+    return aggregated, aggregatedNodata
+
+
+# Integer DEMs spanning at most this many distinct elevations are filled with
+# the O(n) bucket queue instead of the heap.
+MAX_BUCKET_LEVELS = 1 << 16
+
+
+def _flat_layout(nodata):
+    """Flat indexes over the window padded with a closed ring of nodata cells.
+
+    Returns (closed, offsets, width): the padded nodata mask as a bytearray, the
+    flat index offsets of the D8 neighbours in D8_OFFSETS order and the row width.
+    The ring means neighbour indexes never need bounds checks.
+    """
+    width = nodata.shape[1] + 2
+    closed = bytearray(np.pad(nodata, 1, constant_values=True).astype(np.uint8).ravel().tobytes())
+    offsets = [dRow * width + dCol for dRow, dCol, _ in D8_OFFSETS]
+    return closed, offsets, width
+
+
+def _drains_off(nodata):
+    """Valid cells on the window border or next to nodata, where water can leave the window."""
+    padded = np.pad(nodata, 1, constant_values=True)
+    return ~nodata & neighbour_stack(padded).any(axis=0)
+
+
+def priority_flood(values, nodata):
+    """Fill the depressions of a window with Priority-Flood (Barnes et al. 2014).
+
+    values and nodata are the (rows, cols) window itself, not halo-padded: cells on
+    its border and next to nodata are the outlets the flood starts from. Every
+    other cell is raised to the lowest level at which it drains to an outlet, which
+    leaves flats where depressions were. Depressions are filled through a plain
+    FIFO queue; the heap is only used for cells above the current flood level, and
+    integer DEMs use a bucket queue instead, for O(n) filling.
+
+    Returns the filled float64 (rows, cols) array; nodata cells are left unchanged.
+    """
+    rows, cols = values.shape
+    closed, offsets, width = _flat_layout(nodata)
+    filled = np.pad(values.astype(np.float64), 1).ravel().tolist()
+
+    seedRows, seedCols = np.nonzero(_drains_off(nodata))
+    seeds = ((seedRows + 1) * width + seedCols + 1).tolist()
+    for cell in seeds:
+        closed[cell] = 1
+
+    validValues = values[~nodata]
+    isInteger = validValues.size > 0 and np.all(validValues == np.floor(validValues)) and \
+        validValues.max() - validValues.min() < MAX_BUCKET_LEVELS
+    if isInteger:
+        _flood_buckets(filled, closed, offsets, seeds, int(validValues.min()),
+                       int(validValues.max()) - int(validValues.min()) + 1)
+    else:
+        _flood_heap(filled, closed, offsets, seeds)
+
+    return np.array(filled).reshape(rows + 2, width)[1:-1, 1:-1]
+
+
+def _flood_heap(filled, closed, offsets, seeds):
+    heap = [(filled[cell], cell) for cell in seeds]
+    heapq.heapify(heap)
+    pit = deque()
+    while heap or pit:
+        if pit:
+            level, cell = pit.popleft()
+        else:
+            level, cell = heapq.heappop(heap)
+        for offset in offsets:
+            neighbour = cell + offset
+            if closed[neighbour]:
+                continue
+            closed[neighbour] = 1
+            if filled[neighbour] <= level:
+                filled[neighbour] = level
+                pit.append((level, neighbour))
+            else:
+                heapq.heappush(heap, (filled[neighbour], neighbour))
+
+
+def _flood_buckets(filled, closed, offsets, seeds, base, levels):
+    buckets = [[] for _ in range(levels)]
+    for cell in seeds:
+        buckets[int(filled[cell]) - base].append(cell)
+    for bucketIndex, bucket in enumerate(buckets):
+        level = float(base + bucketIndex)
+        # cells raised to this level are appended to the bucket while it is walked
+        i = 0
+        while i < len(bucket):
+            cell = bucket[i]
+            i += 1
+            for offset in offsets:
+                neighbour = cell + offset
+                if closed[neighbour]:
+                    continue
+                closed[neighbour] = 1
+                if filled[neighbour] <= level:
+                    filled[neighbour] = level
+                    bucket.append(neighbour)
+                else:
+                    buckets[int(filled[neighbour]) - base].append(neighbour)
+        buckets[bucketIndex] = None
+
+
+def _bfs(seeds, inFlat, flatValues, offsets):
+    """Breadth-first distances from the seeds, spreading over flat cells of equal elevation.
+
+    seeds are flat indexes into the padded window. The whole frontier is
+    expanded at once, one ring per step. Returns the distances, 1 at the seeds
+    and 0 where unreached.
+    """
+    distance = np.zeros(inFlat.size, dtype=np.int64)
+    distance[seeds] = 1
+    frontier = seeds
+    step = 1
+    while frontier.size:
+        step += 1
+        reached = []
+        for offset in offsets:
+            neighbour = frontier + offset
+            spreads = inFlat[neighbour] & (distance[neighbour] == 0) & \
+                (flatValues[neighbour] == flatValues[frontier])
+            neighbour = neighbour[spreads]
+            # set before the next offset, so that every cell is reached once
+            distance[neighbour] = step
+            reached.append(neighbour)
+        frontier = np.concatenate(reached)
+    return distance
+
+
+def resolve_flats(filled, nodata):
+    """D8 directions of a filled window, with drainage across flats.
+
+    Cells with a lower valid neighbour flow to the lowest one, as in
+    analyse_window. Cells on flats flow along the gradient of Barnes et al. (2014):
+    towards the flat's outlets and away from the higher terrain around it. Cells
+    that drain off the window border or into nodata, and flats without any outlet,
+    get NO_DIRECTION.
+
+    Returns (directions, undrained): the uint8 codes and the valid cells that have
+    neither a direction nor a way off the window.
+    """
+    rows, cols = filled.shape
+    padded = np.pad(filled, 1)
+    paddedNodata = np.pad(nodata, 1, constant_values=True)
+    valid = ~nodata
+    neighbours = neighbour_stack(padded)
+    neighbourValid = ~neighbour_stack(paddedNodata)
+
+    directions, _, _, _ = analyse_window(padded, paddedNodata)
+    hasLower = (neighbourValid & (neighbours < filled)).any(axis=0)
+    drainsOff = _drains_off(nodata)
+    flat = valid & ~hasLower & ~drainsOff
+    directions[~hasLower] = NO_DIRECTION
+    if not flat.any():
+        return directions, np.zeros_like(flat)
+
+    sameNeighbour = neighbourValid & (neighbours == filled)
+    flatNeighbour = neighbour_stack(np.pad(flat, 1))
+    # Outlets of the flats: drained cells next to a flat cell of the same elevation.
+    lowEdges = valid & ~flat & (sameNeighbour & flatNeighbour).any(axis=0)
+    # Flat cells next to higher terrain.
+    highEdges = flat & (neighbourValid & (neighbours > filled)).any(axis=0)
+
+    _, offsets, width = _flat_layout(nodata)
+    offsets = np.array(offsets)
+    flatValues = padded.ravel()
+    inFlat = np.pad(flat, 1).ravel()
+
+    def flatIndexes(mask):
+        maskRows, maskCols = np.nonzero(mask)
+        return (maskRows + 1) * width + maskCols + 1
+
+    # Distance to the nearest outlet; outlets start at 1 so that 0 means unreached.
+    towardsArray = _bfs(flatIndexes(lowEdges), inFlat, flatValues, offsets).reshape(
+        rows + 2, width)[1:-1, 1:-1]
+    # Distance to the nearest higher terrain, and its maximum on each flat.
+    awayArray = _bfs(flatIndexes(highEdges), inFlat, flatValues, offsets).reshape(
+        rows + 2, width)[1:-1, 1:-1]
+    maxAway = _flat_maxima(flat, awayArray, sameNeighbour & flatNeighbour)
+
+    # Combined gradient: every step towards an outlet lowers it by at least one.
+    mask = np.full((rows, cols), np.inf)
+    mask[lowEdges] = 0
+    drainedFlat = flat & (towardsArray > 0)
+    mask[drainedFlat] = 2 * (towardsArray[drainedFlat] - 1) + \
+        np.where(awayArray[drainedFlat] > 0, maxAway[drainedFlat] - awayArray[drainedFlat], 0)
+
+    neighbourMask = np.where(sameNeighbour, neighbour_stack(np.pad(mask, 1, constant_values=np.inf)), np.inf)
+    lowestMask = neighbourMask.min(axis=0)
+    flows = drainedFlat & (lowestMask < mask)
+    flatDirections = D8_CODES[(neighbourMask == lowestMask).argmax(axis=0)]
+    directions[flows] = flatDirections[flows]
+    return directions, flat & ~flows
+
+
+def _flat_maxima(flat, away, flatLinks):
+    """Per flat cell, the largest away distance on its flat (connected cells of equal elevation).
+
+    flatLinks are the D8 neighbour planes linking flat cells of equal elevation.
+    The flats are labelled with the smallest cell number they hold, by hooking
+    labels across the links and pointer jumping until nothing changes.
+    """
+    rows, cols = flat.shape
+    cells = np.flatnonzero(flat)
+    number = np.zeros(rows * cols, dtype=np.int64)
+    number[cells] = np.arange(cells.size)
+    linkFrom = []
+    linkTo = []
+    for k, (dRow, dCol, _) in enumerate(D8_OFFSETS):
+        linked = np.flatnonzero(flatLinks[k])
+        linkFrom.append(number[linked])
+        linkTo.append(number[linked + dRow * cols + dCol])
+    linkFrom = np.concatenate(linkFrom)
+    linkTo = np.concatenate(linkTo)
+
+    labels = np.arange(cells.size)
+    while True:
+        hooked = labels.copy()
+        np.minimum.at(hooked, linkFrom, labels[linkTo])
+        np.minimum.at(hooked, labels[linkFrom], labels[linkTo])
+        while True:
+            jumped = hooked[hooked]
+            if np.array_equal(jumped, hooked):
+                break
+            hooked = jumped
+        if np.array_equal(hooked, labels):
+            break
+        labels = hooked
+
+    maxima = np.zeros(cells.size, dtype=away.dtype)
+    np.maximum.at(maxima, labels, away.ravel()[cells])
+    flatMaxima = np.zeros(rows * cols, dtype=away.dtype)
+    flatMaxima[cells] = maxima[labels]
+    return flatMaxima.reshape(rows, cols)
+
+
+def condition_window(values, nodata):
+    """Hydrologically condition a window: fill its depressions and resolve its flats.
+
+    Returns (filled, directions, sinks): the filled surface, its D8 directions
+    with drainage across flats and the cells still without any drainage.
+    """
+    filled = priority_flood(values, nodata)
+    directions, undrained = resolve_flats(filled, nodata)
+    return filled, directions, undrained
+
+
+# Light from the north-west, and the azimuths of the multidirectional hillshade.
+HILLSHADE_ALTITUDE = 45.0
+HILLSHADE_AZIMUTHS = (225.0, 270.0, 315.0, 360.0)
+
+
+def _filled_neighbours(values, nodata):
+    """Neighbour planes of a halo-padded window, nodata neighbours replaced by the center value."""
+    center = values[1:-1, 1:-1]
+    return np.where(neighbour_stack(nodata), center, neighbour_stack(values))
+
+
+def horn_gradient(values, nodata, xRes, yRes):
+    """Elevation gradient (dz/dx towards east, dz/dy towards north) of a halo-padded window.
+
+    Horn's 3x3 kernel; nodata neighbours count as the center value.
+    """
+    a, b, c, d, f, g, h, i = _filled_neighbours(values, nodata)
+    dzdx = ((c + 2 * f + i) - (a + 2 * d + g)) / (8 * xRes)
+    dzdy = ((a + 2 * b + c) - (g + 2 * h + i)) / (8 * yRes)
+    return dzdx, dzdy
+
+
+def slope(dzdx, dzdy):
+    """Slope in degrees."""
+    return np.degrees(np.arctan(np.hypot(dzdx, dzdy)))
+
+
+def aspect(dzdx, dzdy):
+    """Downslope direction in degrees clockwise from north, NaN on flat cells."""
+    result = np.degrees(np.arctan2(-dzdx, -dzdy)) % 360.0
+    result[(dzdx == 0) & (dzdy == 0)] = np.nan
+    return result
+
+
+def curvature(values, nodata, xRes, yRes):
+    """Curvature of a halo-padded window (Zevenbergen and Thorne), positive on convex cells."""
+    center = values[1:-1, 1:-1]
+    _, b, _, d, f, _, h, _ = _filled_neighbours(values, nodata)
+    alongX = ((d + f) / 2 - center) / (xRes * xRes)
+    alongY = ((b + h) / 2 - center) / (yRes * yRes)
+    return -2 * (alongX + alongY)
+
+
+def hillshade(dzdx, dzdy, azimuth, altitude=HILLSHADE_ALTITUDE):
+    """Illumination in [0, 1] from a light at azimuth degrees clockwise from north."""
+    azimuth = np.radians(azimuth)
+    altitude = np.radians(altitude)
+    lightX = np.cos(altitude) * np.sin(azimuth)
+    lightY = np.cos(altitude) * np.cos(azimuth)
+    shade = (np.sin(altitude) - dzdx * lightX - dzdy * lightY) / np.sqrt(1 + dzdx * dzdx + dzdy * dzdy)
+    return np.clip(shade, 0.0, 1.0)
+
+
+def multidirectional_hillshade(dzdx, dzdy, altitude=HILLSHADE_ALTITUDE):
+    """Hillshade lit from HILLSHADE_AZIMUTHS, weighted by the aspect (Mark, 1992).
+
+    Each light weighs sin^2(aspect - azimuth), so slopes are lit mostly from
+    across their own direction; the four weights always sum to 2.
+    """
+    aspectRadians = np.arctan2(-dzdx, -dzdy)
+    shade = np.zeros(dzdx.shape)
+    for azimuth in HILLSHADE_AZIMUTHS:
+        weight = np.sin(aspectRadians - np.radians(azimuth)) ** 2
+        shade += weight * hillshade(dzdx, dzdy, azimuth, altitude)
+    return shade / 2
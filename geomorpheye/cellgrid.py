@@ -0,0 +1,146 @@
+import numpy as np
+
+from .analysis import (aspect, curvature, horn_gradient, multidirectional_hillshade,
+                       slope, value_range)
+
+# Surfaces the local colormap can show, with their labels.
+SURFACES = {
+    "elevation": "elevation",
+    "fillDepth": "fill depth (needs conditioning)",
+    "accumulation": "flow accumulation (log)",
+    "slope": "slope",
+    "aspect": "aspect",
+    "curvature": "curvature",
+    "hillshade": "hillshade (multidirectional)",
+    "difference": "difference of the compared raster",
+}
+# Surfaces derived from the values with 3x3 kernels.
+TERRAIN_SURFACES = ("slope", "aspect", "curvature", "hillshade")
+
+
+class CellGrid():
+    """Columnar model of the cells GeomorphEye shows.
+
+    Only the grid origin (upper-left corner), the cell size and dense
+    (rows, cols) arrays are stored; world coordinates and the col/row in the
+    original raster are derived on demand. On an overview level every cell
+    covers factor x factor native cells and origCol/origRow refer to the
+    upper-left native one. fillDepth is only set when the directions come from
+    a hydrologically conditioned surface, accumulation when the flow
+    accumulation was asked for. paddedValues and paddedNodata are the values
+    and the mask with a one-cell halo, used for the terrain surfaces; without
+    them the cells outside the grid count as nodata. compared holds the
+    (values, nodata) of the compared rasters, on the same cells.
+    """
+
+    __slots__ = ("west", "north", "xRes", "yRes", "firstCol", "firstRow", "factor",
+                 "values", "nodata", "directions", "sinks", "fillDepth", "accumulation", "paddedValues", "paddedNodata", "elevMin", "elevMax",
+                 "compared", "_terrain")
+
+    def __init__(self, west, north, xRes, yRes, firstCol, firstRow, values, nodata,
+                 directions, sinks, factor=1, fillDepth=None, accumulation=None,
+                 paddedValues=None, paddedNodata=None, compared=None):
+        self.west = west
+        self.north = north
+        self.xRes = xRes
+        self.yRes = yRes
+        self.firstCol = firstCol
+        self.firstRow = firstRow
+        self.factor = factor
+        self.values = values
+        self.nodata = nodata
+        self.directions = directions
+        self.sinks = sinks
+        self.fillDepth = fillDepth
+        self.accumulation = accumulation
+        if paddedValues is None:
+            paddedValues = np.pad(values, 1)
+            paddedNodata = np.pad(nodata, 1, constant_values=True)
+        self.paddedValues = paddedValues
+        self.paddedNodata = paddedNodata
+        self.compared = compared or []
+        self._terrain = {}
+        self.elevMin, self.elevMax = value_range(values, nodata)
+
+    @property
+    def rows(self):
+        return self.values.shape[0]
+
+    @property
+    def cols(self):
+        return self.values.shape[1]
+
+    @property
+    def east(self):
+        return self.west + self.cols * self.xRes
+
+    @property
+    def south(self):
+        return self.north - self.rows * self.yRes
+
+    def validCells(self):
+        """(rows, cols) index arrays of the cells with data, in row-major order."""
+        return np.nonzero(~self.nodata)
+
+    def worldX(self, cols):
+        """World x of the centers of the given grid columns."""
+        return self.west + (np.asarray(cols) + 0.5) * self.xRes
+
+    def worldY(self, rows):
+        """World y of the centers of the given grid rows."""
+        return self.north - (np.asarray(rows) + 0.5) * self.yRes
+
+    def origCol(self, cols):
+        return (self.firstCol + np.asarray(cols)) * self.factor
+
+    def origRow(self, rows):
+        return (self.firstRow + np.asarray(rows)) * self.factor
+
+    def maskedValues(self):
+        """The values with NaN where there is no data."""
+        return np.where(self.nodata, np.nan, self.values)
+
+    def comparedValues(self, rows, cols):
+        """Values of every compared raster at the given cells, NaN where it has no data."""
+        return [np.where(nodata[rows, cols], np.nan, values[rows, cols]) for values, nodata in self.compared]
+
+    def surface(self, name):
+        """(values with NaN where there is no data, min, max) of a surface to colour.
+
+        name is one of SURFACES; surfaces that were not computed fall back to the
+        elevation.
+        """
+        if name == "fillDepth" and self.fillDepth is not None:
+            values = np.where(self.nodata, np.nan, self.fillDepth)
+            return (values,) + value_range(self.fillDepth, self.nodata)
+        if name == "accumulation" and self.accumulation is not None:
+            logAccumulation = np.log10(np.maximum(self.accumulation, 1))
+            values = np.where(self.nodata, np.nan, logAccumulation)
+            return (values,) + value_range(logAccumulation, self.nodata)
+        if name == "difference" and self.compared:
+            comparedValues, comparedNodata = self.compared[0]
+            nodata = self.nodata | comparedNodata
+            difference = comparedValues - self.values
+            return (np.where(nodata, np.nan, difference),) + value_range(difference, nodata)
+        if name in TERRAIN_SURFACES:
+            values = np.where(self.nodata, np.nan, self.terrain(name))
+            return (values,) + value_range(values, self.nodata | np.isnan(values))
+        return self.maskedValues(), self.elevMin, self.elevMax
+
+    def terrain(self, name):
+        """A terrain surface of TERRAIN_SURFACES, computed on first use from the halo-padded values."""
+        if name not in self._terrain:
+            if "gradient" not in self._terrain:
+                self._terrain["gradient"] = horn_gradient(
+                    self.paddedValues, self.paddedNodata, self.xRes, self.yRes)
+            dzdx, dzdy = self._terrain["gradient"]
+            if name == "slope":
+                surface = slope(dzdx, dzdy)
+            elif name == "aspect":
+                surface = aspect(dzdx, dzdy)
+            elif name == "curvature":
+                surface = curvature(self.paddedValues, self.paddedNodata, self.xRes, self.yRes)
+            else:
+                surface = multidirectional_hillshade(dzdx, dzdy)
+            self._terrain[name] = surface
+        return self._terrain[name]
@@ -0,0 +1,61 @@
+"""Colour lookup tables for the GeomorphEye local colormap."""
+import numpy as np
+
+LUT_SIZE = 256
+COLOR_ALPHA = 170
+
+# (ratio, (r, g, b)) stops of the default local colormap.
+DEFAULT_STOPS = [
+    (0.0, (0, 191, 191)),   # #00bfbf
+    (0.2, (0, 255, 0)),     # #00ff00
+    (0.4, (255, 255, 0)),   # #ffff00
+    (0.6, (255, 127, 0)),   # #ff7f00
+    (0.8, (191, 127, 63)),  # #bf7f3f
+    (1.0, (20, 21, 20)),    # #141514
+]
+# Black to white, for shaded relief.
+GREY_STOPS = [
+    (0.0, (0, 0, 0)),
+    (1.0, (255, 255, 255)),
+]
+
+
+def lut_from_stops(stops=DEFAULT_STOPS, alpha=COLOR_ALPHA):
+    """Compile (ratio, (r, g, b)) stops into a (LUT_SIZE, 4) RGBA uint8 table."""
+    lut = np.zeros((LUT_SIZE, 4), dtype=np.uint8)
+    for i in range(LUT_SIZE):
+        ratio = i / (LUT_SIZE - 1)
+        for (r1, c1), (r2, c2) in zip(stops[:-1], stops[1:]):
+            if r1 <= ratio <= r2:
+                # Interpolate between c1 and c2
+                t = (ratio - r1) / (r2 - r1)
+                lut[i, :3] = [int(a + (b - a) * t) for a, b in zip(c1, c2)]
+                break
+    lut[:, 3] = alpha
+    return lut
+
+
+def lut_from_color_ramp(ramp, alpha=COLOR_ALPHA):
+    """Sample a QgsColorRamp into a (LUT_SIZE, 4) RGBA uint8 table."""
+    lut = np.empty((LUT_SIZE, 4), dtype=np.uint8)
+    for i in range(LUT_SIZE):
+        color = ramp.color(i / (LUT_SIZE - 1))
+        lut[i] = (color.red(), color.green(), color.blue(), alpha)
+    return lut
+
+
+def apply_lut(values, vmin, vmax, lut):
+    """Map values to RGBA through the lut, stretched over [vmin, vmax].
+
+    NaN values become fully transparent. Returns a C-contiguous uint8 array of
+    shape values.shape + (4,).
+    """
+    valid = ~np.isnan(values)
+    if vmax == vmin:
+        ratios = np.full(values.shape, 0.5)
+    else:
+        ratios = (np.clip(np.where(valid, values, vmin), vmin, vmax) - vmin) / (vmax - vmin)
+    indexes = np.rint(ratios * (LUT_SIZE - 1)).astype(np.intp)
+    rgba = lut[indexes]
+    rgba[~valid] = 0
+    return np.ascontiguousarray(rgba)
@@ -0,0 +1,179 @@
+import os
+
+from qgis.PyQt.QtCore import QByteArray, QCoreApplication, QVariant
+from qgis.core import (Qgis, QgsFeature, QgsFeatureSink, QgsField, QgsFields, QgsGeometry,
+                       QgsPointXY, QgsProcessing, QgsProcessingAlgorithm, QgsProcessingException,
+                       QgsProcessingParameterBand, QgsProcessingParameterFeatureSink,
+                       QgsProcessingParameterNumber, QgsProcessingParameterRasterDestination,
+                       QgsProcessingParameterRasterLayer, QgsRasterBlock, QgsRasterFileWriter,
+                       QgsRectangle, QgsWkbTypes)
+
+from .exporttiles import (BYTE_NODATA, FLOAT_NODATA, analyse_export_tile, export_windows,
+                          parallel_map)
+from .geotransform import GeoTransform
+from .rasterreader import read_window_with_halo
+
+# Creation options of the exported GeoTIFFs.
+GEOTIFF_OPTIONS = ["TILED=YES", "COMPRESS=DEFLATE", "BIGTIFF=IF_SAFER"]
+
+
+class ExportAnalysisAlgorithm(QgsProcessingAlgorithm):
+    """Runs the GeomorphEye D8 analysis over a whole raster band and writes it out.
+
+    The raster is streamed in tiles (see exporttiles): read here, analysed in
+    worker threads, and written block by block into tiled GeoTIFFs, while
+    the sinks also go to a point layer.
+    """
+
+    INPUT = "INPUT"
+    BAND = "BAND"
+    # Parallel threads; the name is kept for the models and scripts that set it.
+    PROCESSES = "PROCESSES"
+    OUTPUT_DIRECTIONS = "OUTPUT_DIRECTIONS"
+    OUTPUT_SINKS = "OUTPUT_SINKS"
+    OUTPUT_SLOPE = "OUTPUT_SLOPE"
+    OUTPUT_SINK_POINTS = "OUTPUT_SINK_POINTS"
+
+    def tr(self, string):
+        return QCoreApplication.translate("ExportAnalysisAlgorithm", string)
+
+    def createInstance(self):
+        return ExportAnalysisAlgorithm()
+
+    def name(self):
+        return "exportanalysis"
+
+    def displayName(self):
+        return self.tr("Export D8 directions, sinks and slope")
+
+    def shortHelpString(self):
+        return self.tr(
+            "Computes the D8 steepest descent directions (1 = E, 2 = NE, 3 = N, ... 8 = SE, "
+            "0 = no valid neighbour), the sinks and the slope in degrees of a raster band, as "
+            "GeomorphEye shows them, and writes them to tiled GeoTIFFs. Every cell points to its "
+            "lowest valid neighbour, so sinks point to the one they would spill into; the sinks "
+            "output marks them. The sinks are also written as points.\n\n"
+            "The raster is processed in tiles with a one-cell overlap, in parallel, so memory "
+            "use does not depend on the raster size.")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterRasterLayer(self.INPUT, self.tr("Raster layer")))
+        self.addParameter(QgsProcessingParameterBand(self.BAND, self.tr("Band"), 1, self.INPUT))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.PROCESSES, self.tr("Parallel threads"), QgsProcessingParameterNumber.Integer,
+            max(1, (os.cpu_count() or 1) - 1), minValue=1))
+        self.addParameter(QgsProcessingParameterRasterDestination(
+            self.OUTPUT_DIRECTIONS, self.tr("D8 directions")))
+        self.addParameter(QgsProcessingParameterRasterDestination(
+            self.OUTPUT_SINKS, self.tr("Sinks"), optional=True, createByDefault=False))
+        self.addParameter(QgsProcessingParameterRasterDestination(
+            self.OUTPUT_SLOPE, self.tr("Slope"), optional=True))
+        self.addParameter(QgsProcessingParameterFeatureSink(
+            self.OUTPUT_SINK_POINTS, self.tr("Sink points"), QgsProcessing.TypeVectorPoint,
+            optional=True))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        """Take what the export needs from the layer, on the main thread.
+
+        The algorithm runs in a background thread while the layer may be read
+        elsewhere, e.g. by the GeomorphEye dialog, and providers must not be
+        shared between threads: the export reads through a clone of its own.
+        """
+        rasterLayer = self.parameterAsRasterLayer(parameters, self.INPUT, context)
+        if rasterLayer is None:
+            raise QgsProcessingException(self.invalidRasterError(parameters, self.INPUT))
+        self._provider = rasterLayer.dataProvider().clone()
+        self._extent = rasterLayer.extent()
+        self._cols = rasterLayer.width()
+        self._rows = rasterLayer.height()
+        self._xRes = rasterLayer.rasterUnitsPerPixelX()
+        self._yRes = rasterLayer.rasterUnitsPerPixelY()
+        self._crs = rasterLayer.crs()
+        return True
+
+    def processAlgorithm(self, parameters, context, feedback):
+        band = self.parameterAsInt(parameters, self.BAND, context)
+        threads = self.parameterAsInt(parameters, self.PROCESSES, context)
+
+        provider = self._provider
+        extent = self._extent
+        cols = self._cols
+        rows = self._rows
+        xRes = self._xRes
+        yRes = self._yRes
+        crs = self._crs
+        gridTransform = GeoTransform(extent.xMinimum(), extent.yMaximum(), xRes, yRes)
+
+        results = {}
+        # (output provider, result index, data type) of every raster to write.
+        writers = []
+        for outputKey, index, dataType, nodata in (
+                (self.OUTPUT_DIRECTIONS, 1, Qgis.Byte, BYTE_NODATA),
+                (self.OUTPUT_SINKS, 2, Qgis.Byte, BYTE_NODATA),
+                (self.OUTPUT_SLOPE, 3, Qgis.Float32, FLOAT_NODATA)):
+            path = self.parameterAsOutputLayer(parameters, outputKey, context)
+            if not path:
+                continue
+            writer = QgsRasterFileWriter(path)
+            writer.setOutputFormat("GTiff")
+            writer.setCreateOptions(GEOTIFF_OPTIONS)
+            outputProvider = writer.createOneBandRaster(dataType, cols, rows, extent, crs)
+            if outputProvider is None or not outputProvider.isValid():
+                raise QgsProcessingException(self.tr("Could not create {}").format(path))
+            outputProvider.setNoDataValue(1, nodata)
+            outputProvider.setEditable(True)
+            writers.append((outputProvider, index, dataType))
+            results[outputKey] = path
+
+        fields = QgsFields()
+        fields.append(QgsField("col", QVariant.Int))
+        fields.append(QgsField("row", QVariant.Int))
+        fields.append(QgsField("value", QVariant.Double))
+        sink, sinkId = self.parameterAsSink(parameters, self.OUTPUT_SINK_POINTS, context,
+                                            fields, QgsWkbTypes.Point, crs)
+        if sink is not None:
+            results[self.OUTPUT_SINK_POINTS] = sinkId
+
+        windows = list(export_windows(cols, rows))
+
+        def read_tiles():
+            for window in windows:
+                firstCol, firstRow, endCol, endRow = window
+                readExtent = QgsRectangle(*gridTransform.windowExtent(window))
+                values, nodata = read_window_with_halo(provider, band, readExtent, xRes, yRes,
+                                                       endCol - firstCol, endRow - firstRow)
+                yield window, values, nodata, xRes, yRes
+
+        feedback.pushInfo(self.tr("{} tiles in {} threads").format(len(windows), threads))
+        tiles = parallel_map(analyse_export_tile, read_tiles(), threads)
+        try:
+            for done, result in enumerate(tiles, 1):
+                if feedback.isCanceled():
+                    break
+                window = result[0]
+                firstCol, firstRow, endCol, endRow = window
+                for outputProvider, index, dataType in writers:
+                    array = result[index]
+                    block = QgsRasterBlock(dataType, endCol - firstCol, endRow - firstRow)
+                    block.setData(QByteArray(array.tobytes()))
+                    outputProvider.writeBlock(block, 1, firstCol, firstRow)
+                if sink is not None:
+                    self.addSinkPoints(sink, result[4], window, gridTransform)
+                feedback.setProgress(100.0 * done / len(windows))
+        finally:
+            tiles.close()
+            for outputProvider, _, _ in writers:
+                outputProvider.setEditable(False)
+        return results
+
+    def addSinkPoints(self, sink, sinkCells, window, gridTransform):
+        """Add a point, with its col, row and value, for every sink cell of a written window."""
+        firstCol, firstRow, _, _ = window
+        sinkRows, sinkCols, sinkValues = sinkCells
+        for row, col, value in zip((sinkRows + firstRow).tolist(), (sinkCols + firstCol).tolist(),
+                                   sinkValues.tolist()):
+            x, y = gridTransform.cellCenter(col, row)
+            feature = QgsFeature()
+            feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            feature.setAttributes([col, row, value])
+            sink.addFeature(feature, QgsFeatureSink.FastInsert)
@@ -0,0 +1,81 @@
+"""Qt-free tile engine of the GeomorphEye export.
+
+A raster is cut into EXPORT_TILE_SIZE windows, each read with a one-cell halo,
+so that its D8 directions, sinks and slope are exactly those of the whole
+raster. The windows are analysed in a pool of worker threads, a bounded
+number at a time, so memory does not grow with the raster size.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .analysis import analyse_window, horn_gradient, slope
+
+# Side, in cells, of the windows the export reads, analyses and writes.
+EXPORT_TILE_SIZE = 1024
+# Nodata of the exported rasters: Byte for directions and sinks, Float32 for slope.
+BYTE_NODATA = 255
+FLOAT_NODATA = -9999.0
+
+
+def export_windows(cols, rows, size=EXPORT_TILE_SIZE):
+    """(firstCol, firstRow, endCol, endRow) of the windows covering a cols x rows raster, row by row."""
+    for firstRow in range(0, rows, size):
+        for firstCol in range(0, cols, size):
+            yield firstCol, firstRow, min(firstCol + size, cols), min(firstRow + size, rows)
+
+
+def analyse_export_tile(window, paddedValues, paddedNodata, xRes, yRes):
+    """D8 directions, sinks and slope of one halo-padded window, ready to be written.
+
+    Returns (window, directions, sinks, slope, sinkCells): directions and
+    sinks as uint8, slope in degrees as float32, with BYTE_NODATA and
+    FLOAT_NODATA where the cell has no data, and the (rows, cols, values) of
+    the sinks within the window.
+    """
+    directions, sinks, _, _ = analyse_window(paddedValues, paddedNodata)
+    dzdx, dzdy = horn_gradient(paddedValues, paddedNodata, xRes, yRes)
+    nodata = paddedNodata[1:-1, 1:-1]
+    sinkRows, sinkCols = sinks.nonzero()
+    sinkCells = (sinkRows, sinkCols, paddedValues[sinkRows + 1, sinkCols + 1])
+    directions = np.where(nodata, BYTE_NODATA, directions).astype(np.uint8)
+    sinkCodes = np.where(nodata, BYTE_NODATA, sinks).astype(np.uint8)
+    slopeDegrees = np.where(nodata, FLOAT_NODATA, slope(dzdx, dzdy)).astype(np.float32)
+    return window, directions, sinkCodes, slopeDegrees, sinkCells
+
+
+def map_bounded(executor, function, items, maxPending):
+    """Results of function(*item) for the items, in order, with at most maxPending submitted at once.
+
+    The items are pulled lazily, so a generator of large arrays is only read
+    as fast as the results are consumed. Pending work is cancelled when the
+    caller stops iterating.
+    """
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(function, *item))
+            if len(pending) >= maxPending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def parallel_map(function, items, threads):
+    """map_bounded() over a pool of threads, in the calling thread if threads is 1.
+
+    Threads rather than processes: QGIS is multithreaded, so forking it is not
+    safe, and starting fresh interpreters needs a Python executable, which
+    sys.executable inside QGIS is not. numpy releases the GIL for most of the
+    analysis.
+    """
+    if threads <= 1:
+        for item in items:
+            yield function(*item)
+        return
+    with ThreadPoolExecutor(threads) as executor:
+        yield from map_bounded(executor, function, items, 2 * threads)
@@ -14,9 +14,9 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_Dialog(object):
     def setupUi(self, Dialog):
         Dialog.setObjectName("Dialog")
-        Dialog.resize(400, 530)
+        Dialog.resize(400, 722)
         self.buttonBox = QtWidgets.QDialogButtonBox(Dialog)
-        self.buttonBox.setGeometry(QtCore.QRect(50, 492, 341, 32))
+        self.buttonBox.setGeometry(QtCore.QRect(50, 684, 341, 32))
         self.buttonBox.setOrientation(QtCore.Qt.Horizontal)
         self.buttonBox.setStandardButtons(QtWidgets.QDialogButtonBox.Cancel|QtWidgets.QDialogButtonBox.Ok)
         self.buttonBox.setObjectName("buttonBox")
@@ -24,7 +24,7 @@ class Ui_Dialog(object):
         self.rasterLayerLabel.setGeometry(QtCore.QRect(20, 20, 91, 18))
         self.rasterLayerLabel.setObjectName("rasterLayerLabel")
         self.widget = QtWidgets.QWidget(Dialog)
-        self.widget.setGeometry(QtCore.QRect(100, 296, 260, 30))
+        self.widget.setGeometry(QtCore.QRect(100, 360, 260, 30))
         self.widget.setObjectName("widget")
         self.horizontalLayout_4 = QtWidgets.QHBoxLayout(self.widget)
         self.horizontalLayout_4.setContentsMargins(0, 0, 0, 0)
@@ -40,16 +40,16 @@ class Ui_Dialog(object):
         self.maxCellsLabel.setObjectName("maxCellsLabel")
         self.horizontalLayout_4.addWidget(self.maxCellsLabel)
         self.pushButtonLoad = QtWidgets.QPushButton(Dialog)
-        self.pushButtonLoad.setGeometry(QtCore.QRect(20, 330, 371, 34))
+        self.pushButtonLoad.setGeometry(QtCore.QRect(20, 522, 371, 34))
         self.pushButtonLoad.setCheckable(False)
         self.pushButtonLoad.setObjectName("pushButtonLoad")
         self.navigateSeparator = QtWidgets.QFrame(Dialog)
-        self.navigateSeparator.setGeometry(QtCore.QRect(20, 372, 371, 2))
+        self.navigateSeparator.setGeometry(QtCore.QRect(20, 564, 371, 2))
         self.navigateSeparator.setFrameShape(QtWidgets.QFrame.HLine)
         self.navigateSeparator.setFrameShadow(QtWidgets.QFrame.Sunken)
         self.navigateSeparator.setObjectName("navigateSeparator")
         self.widget1 = QtWidgets.QWidget(Dialog)
-        self.widget1.setGeometry(QtCore.QRect(20, 380, 371, 30))
+        self.widget1.setGeometry(QtCore.QRect(20, 572, 371, 30))
         self.widget1.setObjectName("widget1")
         self.horizontalLayout_navigate = QtWidgets.QHBoxLayout(self.widget1)
         self.horizontalLayout_navigate.setContentsMargins(0, 0, 0, 0)
@@ -69,31 +69,62 @@ class Ui_Dialog(object):
         self.rowSpinBox.setObjectName("rowSpinBox")
         self.horizontalLayout_navigate.addWidget(self.rowSpinBox)
         self.pushButtonZoomTo = QtWidgets.QPushButton(Dialog)
-        self.pushButtonZoomTo.setGeometry(QtCore.QRect(20, 416, 371, 34))
+        self.pushButtonZoomTo.setGeometry(QtCore.QRect(20, 608, 181, 34))
         self.pushButtonZoomTo.setObjectName("pushButtonZoomTo")
+        self.pushButtonInspect = QtWidgets.QPushButton(Dialog)
+        self.pushButtonInspect.setGeometry(QtCore.QRect(210, 608, 181, 34))
+        self.pushButtonInspect.setCheckable(True)
+        self.pushButtonInspect.setObjectName("pushButtonInspect")
         self.progressBar = QtWidgets.QProgressBar(Dialog)
-        self.progressBar.setGeometry(QtCore.QRect(20, 456, 371, 23))
+        self.progressBar.setGeometry(QtCore.QRect(20, 648, 371, 23))
         self.progressBar.setProperty("value", 24)
         self.progressBar.setObjectName("progressBar")
         self.rasterLayerCombobox = gui.QgsMapLayerComboBox(Dialog)
         self.rasterLayerCombobox.setGeometry(QtCore.QRect(90, 10, 301, 32))
         self.rasterLayerCombobox.setObjectName("rasterLayerCombobox")
+        self.widget7 = QtWidgets.QWidget(Dialog)
+        self.widget7.setGeometry(QtCore.QRect(20, 48, 371, 30))
+        self.widget7.setObjectName("widget7")
+        self.horizontalLayout_7 = QtWidgets.QHBoxLayout(self.widget7)
+        self.horizontalLayout_7.setContentsMargins(0, 0, 0, 0)
+        self.horizontalLayout_7.setObjectName("horizontalLayout_7")
+        self.bandLabel = QtWidgets.QLabel(self.widget7)
+        self.bandLabel.setObjectName("bandLabel")
+        self.horizontalLayout_7.addWidget(self.bandLabel)
+        self.bandCombobox = gui.QgsRasterBandComboBox(self.widget7)
+        self.bandCombobox.setObjectName("bandCombobox")
+        self.horizontalLayout_7.addWidget(self.bandCombobox)
+        self.widget8 = QtWidgets.QWidget(Dialog)
+        self.widget8.setGeometry(QtCore.QRect(20, 84, 371, 30))
+        self.widget8.setObjectName("widget8")
+        self.horizontalLayout_8 = QtWidgets.QHBoxLayout(self.widget8)
+        self.horizontalLayout_8.setContentsMargins(0, 0, 0, 0)
+        self.horizontalLayout_8.setObjectName("horizontalLayout_8")
+        self.compareLabel = QtWidgets.QLabel(self.widget8)
+        self.compareLabel.setObjectName("compareLabel")
+        self.horizontalLayout_8.addWidget(self.compareLabel)
+        self.compareLayerCombobox = gui.QgsMapLayerComboBox(self.widget8)
+        self.compareLayerCombobox.setObjectName("compareLayerCombobox")
+        self.horizontalLayout_8.addWidget(self.compareLayerCombobox)
+        self.compareBandCombobox = gui.QgsRasterBandComboBox(self.widget8)
+        self.compareBandCombobox.setObjectName("compareBandCombobox")
+        self.horizontalLayout_8.addWidget(self.compareBandCombobox)
         self.viewFlowCheckbox = QtWidgets.QCheckBox(Dialog)
-        self.viewFlowCheckbox.setGeometry(QtCore.QRect(30, 60, 250, 22))
+        self.viewFlowCheckbox.setGeometry(QtCore.QRect(30, 124, 250, 22))
         self.viewFlowCheckbox.setChecked(True)
         self.viewFlowCheckbox.setObjectName("viewFlowCheckbox")
         self.viewPitsCheckbox = QtWidgets.QCheckBox(Dialog)
-        self.viewPitsCheckbox.setGeometry(QtCore.QRect(30, 90, 171, 22))
+        self.viewPitsCheckbox.setGeometry(QtCore.QRect(30, 154, 171, 22))
         self.viewPitsCheckbox.setChecked(True)
         self.viewPitsCheckbox.setObjectName("viewPitsCheckbox")
         self.viewColorsCheckbox = QtWidgets.QCheckBox(Dialog)
-        self.viewColorsCheckbox.setGeometry(QtCore.QRect(30, 120, 250, 22))
+        self.viewColorsCheckbox.setGeometry(QtCore.QRect(30, 184, 250, 22))
         self.viewColorsCheckbox.setObjectName("viewColorsCheckbox")
         self.viewColRowCheckbox = QtWidgets.QCheckBox(Dialog)
-        self.viewColRowCheckbox.setGeometry(QtCore.QRect(100, 270, 253, 22))
+        self.viewColRowCheckbox.setGeometry(QtCore.QRect(100, 334, 253, 22))
         self.viewColRowCheckbox.setObjectName("viewColRowCheckbox")
         self.widget2 = QtWidgets.QWidget(Dialog)
-        self.widget2.setGeometry(QtCore.QRect(30, 190, 255, 34))
+        self.widget2.setGeometry(QtCore.QRect(30, 254, 255, 34))
         self.widget2.setObjectName("widget2")
         self.horizontalLayout = QtWidgets.QHBoxLayout(self.widget2)
         self.horizontalLayout.setContentsMargins(0, 0, 0, 0)
@@ -102,7 +133,7 @@ class Ui_Dialog(object):
         self.viewValuesCheckbox.setObjectName("viewValuesCheckbox")
         self.horizontalLayout.addWidget(self.viewValuesCheckbox)
         self.widget3 = QtWidgets.QWidget(Dialog)
-        self.widget3.setGeometry(QtCore.QRect(30, 150, 259, 30))
+        self.widget3.setGeometry(QtCore.QRect(30, 214, 259, 30))
         self.widget3.setObjectName("widget3")
         self.horizontalLayout_2 = QtWidgets.QHBoxLayout(self.widget3)
         self.horizontalLayout_2.setContentsMargins(0, 0, 0, 0)
@@ -114,7 +145,7 @@ class Ui_Dialog(object):
         self.cellBorderColorButton.setObjectName("cellBorderColorButton")
         self.horizontalLayout_2.addWidget(self.cellBorderColorButton)
         self.widget4 = QtWidgets.QWidget(Dialog)
-        self.widget4.setGeometry(QtCore.QRect(100, 230, 200, 34))
+        self.widget4.setGeometry(QtCore.QRect(100, 294, 200, 34))
         self.widget4.setObjectName("widget4")
         self.horizontalLayout_3 = QtWidgets.QHBoxLayout(self.widget4)
         self.horizontalLayout_3.setContentsMargins(0, 0, 0, 0)
@@ -125,6 +156,40 @@ class Ui_Dialog(object):
         self.fontSizeLabel = QtWidgets.QLabel(self.widget4)
         self.fontSizeLabel.setObjectName("fontSizeLabel")
         self.horizontalLayout_3.addWidget(self.fontSizeLabel)
+        self.conditionCheckbox = QtWidgets.QCheckBox(Dialog)
+        self.conditionCheckbox.setGeometry(QtCore.QRect(30, 396, 330, 22))
+        self.conditionCheckbox.setObjectName("conditionCheckbox")
+        self.widget5 = QtWidgets.QWidget(Dialog)
+        self.widget5.setGeometry(QtCore.QRect(30, 422, 330, 30))
+        self.widget5.setObjectName("widget5")
+        self.horizontalLayout_5 = QtWidgets.QHBoxLayout(self.widget5)
+        self.horizontalLayout_5.setContentsMargins(0, 0, 0, 0)
+        self.horizontalLayout_5.setObjectName("horizontalLayout_5")
+        self.colorSurfaceLabel = QtWidgets.QLabel(self.widget5)
+        self.colorSurfaceLabel.setObjectName("colorSurfaceLabel")
+        self.horizontalLayout_5.addWidget(self.colorSurfaceLabel)
+        self.colorSurfaceCombobox = QtWidgets.QComboBox(self.widget5)
+        self.colorSurfaceCombobox.setObjectName("colorSurfaceCombobox")
+        self.horizontalLayout_5.addWidget(self.colorSurfaceCombobox)
+        self.colorRampCombobox = QtWidgets.QComboBox(self.widget5)
+        self.colorRampCombobox.setObjectName("colorRampCombobox")
+        self.horizontalLayout_5.addWidget(self.colorRampCombobox)
+        self.viewAccumulationCheckbox = QtWidgets.QCheckBox(Dialog)
+        self.viewAccumulationCheckbox.setGeometry(QtCore.QRect(30, 456, 330, 22))
+        self.viewAccumulationCheckbox.setObjectName("viewAccumulationCheckbox")
+        self.widget6 = QtWidgets.QWidget(Dialog)
+        self.widget6.setGeometry(QtCore.QRect(30, 482, 330, 34))
+        self.widget6.setObjectName("widget6")
+        self.horizontalLayout_6 = QtWidgets.QHBoxLayout(self.widget6)
+        self.horizontalLayout_6.setContentsMargins(0, 0, 0, 0)
+        self.horizontalLayout_6.setObjectName("horizontalLayout_6")
+        self.pushButtonTrace = QtWidgets.QPushButton(self.widget6)
+        self.pushButtonTrace.setCheckable(True)
+        self.pushButtonTrace.setObjectName("pushButtonTrace")
+        self.horizontalLayout_6.addWidget(self.pushButtonTrace)
+        self.traceModeCombobox = QtWidgets.QComboBox(self.widget6)
+        self.traceModeCombobox.setObjectName("traceModeCombobox")
+        self.horizontalLayout_6.addWidget(self.traceModeCombobox)
 
         self.retranslateUi(Dialog)
         self.buttonBox.accepted.connect(Dialog.accept) # type: ignore
@@ -135,11 +200,16 @@ class Ui_Dialog(object):
         _translate = QtCore.QCoreApplication.translate
         Dialog.setWindowTitle(_translate("Dialog", "Dialog"))
         self.rasterLayerLabel.setText(_translate("Dialog", "Raster"))
+        self.bandLabel.setText(_translate("Dialog", "Band"))
+        self.compareLabel.setToolTip(_translate("Dialog", "A second raster or band on the same grid, for the difference colormap and the values"))
+        self.compareLabel.setText(_translate("Dialog", "Compare"))
         self.maxCellsLabel.setText(_translate("Dialog", "max cells to display"))
         self.pushButtonLoad.setText(_translate("Dialog", "Load On-Screen Raster Info"))
         self.colLabel.setText(_translate("Dialog", "Col:"))
         self.rowLabel.setText(_translate("Dialog", "Row:"))
         self.pushButtonZoomTo.setText(_translate("Dialog", "Zoom To Cell"))
+        self.pushButtonInspect.setToolTip(_translate("Dialog", "Show value, col/row, flow direction, slope and sink of the cell under the cursor"))
+        self.pushButtonInspect.setText(_translate("Dialog", "Inspect Cells"))
         self.viewFlowCheckbox.setText(_translate("Dialog", "view steepest direction"))
         self.viewPitsCheckbox.setText(_translate("Dialog", "view sinks"))
         self.viewColorsCheckbox.setText(_translate("Dialog", "view local colormap"))
@@ -147,4 +217,12 @@ class Ui_Dialog(object):
         self.viewValuesCheckbox.setText(_translate("Dialog", "view raster values"))
         self.viewBordersCheckbox.setText(_translate("Dialog", "view cell borders"))
         self.fontSizeLabel.setText(_translate("Dialog", "font size"))
+        self.conditionCheckbox.setToolTip(_translate("Dialog", "Fill depressions and resolve flats before computing the steepest directions"))
+        self.conditionCheckbox.setText(_translate("Dialog", "condition surface (fill pits, resolve flats)"))
+        self.colorSurfaceLabel.setText(_translate("Dialog", "colormap of"))
+        self.colorRampCombobox.setToolTip(_translate("Dialog", "Colour ramp of the local colormap, from the QGIS style manager"))
+        self.viewAccumulationCheckbox.setToolTip(_translate("Dialog", "Draw the steepest direction arrows wider the more cells drain through them"))
+        self.viewAccumulationCheckbox.setText(_translate("Dialog", "view flow accumulation"))
+        self.pushButtonTrace.setToolTip(_translate("Dialog", "Click a cell on the map to highlight where its water comes from or goes to"))
+        self.pushButtonTrace.setText(_translate("Dialog", "Trace Flow"))
 from qgis import gui
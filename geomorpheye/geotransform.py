@@ -0,0 +1,115 @@
+"""Grid arithmetic of north-up rasters: world <-> pixel, snapping and windows.
+
+Everything is O(1) closed-form arithmetic, with no stepping cell by cell, and
+free of QGIS. The plugins are zipped separately, so this canonical copy is
+copied into the plugins that use it by build_plugins.sh, which also runs the
+examples below as doctests:
+
+    python -m doctest shared/geotransform.py
+
+Windows are half-open cell ranges (firstCol, firstRow, endCol, endRow).
+
+>>> gt = GeoTransform(1000.0, 5000.0, 10.0, 10.0)
+>>> gt.toPixel(1025.0, 4975.0)
+(2.5, 2.5)
+>>> gt.cellOf(1025.0, 4975.0)
+(2, 2)
+>>> gt.cellCenter(2, 2)
+(1025.0, 4975.0)
+>>> gt.snapWindow(1012.0, 4951.0, 1030.0, 4990.0)
+(1, 1, 3, 5)
+>>> gt.windowExtent((1, 1, 3, 5))
+(1010.0, 4950.0, 1030.0, 4990.0)
+>>> clip_window(expand_window((1, 1, 3, 5), 2), 4, 4)
+(0, 0, 4, 4)
+>>> clip_window((-5, 3, 2, 9), 4, 4)
+(0, 3, 2, 4)
+>>> snap_extent(12.0, -7.0, 31.0, 40.0, 10.0)
+(10.0, -10.0, 40.0, 40.0)
+
+Coordinates a rounding error away from a grid line snap to that line:
+
+>>> GeoTransform(0.0, 0.0, 0.1, 0.1).snapWindow(0.30000000000000004, -0.7, 0.7, -0.29999999999999993)
+(3, 3, 7, 7)
+"""
+import math
+
+# Distance, in cells, under which a coordinate counts as lying on a grid line.
+SNAP_TOLERANCE = 1e-9
+
+
+def floor_cell(value):
+    """floor(value), but values within SNAP_TOLERANCE of an integer give that integer."""
+    nearest = round(value)
+    return int(nearest) if abs(value - nearest) < SNAP_TOLERANCE else math.floor(value)
+
+
+def ceil_cell(value):
+    """ceil(value), but values within SNAP_TOLERANCE of an integer give that integer."""
+    nearest = round(value)
+    return int(nearest) if abs(value - nearest) < SNAP_TOLERANCE else math.ceil(value)
+
+
+class GeoTransform():
+    """Affine transform of a north-up grid: upper-left corner (west, north) and cell size."""
+
+    __slots__ = ("west", "north", "xRes", "yRes")
+
+    def __init__(self, west, north, xRes, yRes):
+        self.west = west
+        self.north = north
+        self.xRes = xRes
+        self.yRes = yRes
+
+    def toPixel(self, x, y):
+        """Fractional (col, row) of a world point; cell centers are at .5."""
+        return (x - self.west) / self.xRes, (self.north - y) / self.yRes
+
+    def toWorld(self, col, row):
+        """World point of a fractional (col, row)."""
+        return self.west + col * self.xRes, self.north - row * self.yRes
+
+    def cellOf(self, x, y):
+        """(col, row) of the cell containing a world point; may be outside the grid."""
+        col, row = self.toPixel(x, y)
+        return math.floor(col), math.floor(row)
+
+    def cellCenter(self, col, row):
+        return self.toWorld(col + 0.5, row + 0.5)
+
+    def snapWindow(self, xMin, yMin, xMax, yMax):
+        """The window of the cells touched by an extent, snapped outwards to the grid lines."""
+        firstCol, firstRow = self.toPixel(xMin, yMax)
+        endCol, endRow = self.toPixel(xMax, yMin)
+        return floor_cell(firstCol), floor_cell(firstRow), ceil_cell(endCol), ceil_cell(endRow)
+
+    def windowExtent(self, window):
+        """(xMin, yMin, xMax, yMax) of a window."""
+        firstCol, firstRow, endCol, endRow = window
+        xMin, yMax = self.toWorld(firstCol, firstRow)
+        xMax, yMin = self.toWorld(endCol, endRow)
+        return xMin, yMin, xMax, yMax
+
+
+def clip_window(window, cols=None, rows=None):
+    """The window clipped to a grid of cols x rows cells; None leaves that side unbounded."""
+    firstCol, firstRow, endCol, endRow = window
+    firstCol = max(0, firstCol)
+    firstRow = max(0, firstRow)
+    if cols is not None:
+        endCol = min(cols, endCol)
+    if rows is not None:
+        endRow = min(rows, endRow)
+    return firstCol, firstRow, max(firstCol, endCol), max(firstRow, endRow)
+
+
+def expand_window(window, halo):
+    """The window grown by halo cells on every side."""
+    firstCol, firstRow, endCol, endRow = window
+    return firstCol - halo, firstRow - halo, endCol + halo, endRow + halo
+
+
+def snap_extent(xMin, yMin, xMax, yMax, xRes, yRes=None, originX=0.0, originY=0.0):
+    """Expand an extent so all four edges fall on the lines of a grid anchored at (originX, originY)."""
+    transform = GeoTransform(originX, originY, xRes, xRes if yRes is None else yRes)
+    return transform.windowExtent(transform.snapWindow(xMin, yMin, xMax, yMax))
@@ -0,0 +1,152 @@
+from qgis.PyQt.QtCore import QPoint
+from qgis.PyQt.QtGui import QCursor
+from qgis.PyQt.QtWidgets import QToolTip
+from qgis.core import QgsPointXY
+from qgis.gui import QgsMapTool
+
+from .analysis import horn_gradient, slope
+from .geotransform import GeoTransform
+from .rasterreader import TILE_SIZE, tile_key, tile_layer_key
+from .refreshworker import TileFetchWorker
+from .reprojection import transform_point
+
+# Compass names of the D8 direction codes of analysis.D8_OFFSETS.
+D8_NAMES = ("none", "E", "NE", "N", "NW", "W", "SW", "S", "SE")
+
+
+def inspect_cell(cells, row, col, xRes, yRes):
+    """(value, direction, sink, slope) of one cell of a Tile or a CellGrid, None where it has no data.
+
+    Both keep the values with a one-cell halo, so the slope comes from the
+    3x3 neighbourhood of the cell alone.
+    """
+    if cells.nodata[row, col]:
+        return None
+    neighbourhood = (slice(row, row + 3), slice(col, col + 3))
+    dzdx, dzdy = horn_gradient(cells.paddedValues[neighbourhood], cells.paddedNodata[neighbourhood],
+                               xRes, yRes)
+    return (cells.values[row, col].item(), int(cells.directions[row, col]),
+            bool(cells.sinks[row, col]), float(slope(dzdx, dzdy)[0, 0]))
+
+
+class CellInspectorTool(QgsMapTool):
+    """Map tool showing value, col/row, D8 direction, slope and sink of the cell under the cursor.
+
+    Every mouse move is answered from memory: from the cells of the overlay,
+    when they are native cells covering the cursor, or else from the native
+    tile in the tile cache, both by index. Tiles that are not cached yet are
+    read by a TileFetchWorker, one at a time, always the one last hovered;
+    the cell is shown once its tile arrives.
+    """
+
+    def __init__(self, canvas, tileCache):
+        super().__init__(canvas)
+        self._tileCache = tileCache
+        self._rasterLayer = None
+        self._band = 1
+        self._layerKey = None
+        self._gridTransform = None
+        self._grid = None
+        self._lastPoint = None
+        self._worker = None
+        self._wantedTile = None
+
+    def setLayer(self, rasterLayer, band=1):
+        self._rasterLayer = rasterLayer
+        self._band = band
+        self._layerKey = None
+        self._gridTransform = None
+        self._wantedTile = None
+        if rasterLayer is not None:
+            self._layerKey = tile_layer_key(rasterLayer, band)
+            extent = rasterLayer.extent()
+            self._gridTransform = GeoTransform(extent.xMinimum(), extent.yMaximum(),
+                                               rasterLayer.rasterUnitsPerPixelX(),
+                                               rasterLayer.rasterUnitsPerPixelY())
+
+    def setGrid(self, grid):
+        """The CellGrid the overlay shows, None when there is no overlay."""
+        self._grid = grid
+
+    def stop(self, wait=False):
+        if self._worker is not None:
+            self._worker.stop()
+            if wait:
+                self._worker.wait()
+
+    def canvasMoveEvent(self, e):
+        self._lastPoint = self.toMapCoordinates(e.pos())
+        self.showCell(e.globalPos())
+
+    def deactivate(self):
+        QToolTip.hideText()
+        self._lastPoint = None
+        self._wantedTile = None
+        super().deactivate()
+
+    def showCell(self, globalPos):
+        text = self.inspect(self._lastPoint) if self._lastPoint is not None else None
+        if text is None:
+            QToolTip.hideText()
+        else:
+            QToolTip.showText(globalPos + QPoint(16, 16), text, self.canvas())
+
+    def inspect(self, mapPoint:QgsPointXY):
+        """Text describing the cell at a map point, None outside the raster."""
+        if self._rasterLayer is None:
+            return None
+        point = transform_point(mapPoint, self.canvas().mapSettings().destinationCrs(),
+                                self._rasterLayer.crs())
+        if point is None:
+            return None
+        col, row = self._gridTransform.cellOf(point.x(), point.y())
+        if not (0 <= col < self._rasterLayer.width() and 0 <= row < self._rasterLayer.height()):
+            return None
+
+        header = f"c: {col}\nr: {row}"
+        cell = self._inspectGrid(col, row)
+        if cell is None:
+            tileRow, tileCol = row // TILE_SIZE, col // TILE_SIZE
+            tile = self._tileCache.peek(tile_key(self._layerKey, 0, tileRow, tileCol))
+            if tile is None:
+                self._fetch(tileRow, tileCol)
+                return f"{header}\nloading..."
+            cell = ("tile", inspect_cell(tile, row % TILE_SIZE, col % TILE_SIZE,
+                                         self._gridTransform.xRes, self._gridTransform.yRes))
+        source, values = cell
+        if values is None:
+            return f"{header}\nno data"
+        value, direction, sink, slopeDegrees = values
+        conditioned = " (conditioned)" if source == "grid" and self._grid.fillDepth is not None else ""
+        return (f"{header}\nv: {value}\nflow: {D8_NAMES[direction]}{conditioned}\n"
+                f"slope: {slopeDegrees:.1f}°\nsink: {'yes' if sink else 'no'}")
+
+    def _inspectGrid(self, col, row):
+        """("grid", cell values) from the overlay cells, None if they do not hold the native cell."""
+        grid = self._grid
+        if grid is None or grid.factor != 1:
+            return None
+        gridRow = row - grid.firstRow
+        gridCol = col - grid.firstCol
+        if not (0 <= gridRow < grid.rows and 0 <= gridCol < grid.cols):
+            return None
+        return "grid", inspect_cell(grid, gridRow, gridCol, grid.xRes, grid.yRes)
+
+    def _fetch(self, tileRow, tileCol):
+        self._wantedTile = (tileRow, tileCol)
+        if self._worker is not None:
+            return  # started when the running fetch is done
+        self._worker = TileFetchWorker(self._rasterLayer, self._tileCache, tileRow, tileCol, self._band)
+        self._worker.finished.connect(self._on_fetch_done)
+        self._worker.start()
+
+    def _on_fetch_done(self):
+        worker = self._worker
+        self._worker = None
+        worker.deleteLater()
+        wantedTile = self._wantedTile
+        self._wantedTile = None
+        if wantedTile is not None and self.isActive():
+            if wantedTile != (worker.tileRow, worker.tileCol):
+                self._fetch(*wantedTile)
+            self.showCell(QCursor.pos())
@@ -0,0 +1,99 @@
+import math
+
+from PyQt5.QtCore import QPointF, Qt
+from PyQt5.QtGui import QColor, QFont, QFontMetricsF, QImage, QPainter, QPen
+
+
+class Glyph():
+    """One character pre-rendered twice: its halo and its text, on images of the same size."""
+
+    __slots__ = ("halo", "text", "advance")
+
+    def __init__(self, halo, text, advance):
+        self.halo = halo
+        self.text = text
+        self.advance = advance
+
+
+class LabelCache():
+    """Pre-rendered haloed glyphs, cached by (character, font size, pixel ratio).
+
+    Labels are drawn from the glyphs of their characters, so the few
+    characters of the numbers (digits, sign, point) serve every value, also
+    on float DEMs where hardly any two labels are the same. Each glyph is
+    drawn once into two small transparent images, its halo (eight offsets)
+    and its text; a label is then two image blits per character, all halos
+    first so that no halo covers a neighbouring glyph.
+    """
+
+    def __init__(self, textColorHex, haloColorHex):
+        self.textColorHex = textColorHex
+        self.haloColorHex = haloColorHex
+        self._glyphs = {}
+        self._fonts = {}
+
+    def font(self, fontSize):
+        if fontSize not in self._fonts:
+            font = QFont("Arial", fontSize)
+            self._fonts[fontSize] = (font, QFontMetricsF(font))
+        return self._fonts[fontSize][0]
+
+    def metrics(self, fontSize):
+        self.font(fontSize)
+        return self._fonts[fontSize][1]
+
+    def textWidth(self, text, fontSize):
+        """Logical width of the (multi-line) text, without rendering it."""
+        metrics = self.metrics(fontSize)
+        return max(metrics.horizontalAdvance(line) for line in text.split("\n"))
+
+    def glyph(self, char, fontSize, devicePixelRatio):
+        key = (char, fontSize, devicePixelRatio)
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            glyph = self._glyphs[key] = self._render(char, fontSize, devicePixelRatio)
+        return glyph
+
+    def drawLabel(self, painter, centerX, centerY, text, fontSize, devicePixelRatio):
+        """Draw the (multi-line) text centered on a point, each line centered too."""
+        lineHeight = self.metrics(fontSize).height()
+        lines = [[self.glyph(char, fontSize, devicePixelRatio) for char in line] for line in text.split("\n")]
+        top = centerY - len(lines) * lineHeight / 2
+        for layer in ("halo", "text"):
+            for i, glyphs in enumerate(lines):
+                x = centerX - sum(glyph.advance for glyph in glyphs) / 2
+                y = top + i * lineHeight
+                for glyph in glyphs:
+                    # the glyph images start one pixel of halo up and left of the glyph
+                    painter.drawImage(QPointF(x - 1, y - 1), getattr(glyph, layer))
+                    x += glyph.advance
+
+    def clear(self):
+        self._glyphs.clear()
+
+    def _render(self, char, fontSize, devicePixelRatio):
+        font = self.font(fontSize)
+        metrics = self.metrics(fontSize)
+        advance = metrics.horizontalAdvance(char)
+        # one pixel of halo on every side
+        width = math.ceil(max(advance, metrics.boundingRect(char).right())) + 2
+        height = math.ceil(metrics.height()) + 2
+        baseline = QPointF(1, 1 + metrics.ascent())
+
+        images = []
+        for color, offsets in ((self.haloColorHex, [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                                                    if dx or dy]),
+                               (self.textColorHex, [(0, 0)])):
+            image = QImage(math.ceil(width * devicePixelRatio), math.ceil(height * devicePixelRatio),
+                           QImage.Format_ARGB32_Premultiplied)
+            image.setDevicePixelRatio(devicePixelRatio)
+            image.fill(Qt.transparent)
+            painter = QPainter(image)
+            painter.setRenderHint(QPainter.TextAntialiasing)
+            painter.setFont(font)
+            painter.setPen(QPen(QColor(color), 1))
+            for dx, dy in offsets:
+                painter.drawText(baseline + QPointF(dx, dy), char)
+            painter.end()
+            images.append(image)
+        return Glyph(images[0], images[1], advance)
@@ -0,0 +1,43 @@
+from collections import deque
+
+
+class PanTracker():
+    """Estimates pan direction and velocity from successive canvas extents.
+
+    Samples are (time, centerX, centerY, width); a change of width means a zoom,
+    which restarts the tracking. Velocities are in map units per second.
+    """
+
+    def __init__(self, maxSamples=5, maxAge=1.5):
+        self.maxAge = maxAge
+        self._samples = deque(maxlen=maxSamples)
+
+    def addSample(self, time, centerX, centerY, width):
+        if self._samples and abs(self._samples[-1][3] - width) > 1e-9 * max(width, 1.0):
+            self._samples.clear()
+        self._samples.append((time, centerX, centerY, width))
+
+    def reset(self):
+        self._samples.clear()
+
+    def velocity(self, now):
+        """(vx, vy) over the recent samples, (0, 0) if not panning."""
+        recent = [s for s in self._samples if now - s[0] <= self.maxAge]
+        if len(recent) < 2:
+            return 0.0, 0.0
+        t0, x0, y0, _ = recent[0]
+        t1, x1, y1, _ = recent[-1]
+        if t1 <= t0:
+            return 0.0, 0.0
+        return (x1 - x0) / (t1 - t0), (y1 - y0) / (t1 - t0)
+
+    def predictOffset(self, now, lookahead, maxDistance):
+        """Where the view is heading: (dx, dy) after lookahead seconds, capped at maxDistance."""
+        vx, vy = self.velocity(now)
+        dx = vx * lookahead
+        dy = vy * lookahead
+        distance = (dx * dx + dy * dy) ** 0.5
+        if distance > maxDistance:
+            dx *= maxDistance / distance
+            dy *= maxDistance / distance
+        return dx, dy
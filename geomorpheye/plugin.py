@@ -1,13 +1,35 @@
 from qgis.PyQt.QtWidgets import QDialog, QAction
-from qgis.core import QgsProject, QgsRasterLayer, QgsCoordinateTransform, \
-    QgsMapLayerType, QgsRectangle, QgsPointXY
+from qgis.core import QgsApplication, QgsProject, QgsRasterLayer, QgsCoordinateTransform, \
+    QgsMapLayerType, QgsRectangle, QgsPointXY, QgsStyle
 from qgis.PyQt.QtCore import QSettings, Qt, QTimer
 from PyQt5.QtGui import QColor
+from qgis.gui import QgsMapToolEmitPoint
 from qgis.utils import iface
 from .geomorpheye_dialog import Ui_Dialog
 from .ui import IconGeomorphEye
-from .rasteroverlay import RasterOverlay
+from .rasteroverlay import RasterOverlay, TRACE_DOWNSTREAM, TRACE_UPSTREAM
+from .rasterreader import same_grid
+from .tilecache import TileCache
+from .cellgrid import SURFACES
+from .refreshworker import OverlayRefreshWorker, TilePrefetchWorker
+from .reprojection import transform_extent, transform_point
+from .profiling import profiler
+from .geotransform import GeoTransform
+from .pantracker import PanTracker
+from .inspecttool import CellInspectorTool
+from .processingprovider import GeomorphEyeProcessingProvider
 from qgis.PyQt import sip
+from functools import partial
+import time
+
+# Debounce of the overlay refresh after the extent changed, in ms; short since
+# most refreshes are served from the tile cache.
+REFRESH_DELAY_MS = 50
+# How far ahead, in seconds, tiles are prefetched along the pan direction.
+PREFETCH_LOOKAHEAD = 1.0
+# Interval, in ms, of the prefetch while panning; throttled, not debounced, so
+# that the prefetch runs during the pan.
+PREFETCH_INTERVAL_MS = 150
 
 
 class GeomorphEyePlugin():
@@ -20,6 +42,8 @@ class GeomorphEyePlugin():
         self.iface.addPluginToMenu("&G-ANT", self.action)
         self.iface.addToolBarIcon(self.action)
         self.dialog = None
+        self.processingProvider = GeomorphEyeProcessingProvider()
+        QgsApplication.processingRegistry().addProvider(self.processingProvider)
 
     def unload(self):
         if self.dialog:
@@ -28,6 +52,7 @@ class GeomorphEyePlugin():
             self.dialog = None
         self.iface.removePluginMenu("&G-ANT", self.action)
         self.iface.removeToolBarIcon(self.action)
+        QgsApplication.processingRegistry().removeProvider(self.processingProvider)
 
     def run(self):
         if not self.dialog:
@@ -41,10 +66,19 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
         self.iface = iface
         self.rasterOverlayItem = None
         self._currentRasterLayer = None
+        self._loadingLayer = None  # read in the background, the overlay is not shown yet
+        self._loadingExtent = None  # the canvas extent it is read for
+        self._refreshGeneration = 0
+        self._refreshWorkers = []
+        self._prefetchWorkers = []
+        self._panTracker = PanTracker()
 
         self._refreshTimer = QTimer()
         self._refreshTimer.setSingleShot(True)
         self._refreshTimer.timeout.connect(self._refresh_overlay)
+        self._prefetchTimer = QTimer()
+        self._prefetchTimer.setSingleShot(True)
+        self._prefetchTimer.timeout.connect(self._start_prefetch)
 
         self.setupUi(self)
         self.setWindowTitle("GeomorphEye")
@@ -57,10 +91,26 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
         viewColRow  = self.isTrue(settings.value("GeomorphEye/viewColRow", False))
         viewBorders = self.isTrue(settings.value("GeomorphEye/viewBorders", True))
         viewColors  = self.isTrue(settings.value("GeomorphEye/viewColors", False))
+        condition   = self.isTrue(settings.value("GeomorphEye/condition", False))
+        viewAccumulation = self.isTrue(settings.value("GeomorphEye/viewAccumulation", False))
+        colorSurface    = settings.value("GeomorphEye/colorSurface", "elevation")
+        colorRamp       = settings.value("GeomorphEye/colorRamp", "")
         fontSize        = int(settings.value("GeomorphEye/fontSize", 14))
         cellBorderColor = settings.value("GeomorphEye/cellBorderColor", "#000000")
         maxCells        = int(settings.value("GeomorphEye/maxCells", 10000))
 
+        # Stage timings, off unless enabled in the settings.
+        profiler.configure(
+            self.isTrue(settings.value("GeomorphEye/profiling", False)),
+            settings.value("GeomorphEye/profilingLogLevel", "none"),
+            int(settings.value("GeomorphEye/profilingBufferSize", 1000)),
+        )
+
+        # Analysed tiles, shared by all refreshes; invalidated on data changes.
+        self._tileCache = TileCache(self._tile_cache_bytes())
+        self._watchedLayers = {}
+        QgsProject.instance().layersWillBeRemoved.connect(self._on_layers_will_be_removed)
+
         self.viewFlowCheckbox.setChecked(viewFlow)
         self.viewPitsCheckbox.setChecked(viewPit)
         self.viewValuesCheckbox.setChecked(viewValues)
@@ -70,6 +120,20 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
         self.fontSizeSpinBox.setValue(fontSize)
         self.cellBorderColorButton.setColor(QColor(cellBorderColor))
         self.maxCellsSpinBox.setValue(maxCells)
+        self.conditionCheckbox.setChecked(condition)
+        for surface, label in SURFACES.items():
+            self.colorSurfaceCombobox.addItem(label, surface)
+        self.colorSurfaceCombobox.setCurrentIndex(max(0, self.colorSurfaceCombobox.findData(colorSurface)))
+        # the ramps of the QGIS style manager, after the built-in default
+        self.colorRampCombobox.addItem("default", "")
+        for rampName in sorted(QgsStyle.defaultStyle().colorRampNames(), key=str.casefold):
+            self.colorRampCombobox.addItem(rampName, rampName)
+        self.colorRampCombobox.setCurrentIndex(max(0, self.colorRampCombobox.findData(colorRamp)))
+        self.viewAccumulationCheckbox.setChecked(viewAccumulation)
+        self.traceModeCombobox.addItem("upstream catchment", TRACE_UPSTREAM)
+        self.traceModeCombobox.addItem("downstream path", TRACE_DOWNSTREAM)
+        self._traceTool = None
+        self._inspectTool = None
 
         self.viewFlowCheckbox.toggled.connect(self.on_checkbox_changed)
         self.viewPitsCheckbox.toggled.connect(self.on_checkbox_changed)
@@ -80,9 +144,23 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
         self.fontSizeSpinBox.valueChanged.connect(self.on_fontsize_changed)
         self.cellBorderColorButton.colorChanged.connect(self.on_color_changed)
         self.maxCellsSpinBox.valueChanged.connect(self.on_maxcells_changed)
+        self.conditionCheckbox.toggled.connect(self.on_condition_changed)
+        self.colorSurfaceCombobox.currentIndexChanged.connect(self.on_color_surface_changed)
+        self.colorRampCombobox.currentIndexChanged.connect(self.on_color_ramp_changed)
+        self.viewAccumulationCheckbox.toggled.connect(self.on_accumulation_changed)
+        self.pushButtonTrace.toggled.connect(self.on_trace_toggled)
+        self.pushButtonInspect.toggled.connect(self.on_inspect_toggled)
 
         self.rasterLayerCombobox.setFilters(QgsMapLayerType.Raster)
         self.rasterLayerCombobox.layerChanged.connect(self._on_layer_changed)
+        self.bandCombobox.setLayer(self.rasterLayerCombobox.currentLayer())
+        self.bandCombobox.bandChanged.connect(self.on_band_changed)
+        self.compareLayerCombobox.setFilters(QgsMapLayerType.Raster)
+        self.compareLayerCombobox.setAllowEmptyLayer(True)
+        self.compareLayerCombobox.setLayer(None)
+        self.compareBandCombobox.setLayer(None)
+        self.compareLayerCombobox.layerChanged.connect(self.on_compare_layer_changed)
+        self.compareBandCombobox.bandChanged.connect(self.on_band_changed)
         self.pushButtonLoad.clicked.connect(self.load_raster_info)
         self.pushButtonZoomTo.clicked.connect(self.zoom_to_cell)
         self.buttonBox.accepted.connect(self.on_accept)
@@ -116,10 +194,29 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
 
     def unload(self):
         self.cleanup_overlay()
+        self.pushButtonInspect.setChecked(False)
+        if self._inspectTool is not None:
+            self._inspectTool.stop(wait=True)
+        QgsProject.instance().layersWillBeRemoved.disconnect(self._on_layers_will_be_removed)
+        for layerId in list(self._watchedLayers):
+            self._unwatch_layer(layerId)
+        self._tileCache.clear()
 
     def cleanup_overlay(self):
+        self.pushButtonTrace.setChecked(False)
+        if self._loadingLayer is not None:
+            # the load still reading is outdated: its overlay is not to be shown
+            self._loadingLayer = None
+            self._refreshGeneration += 1
+            self._cancel_refresh_workers(wait=True)
+            self.reset_ui()
         if self.rasterOverlayItem:
             self._refreshTimer.stop()
+            self._prefetchTimer.stop()
+            self._refreshGeneration += 1
+            self._cancel_refresh_workers(wait=True)
+            self._cancel_prefetch_workers(wait=True)
+            self._panTracker.reset()
             canvas = self.iface.mapCanvas()
             try:
                 canvas.extentsChanged.disconnect(self._on_canvas_extent_changed)
@@ -129,6 +226,7 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
             sip.delete(self.rasterOverlayItem)
             self.rasterOverlayItem = None
             self._currentRasterLayer = None
+            self._update_inspect_tool()
 
     # ------------------------------------------------------------------ #
     #  Settings callbacks                                                  #
@@ -164,6 +262,117 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
         if self.rasterOverlayItem:
             self.rasterOverlayItem.setBorderColor(self.cellBorderColorButton.color().name())
 
+    def on_condition_changed(self):
+        QSettings().setValue("GeomorphEye/condition", self.conditionCheckbox.isChecked())
+        if self.rasterOverlayItem:
+            # directions depend on it: read the view again
+            self._refreshGeneration += 1
+            self.rasterOverlayItem.clearRanges()
+            self._refresh_overlay()
+        else:
+            self._reload_if_loading()
+
+    def on_color_surface_changed(self):
+        surface = self.colorSurfaceCombobox.currentData()
+        QSettings().setValue("GeomorphEye/colorSurface", surface)
+        if self.rasterOverlayItem:
+            self.rasterOverlayItem.setColorSurface(surface)
+            self._refresh_if_missing_accumulation()
+        else:
+            self._reload_if_loading()
+
+    def on_color_ramp_changed(self):
+        rampName = self.colorRampCombobox.currentData()
+        QSettings().setValue("GeomorphEye/colorRamp", rampName)
+        if self.rasterOverlayItem:
+            self.rasterOverlayItem.setColorRamp(rampName)
+
+    def on_accumulation_changed(self):
+        QSettings().setValue("GeomorphEye/viewAccumulation", self.viewAccumulationCheckbox.isChecked())
+        if self.rasterOverlayItem:
+            self.rasterOverlayItem.setDrawAccumulation(self.viewAccumulationCheckbox.isChecked())
+            self._refresh_if_missing_accumulation()
+        else:
+            self._reload_if_loading()
+
+    def on_band_changed(self):
+        self._update_inspect_tool()
+        if self.rasterOverlayItem:
+            # another band is other data: read the view again
+            self._refreshGeneration += 1
+            self.rasterOverlayItem.clearRanges()
+            self._refresh_overlay()
+        else:
+            self._reload_if_loading()
+
+    def on_compare_layer_changed(self, layer):
+        self.compareBandCombobox.setLayer(layer)
+        if layer is not None:
+            self._watch_layer(layer)
+            rasterLayer = self.rasterLayerCombobox.currentLayer()
+            if isinstance(rasterLayer, QgsRasterLayer) and not same_grid(rasterLayer, layer):
+                iface.messageBar().pushWarning(
+                    "Different Grid", f"{layer.name()} is not on the grid of {rasterLayer.name()}, "
+                    "it cannot be compared cell by cell.")
+        self.on_band_changed()
+
+    def _needs_accumulation(self):
+        return self.viewAccumulationCheckbox.isChecked() or \
+            self.colorSurfaceCombobox.currentData() == "accumulation"
+
+    def _reload_if_loading(self):
+        """Start a load still reading again, since it was read with a previous setting."""
+        if self._loadingLayer is not None:
+            self.cleanup_overlay()
+            self.load_raster_info()
+
+    def _refresh_if_missing_accumulation(self):
+        if self._needs_accumulation() and self.rasterOverlayItem.grid.accumulation is None:
+            self._refreshGeneration += 1
+            self._refresh_overlay()
+
+    def on_trace_toggled(self, checked):
+        canvas = self.iface.mapCanvas()
+        if checked:
+            if self._traceTool is None:
+                self._traceTool = QgsMapToolEmitPoint(canvas)
+                self._traceTool.canvasClicked.connect(self._on_trace_clicked)
+                self._traceTool.deactivated.connect(partial(self.pushButtonTrace.setChecked, False))
+            canvas.setMapTool(self._traceTool)
+            return
+        if self._traceTool is not None and canvas.mapTool() is self._traceTool:
+            canvas.unsetMapTool(self._traceTool)
+        if self.rasterOverlayItem:
+            self.rasterOverlayItem.clearTrace()
+
+    def on_inspect_toggled(self, checked):
+        canvas = self.iface.mapCanvas()
+        if checked:
+            if self._inspectTool is None:
+                self._inspectTool = CellInspectorTool(canvas, self._tileCache)
+                self._inspectTool.deactivated.connect(partial(self.pushButtonInspect.setChecked, False))
+            self._update_inspect_tool()
+            canvas.setMapTool(self._inspectTool)
+            return
+        if self._inspectTool is not None and canvas.mapTool() is self._inspectTool:
+            canvas.unsetMapTool(self._inspectTool)
+
+    def _update_inspect_tool(self):
+        """Point the cell inspector at the selected layer and band, and at the overlay cells."""
+        if self._inspectTool is None:
+            return
+        rasterLayer = self.rasterLayerCombobox.currentLayer()
+        if not isinstance(rasterLayer, QgsRasterLayer):
+            rasterLayer = None
+        self._inspectTool.setLayer(rasterLayer, self._band())
+        self._inspectTool.setGrid(self.rasterOverlayItem.grid if self.rasterOverlayItem else None)
+
+    def _on_trace_clicked(self, point, button):
+        if self.rasterOverlayItem:
+            point = transform_point(point, self._canvas_crs(), self._currentRasterLayer.crs())
+            if point is not None:
+                self.rasterOverlayItem.setTrace(point, self.traceModeCombobox.currentData())
+
     def on_maxcells_changed(self):
         settings = QSettings()
         settings.setValue("GeomorphEye/maxCells", self.maxCellsSpinBox.value())
@@ -176,164 +385,226 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
         col = self.colSpinBox.value()
         row = self.rowSpinBox.value()
         rasterExtent = rasterLayer.extent()
-        xRes = rasterLayer.rasterUnitsPerPixelX()
-        yRes = rasterLayer.rasterUnitsPerPixelY()
-        worldX = rasterExtent.xMinimum() + (col + 0.5) * xRes
-        worldY = rasterExtent.yMaximum() - (row + 0.5) * yRes
+        gridTransform = GeoTransform(rasterExtent.xMinimum(), rasterExtent.yMaximum(),
+                                     rasterLayer.rasterUnitsPerPixelX(), rasterLayer.rasterUnitsPerPixelY())
+        center = transform_point(QgsPointXY(*gridTransform.cellCenter(col, row)),
+                                 rasterLayer.crs(), self._canvas_crs())
+        if center is None:
+            iface.messageBar().pushWarning("Invalid Cell", "The cell cannot be shown in the map CRS.")
+            return
         canvas = self.iface.mapCanvas()
-        canvas.setCenter(QgsPointXY(worldX, worldY))
+        canvas.setCenter(center)
         canvas.refresh()
 
+    def _canvas_crs(self):
+        return self.iface.mapCanvas().mapSettings().destinationCrs()
+
+    def _to_raster_crs(self, extent, rasterLayer):
+        """A canvas extent as a bounding box in the raster CRS, None if it cannot be transformed.
+
+        Rasters are always read on their native grid; only the drawing is reprojected.
+        """
+        return transform_extent(extent, self._canvas_crs(), rasterLayer.crs())
+
     # ------------------------------------------------------------------ #
     #  Auto-refresh on pan / zoom                                         #
     # ------------------------------------------------------------------ #
 
     def _on_canvas_extent_changed(self):
+        extent = self.iface.mapCanvas().extent()
+        center = extent.center()
+        self._panTracker.addSample(time.monotonic(), center.x(), center.y(), extent.width())
+        # Any running read belongs to the previous extent: outdate and cancel it.
+        self._refreshGeneration += 1
+        self._cancel_refresh_workers()
+        # The prefetch too aimed from the previous extent; the tiles it read stay cached.
+        self._cancel_prefetch_workers()
         # Debounce: restart timer so we only refresh after panning stops.
-        self._refreshTimer.start(1000)
+        self._refreshTimer.start(REFRESH_DELAY_MS)
+        # Throttle: prefetch along the pan while it goes on.
+        if not self._prefetchTimer.isActive():
+            self._prefetchTimer.start(PREFETCH_INTERVAL_MS)
 
     def _refresh_overlay(self):
         if not self.rasterOverlayItem or not self._currentRasterLayer:
             return
-        data = self._read_raster_data(self._currentRasterLayer)
-        if data is None:
-            # Zoomed out too far or panned outside raster — hide until back in range.
+        self._cancel_refresh_workers()
+        extent = self._to_raster_crs(self.iface.mapCanvas().extent(), self._currentRasterLayer)
+        if extent is None:
+            self.rasterOverlayItem.setVisible(False)
+            return
+        self._start_refresh_worker(self._currentRasterLayer, extent, self._on_refresh_data)
+
+    def _start_refresh_worker(self, rasterLayer, extent, slot):
+        """Read and analyse an extent in the raster CRS in the background, for the current generation.
+
+        slot receives (generation, grid), grid None when the extent is outside
+        the raster. Above maxCells the cells of the finest overview level that
+        fits are read.
+        """
+        worker = OverlayRefreshWorker(
+            self._refreshGeneration,
+            rasterLayer,
+            extent,
+            self.maxCellsSpinBox.value(),
+            self._tileCache,
+            self._overview_aggregate(),
+            self.conditionCheckbox.isChecked(),
+            self._needs_accumulation(),
+            self._band(),
+            self._compare_layers(rasterLayer),
+        )
+        worker.dataReady.connect(slot)
+        worker.finished.connect(self._on_refresh_worker_done)
+        self._refreshWorkers.append(worker)
+        worker.start()
+
+    def _on_refresh_data(self, generation, grid):
+        if generation != self._refreshGeneration or not self.rasterOverlayItem:
+            return  # stale job, the extent changed in the meantime
+        if grid is None:
+            # Panned outside raster — hide until back in range.
             self.rasterOverlayItem.setVisible(False)
             return
-        x_y_c_r_v_sink_dir_List, readExtent, rasterXres, rasterYres, elevMin, elevMax = data
         self.rasterOverlayItem.setVisible(True)
-        self.rasterOverlayItem.updateData(
-            x_y_c_r_v_sink_dir_List, readExtent, rasterXres, rasterYres, elevMin, elevMax
+        self.rasterOverlayItem.updateData(grid)
+        self._update_inspect_tool()
+        self._start_prefetch()
+
+    def _start_prefetch(self):
+        """Warm the tile cache where the pan is heading, while panning and once the view is shown."""
+        if not self.rasterOverlayItem or not self._currentRasterLayer:
+            return
+        extent = self.iface.mapCanvas().extent()
+        dx, dy = self._panTracker.predictOffset(
+            time.monotonic(), PREFETCH_LOOKAHEAD, 2 * max(extent.width(), extent.height()))
+        if dx == 0 and dy == 0:
+            return
+        self._cancel_prefetch_workers()
+        predicted = self._to_raster_crs(
+            QgsRectangle(extent.xMinimum() + dx, extent.yMinimum() + dy,
+                         extent.xMaximum() + dx, extent.yMaximum() + dy),
+            self._currentRasterLayer)
+        if predicted is None:
+            return
+        worker = TilePrefetchWorker(
+            self._currentRasterLayer,
+            predicted,
+            self.maxCellsSpinBox.value(),
+            self._tileCache,
+            self._overview_aggregate(),
+            self.conditionCheckbox.isChecked(),
+            self._band(),
+            self._compare_layers(self._currentRasterLayer),
         )
+        worker.finished.connect(self._on_refresh_worker_done)
+        self._prefetchWorkers.append(worker)
+        worker.start()
+
+    def _on_refresh_worker_done(self):
+        worker = self.sender()
+        for workers in (self._refreshWorkers, self._prefetchWorkers):
+            if worker in workers:
+                workers.remove(worker)
+        worker.deleteLater()
+
+    def _cancel_refresh_workers(self, wait=False):
+        for worker in self._refreshWorkers:
+            worker.stop()
+            if wait:
+                worker.wait()
+
+    def _cancel_prefetch_workers(self, wait=False):
+        for worker in self._prefetchWorkers:
+            worker.stop()
+            if wait:
+                worker.wait()
 
     # ------------------------------------------------------------------ #
     #  Data reading                                                        #
     # ------------------------------------------------------------------ #
 
-    def _read_raster_data(self, rasterLayer):
-        """Read cell data for the current canvas extent.
+    def _band(self):
+        band = self.bandCombobox.currentBand()
+        return band if band > 0 else 1
 
-        Returns (x_y_c_r_v_sink_dir_List, readExtent, xRes, yRes, elevMin, elevMax)
-        or None when the view is outside the raster or has too many cells (> 10 000).
+    def _compare_layers(self, rasterLayer):
+        """(layer, band) of the rasters to compare with rasterLayer, read on the same cells.
+
+        Only rasters on the same grid can be compared cell by cell; others are
+        ignored.
         """
-        canvas = self.iface.mapCanvas()
-        canvasExtent = canvas.extent()
-
-        raster_provider = rasterLayer.dataProvider()
-        rasterExtent    = rasterLayer.extent()
-        rasterNorth     = rasterExtent.yMaximum()
-        rasterSouth     = rasterExtent.yMinimum()
-        rasterWest      = rasterExtent.xMinimum()
-        rasterEast      = rasterExtent.xMaximum()
-        rasterXres      = rasterLayer.rasterUnitsPerPixelX()
-        rasterYres      = rasterLayer.rasterUnitsPerPixelY()
-
-        canvasNorth = canvasExtent.yMaximum()
-        canvasSouth = canvasExtent.yMinimum()
-        canvasWest  = canvasExtent.xMinimum()
-        canvasEast  = canvasExtent.xMaximum()
-
-        if not canvasExtent.intersects(rasterExtent):
-            return None
-
-        # Snap reading extent to the raster grid.
-        readNorth = rasterNorth
-        if readNorth > canvasNorth:
-            while readNorth > canvasNorth:
-                readNorth -= rasterYres
-            readNorth += rasterYres
-
-        readSouth = rasterSouth
-        if readSouth < canvasSouth:
-            while readSouth < canvasSouth:
-                readSouth += rasterYres
-            readSouth -= rasterYres
-
-        readWest = rasterWest
-        if readWest < canvasWest:
-            while readWest < canvasWest:
-                readWest += rasterXres
-            readWest -= rasterXres
-
-        readEast = rasterEast
-        if readEast > canvasEast:
-            while readEast > canvasEast:
-                readEast -= rasterXres
-            readEast += rasterXres
-
-        readExtent = QgsRectangle(readWest, readSouth, readEast, readNorth)
-        readCols   = int(readExtent.width()  / rasterXres)
-        readRows   = int(readExtent.height() / rasterYres)
-
-        if readCols * readRows > self.maxCellsSpinBox.value():
-            return None
-
-        x_y_c_r_v_sink_dir_List = []
-        startWorldX = readWest  + rasterXres / 2
-        startWorldY = readNorth - rasterYres / 2
-        elevMin =  99999999999
-        elevMax = -99999999999
-
-        for row in range(readRows):
-            for col in range(readCols):
-                worldX  = startWorldX + col * rasterXres
-                worldY  = startWorldY - row * rasterYres
-                origRow = int((rasterNorth - worldY) / rasterYres)
-                origCol = int((worldX - rasterWest)  / rasterXres)
-
-                result = raster_provider.sample(QgsPointXY(worldX, worldY), 1)
-                value  = result[0] if result[1] else None
-
-                if value is not None:
-                    elevMin = min(elevMin, value)
-                    elevMax = max(elevMax, value)
-
-                    tl = raster_provider.sample(QgsPointXY(worldX - rasterXres, worldY + rasterYres), 1)
-                    tc = raster_provider.sample(QgsPointXY(worldX,              worldY + rasterYres), 1)
-                    tr = raster_provider.sample(QgsPointXY(worldX + rasterXres, worldY + rasterYres), 1)
-                    cl = raster_provider.sample(QgsPointXY(worldX - rasterXres, worldY             ), 1)
-                    cr = raster_provider.sample(QgsPointXY(worldX + rasterXres, worldY             ), 1)
-                    bl = raster_provider.sample(QgsPointXY(worldX - rasterXres, worldY - rasterYres), 1)
-                    bc = raster_provider.sample(QgsPointXY(worldX,              worldY - rasterYres), 1)
-                    br = raster_provider.sample(QgsPointXY(worldX + rasterXres, worldY - rasterYres), 1)
-
-                    tlDir = (tl[0] if tl[1] else None, 4)
-                    tcDir = (tc[0] if tc[1] else None, 3)
-                    trDir = (tr[0] if tr[1] else None, 2)
-                    clDir = (cl[0] if cl[1] else None, 5)
-                    crDir = (cr[0] if cr[1] else None, 1)
-                    blDir = (bl[0] if bl[1] else None, 6)
-                    bcDir = (bc[0] if bc[1] else None, 7)
-                    brDir = (br[0] if br[1] else None, 8)
-
-                    neighbours = [tlDir, tcDir, trDir, clDir, crDir, blDir, bcDir, brDir]
-                    allValues  = [d[0] for d in neighbours]
-
-                    isSink = not any(v is not None and v < value for v in allValues)
-                    if isSink and allValues.count(value) > 1:
-                        isSink = False
-
-                    steepestDir   = None
-                    steepestValue = None
-                    for val, direction in neighbours:
-                        if val is not None and (steepestValue is None or val < steepestValue):
-                            steepestValue = val
-                            steepestDir   = direction
-
-                    x_y_c_r_v_sink_dir_List.append(
-                        (worldX, worldY, origCol, origRow, value, isSink, steepestDir)
-                    )
-
-        return (x_y_c_r_v_sink_dir_List, readExtent, rasterXres, rasterYres, elevMin, elevMax)
+        compareLayer = self.compareLayerCombobox.currentLayer()
+        if not isinstance(compareLayer, QgsRasterLayer) or not same_grid(rasterLayer, compareLayer):
+            return []
+        band = self.compareBandCombobox.currentBand()
+        return [(compareLayer, band if band > 0 else 1)]
+
+    def _overview_aggregate(self):
+        """How overview cells are aggregated when zoomed out: "mean" or "min"."""
+        return QSettings().value("GeomorphEye/overviewAggregate", "mean")
+
+    def _tile_cache_bytes(self):
+        """The memory budget of the tile cache, from the tileCacheMB setting."""
+        return int(QSettings().value("GeomorphEye/tileCacheMB", 256)) * 1024 * 1024
+
+    # ------------------------------------------------------------------ #
+    #  Tile cache invalidation                                            #
+    # ------------------------------------------------------------------ #
+
+    def _watch_layer(self, layer):
+        if layer.id() in self._watchedLayers:
+            return
+        slot = partial(self._on_raster_data_changed, layer.id())
+        layer.dataChanged.connect(slot)
+        layer.repaintRequested.connect(slot)
+        layer.crsChanged.connect(slot)
+        self._watchedLayers[layer.id()] = (layer, slot)
+
+    def _unwatch_layer(self, layerId):
+        layer, slot = self._watchedLayers.pop(layerId)
+        try:
+            layer.dataChanged.disconnect(slot)
+            layer.repaintRequested.disconnect(slot)
+            layer.crsChanged.disconnect(slot)
+        except (TypeError, RuntimeError):
+            pass  # already disconnected or layer deleted
+
+    def _on_raster_data_changed(self, layerId, *args):
+        self._tileCache.invalidateLayer(layerId)
+        self._update_inspect_tool()  # the tile keys hold the data timestamp
+        if self._currentRasterLayer and self._currentRasterLayer.id() == layerId:
+            if self.rasterOverlayItem:
+                self.rasterOverlayItem.setSourceCrs(self._currentRasterLayer.crs())
+                self.rasterOverlayItem.clearRanges()
+            self._on_canvas_extent_changed()
+        elif self.rasterOverlayItem and self.compareLayerCombobox.currentLayer() is not None \
+                and self.compareLayerCombobox.currentLayer().id() == layerId:
+            self.rasterOverlayItem.clearRanges()
+            self._on_canvas_extent_changed()
+
+    def _on_layers_will_be_removed(self, layerIds):
+        for layerId in layerIds:
+            self._tileCache.invalidateLayer(layerId)
+            if layerId in self._watchedLayers:
+                self._unwatch_layer(layerId)
+            if self._currentRasterLayer and self._currentRasterLayer.id() == layerId:
+                self.cleanup_overlay()
+                self.pushButtonLoad.setText("Load On-Screen Raster Info")
+                self.reset_ui()
 
     # ------------------------------------------------------------------ #
     #  Layer selection change                                             #
     # ------------------------------------------------------------------ #
 
     def _on_layer_changed(self, layer):
-        if not self.rasterOverlayItem:
+        if not self.rasterOverlayItem and self._loadingLayer is None:
+            self.bandCombobox.setLayer(layer)
+            self._update_inspect_tool()
             return
         self.cleanup_overlay()
+        self.bandCombobox.setLayer(layer)
+        self._update_inspect_tool()
         self.pushButtonLoad.setText("Load On-Screen Raster Info")
         self.reset_ui()
         if layer and isinstance(layer, QgsRasterLayer):
@@ -359,14 +630,8 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
             iface.messageBar().pushWarning("Invalid Layer", "Selected layer is not a raster layer.")
             return
 
-        raster_crs = rasterLayer.crs()
-        canvas_crs = canvas.mapSettings().destinationCrs()
-        if raster_crs != canvas_crs:
-            iface.messageBar().pushWarning(
-                "CRS Mismatch", "This only works if the raster has the same CRS as the map canvas.")
-            return
-
-        if not canvas.extent().intersects(rasterLayer.extent()):
+        extent = self._to_raster_crs(canvas.extent(), rasterLayer)
+        if extent is None or not extent.intersects(rasterLayer.extent()):
             iface.messageBar().pushWarning("No Data", "No data found in the selected extent.")
             self.reset_ui()
             return
@@ -375,22 +640,30 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
         self.progressBar.setVisible(True)
         self.progressBar.setValue(0)
 
-        data = self._read_raster_data(rasterLayer)
-
-        if data is None:
-            iface.messageBar().pushWarning(
-                "Too many cells", "Zoom in first — max 10,000 cells can be displayed.")
+        # the budget may have been changed in the settings since the dialog opened
+        self._tileCache.setMaxBytes(self._tile_cache_bytes())
+        # read off the GUI thread, like the refreshes; the overlay is created once read
+        self._loadingLayer = rasterLayer
+        self._loadingExtent = canvas.extent()
+        self._refreshGeneration += 1
+        self._start_refresh_worker(rasterLayer, extent, self._on_load_data)
+
+    def _on_load_data(self, generation, grid):
+        if generation != self._refreshGeneration or self._loadingLayer is None:
+            return  # the load was cancelled in the meantime
+        rasterLayer = self._loadingLayer
+        self._loadingLayer = None
+        if grid is None:
+            iface.messageBar().pushWarning("No Data", "No data found in the selected extent.")
             self.reset_ui()
             return
 
-        x_y_c_r_v_sink_dir_List, readExtent, rasterXres, rasterYres, elevMin, elevMax = data
-
         self.progressBar.setValue(100)
+        canvas = self.iface.mapCanvas()
 
         overlay = RasterOverlay(
             canvas,
-            x_y_c_r_v_sink_dir_List,
-            readExtent, rasterXres, rasterYres, elevMin, elevMax,
+            grid,
             fontSize    = self.fontSizeSpinBox.value(),
             borderColor = self.cellBorderColorButton.color().name(),
             draw_pits   = self.viewPitsCheckbox.isChecked(),
@@ -400,10 +673,22 @@ class GeomorpheyePluginDialog(QDialog, Ui_Dialog):
             draw_colors = self.viewColorsCheckbox.isChecked(),
             draw_colrow = self.viewColRowCheckbox.isChecked(),
         )
+        overlay.setColorRamp(self.colorRampCombobox.currentData())
+        overlay.setColorSurface(self.colorSurfaceCombobox.currentData())
+        overlay.setDrawAccumulation(self.viewAccumulationCheckbox.isChecked())
+        overlay.setSourceCrs(rasterLayer.crs())
+        if profiler.enabled:
+            overlay.setHud(self.isTrue(QSettings().value("GeomorphEye/profilingHud", False)), self._tileCache)
+        overlay.setStickyRanges(self.isTrue(QSettings().value("GeomorphEye/stickyRanges", False)))
 
         self._currentRasterLayer = rasterLayer
         self.rasterOverlayItem   = overlay
+        self._update_inspect_tool()
+        self._watch_layer(rasterLayer)
         canvas.extentsChanged.connect(self._on_canvas_extent_changed)
+        if canvas.extent() != self._loadingExtent:
+            # panned or zoomed while loading
+            self._on_canvas_extent_changed()
 
         self.pushButtonLoad.setText("Remove On-Screen Raster Info")
         self.reset_ui()
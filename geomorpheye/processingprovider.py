@@ -0,0 +1,20 @@
+from qgis.core import QgsProcessingProvider
+
+from .exportalgorithm import ExportAnalysisAlgorithm
+from .ui import IconGeomorphEye
+
+
+class GeomorphEyeProcessingProvider(QgsProcessingProvider):
+    """Processing provider of the GeomorphEye algorithms."""
+
+    def loadAlgorithms(self):
+        self.addAlgorithm(ExportAnalysisAlgorithm())
+
+    def id(self):
+        return "geomorpheye"
+
+    def name(self):
+        return "GeomorphEye"
+
+    def icon(self):
+        return IconGeomorphEye
@@ -0,0 +1,94 @@
+"""Per-stage timing of GeomorphEye.
+
+    with profiler.stage("read", cells):
+        ...
+
+Every timed stage goes into a ring buffer and, when a log level is set, to the
+QGIS message log. While the profiler is disabled stage() returns one shared
+no-op context manager, so the timers stay in the hot paths at no cost.
+"""
+from collections import deque
+from contextlib import nullcontext
+import time
+
+from qgis.core import Qgis, QgsMessageLog
+
+LOG_TAG = "GeomorphEye"
+# Values of the GeomorphEye/profilingLogLevel setting.
+LOG_LEVELS = {
+    "none": None,
+    "info": Qgis.Info,
+    "warning": Qgis.Warning,
+    "critical": Qgis.Critical,
+}
+
+_NO_TIMER = nullcontext()
+
+
+class StageTimer():
+    __slots__ = ("profiler", "name", "cells", "start")
+
+    def __init__(self, profiler, name, cells):
+        self.profiler = profiler
+        self.name = name
+        self.cells = cells
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, (time.perf_counter() - self.start) * 1000.0, self.cells)
+        return False
+
+
+class StageProfiler():
+    """Ring buffer of (time, stage, ms, cells) records, filled by the stage timers.
+
+    latest keeps the last record of every stage, for the HUD. Stages run on the
+    worker threads as well as on the GUI thread; appending to a deque and
+    logging through QgsMessageLog are both thread-safe.
+    """
+
+    def __init__(self, capacity=1000):
+        self.enabled = False
+        self.logLevel = None
+        self.records = deque(maxlen=capacity)
+        self.latest = {}
+
+    def configure(self, enabled, logLevel="none", capacity=None):
+        """Enable the timers, log at the named level of LOG_LEVELS and resize the ring buffer."""
+        self.enabled = enabled
+        self.logLevel = LOG_LEVELS.get(logLevel)
+        if capacity is not None and capacity != self.records.maxlen:
+            self.records = deque(self.records, maxlen=capacity)
+
+    def stage(self, name, cells=None):
+        """Context manager timing the enclosed block as the named stage."""
+        if not self.enabled:
+            return _NO_TIMER
+        return StageTimer(self, name, cells)
+
+    def record(self, name, ms, cells=None):
+        self.records.append((time.time(), name, ms, cells))
+        self.latest[name] = (ms, cells)
+        if self.logLevel is not None:
+            message = f"{name}: {ms:.1f} ms" if cells is None else f"{name}: {ms:.1f} ms, {cells} cells"
+            QgsMessageLog.logMessage(message, LOG_TAG, self.logLevel, notifyUser=False)
+
+    def summary(self):
+        """{stage: (count, mean ms, max ms)} over the ring buffer."""
+        durations = {}
+        for _, name, ms, _ in list(self.records):
+            durations.setdefault(name, []).append(ms)
+        return {name: (len(values), sum(values) / len(values), max(values))
+                for name, values in durations.items()}
+
+    def clear(self):
+        self.records.clear()
+        self.latest.clear()
+
+
+# Shared by the readers, the workers and the overlay; configured by the plugin.
+profiler = StageProfiler()
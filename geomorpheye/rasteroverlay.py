@@ -1,24 +1,33 @@
 from qgis.gui import QgsMapCanvasItem, QgsMapCanvas
-from qgis.core import QgsPointXY, QgsRasterLayer, QgsRectangle
-from PyQt5.QtGui import QPainter, QColor, QPen, QFont
-from PyQt5.QtCore import QRectF, QPointF, QSizeF, Qt
+from qgis.core import QgsCoordinateReferenceSystem, QgsPointXY, QgsRasterLayer, QgsRectangle
+from PyQt5.QtGui import QPainter, QColor, QFont, QPen, QImage, QPolygonF, QTransform
+from PyQt5.QtCore import QRectF, QPointF, QLineF, QSizeF, Qt
 from qgis.core import QgsColorRampShader, QgsStyle
-import math
+import numpy as np
+
+from .accumulation import downstream_path, upstream_mask
+from .analysis import NO_DIRECTION
+from .cellgrid import CellGrid
+from .labelcache import LabelCache
+from .colorramp import GREY_STOPS, apply_lut, lut_from_color_ramp, lut_from_stops
+from .profiling import profiler
+from .reprojection import LatticeCache
+from .geotransform import ceil_cell, floor_cell
+
+# Line width classes of the flow arrows when they show the flow accumulation.
+ACCUMULATION_CLASSES = 5
+TRACE_UPSTREAM = "upstream"
+TRACE_DOWNSTREAM = "downstream"
+# Cells per side of the image blocks warped onto the reprojected corner lattice.
+WARP_BLOCK = 16
+
 
 class RasterOverlay(QgsMapCanvasItem):
-    def __init__(self, canvas:QgsMapCanvas, x_y_c_r_v_sink_dir_List,
-                 readExtent:QgsRectangle, xRes:float, yRes:float, elevMin:float, elevMax:float,
+    def __init__(self, canvas:QgsMapCanvas, grid:CellGrid,
                  fontSize, borderColor, draw_pits, draw_flow, draw_values, draw_cells, draw_colors, draw_colrow):
-        print("=======> INITIALIZING RASTER OVERLAY1")
         super().__init__(canvas)
         self._canvas = canvas
-        print("=======> INITIALIZING RASTER OVERLAY2")
-        self.x_y_c_r_v_sink_dir_List = x_y_c_r_v_sink_dir_List
-        self.readExtent = readExtent
-        self.xRes = xRes
-        self.yRes = yRes
-        self.elevMin = elevMin
-        self.elevMax = elevMax
+        self.grid = grid
         self.fontSize = fontSize
         self.cellBorderColorHex = borderColor
         self.draw_pits = draw_pits
@@ -34,7 +43,34 @@ class RasterOverlay(QgsMapCanvasItem):
         self.flowLinesColorHex = "#1868C4"
         self.sinkColorHex = "#FF0000"
         self.haloColorHex = "#FFFFFF"
-        print("=======> INITIALIZING RASTER OVERLAY3")
+        self.traceColorHex = "#FF00FF"
+        self.draw_accumulation = False
+        self._trace = None
+        self.colorLut = lut_from_stops()
+        self.greyLut = lut_from_stops(GREY_STOPS)
+        self._labels = LabelCache(self.textColorHex, self.haloColorHex)
+        self._colorRampName = ""
+        self.colorSurface = "elevation"
+        # CRS of the grid; when it differs from the canvas CRS the cells are drawn as reprojected quads.
+        self.sourceCrs = None
+        self._lattices = LatticeCache()
+
+        # Off-screen rendering of the overlay, reused until its render key changes.
+        self._dataGeneration = 0
+        self._image = None
+        self._imageKey = None
+        # (styleKey, grid, canvas position of the grid origin, sharedCellKey) of the image, for incremental updates.
+        self._imageState = None
+        # Every grid is coloured and its flow widths scaled by its own range. With
+        # sticky ranges (opt-in) they are kept by surface instead and only widened
+        # while panning at the scale of _rangeScaleKey.
+        self.stickyRanges = False
+        self._ranges = {}
+        self._rangeScaleKey = None
+
+        # Debug HUD with the cells, the latest stage timings and the tile cache hit rate.
+        self.draw_hud = False
+        self._hudTileCache = None
 
     def boundingRect(self):
         # Must return a stable rect in local (canvas pixel) coords.
@@ -42,13 +78,24 @@ class RasterOverlay(QgsMapCanvasItem):
         # pan/zoom, making Qt's scene BSP index stale and causing crashes on removeItem().
         return QRectF(QPointF(0, 0), QSizeF(self._canvas.size()))
     
-    def updateData(self, x_y_c_r_v_sink_dir_List, readExtent, xRes, yRes, elevMin, elevMax):
-        self.x_y_c_r_v_sink_dir_List = x_y_c_r_v_sink_dir_List
-        self.readExtent = readExtent
-        self.xRes = xRes
-        self.yRes = yRes
-        self.elevMin = elevMin
-        self.elevMax = elevMax
+    def setStickyRanges(self, enabled):
+        """Keep the colour and flow width ranges while panning, widening them only when needed.
+
+        Saves full renders while panning, at the cost of local contrast: the
+        ranges then also cover cells that have left the view.
+        """
+        self.stickyRanges = enabled
+        self._ranges = {}
+        self.update()
+
+    def clearRanges(self):
+        """Scale colours and flow widths to the next grid alone, e.g. once the raster data changed."""
+        self._ranges = {}
+        self.update()
+
+    def updateData(self, grid:CellGrid):
+        self.grid = grid
+        self._dataGeneration += 1
         self.update()
 
     def setFontSize(self, fontSize):
@@ -64,149 +111,596 @@ class RasterOverlay(QgsMapCanvasItem):
         self.draw_colrow = enable_colrow
         self.update()
         
+    def setColorRamp(self, rampName):
+        """Use the named QgsStyle colour ramp for the local colormap, the default stops if empty."""
+        ramp = QgsStyle.defaultStyle().colorRamp(rampName) if rampName else None
+        self.colorLut = lut_from_color_ramp(ramp) if ramp else lut_from_stops()
+        self._colorRampName = rampName if ramp else ""
+        self.update()
+
+    def setDrawAccumulation(self, enabled):
+        """Draw the flow arrows wider the more cells drain through them."""
+        self.draw_accumulation = enabled
+        self.update()
+
+    def setTrace(self, point:QgsPointXY, mode):
+        """Highlight the upstream catchment or the downstream path of the cell at the map point.
+
+        The trace follows the point on later data updates; mode is
+        TRACE_UPSTREAM or TRACE_DOWNSTREAM.
+        """
+        self._trace = (point.x(), point.y(), mode)
+        self.update()
+
+    def clearTrace(self):
+        self._trace = None
+        self.update()
+
+    def setColorSurface(self, surface):
+        """Colour the cells by one of the CellGrid SURFACES instead of the elevation."""
+        self.colorSurface = surface
+        self.update()
+
+    def setSourceCrs(self, crs:QgsCoordinateReferenceSystem):
+        """Set the CRS the grid is read in; the trace point is expected in this CRS too."""
+        self.sourceCrs = crs
+        self._lattices.clear()
+        self.update()
+
+    def setHud(self, enabled, tileCache=None):
+        """Show the profiler timings and the hit rate of the tileCache on the canvas."""
+        self.draw_hud = enabled
+        self._hudTileCache = tileCache
+        self.update()
+
     def setBorderColor(self, color):
         self.cellBorderColorHex = color
         self.update()
 
     def paint(self, painter, option, widget):
-        print("=======> STARTING PAINTING")
-        self.drawColor(painter)
-        self.drawCells(painter)
-        self.drawFlow(painter)
-        self.drawSinks(painter)
-        self.drawValues(painter)
-        print("=======> FINISHED PAINTING")
-
-    def drawValues(self, painter):
-        if self.draw_values:
-            painter.setFont(QFont("Arial", self.fontSize))
-            for x_y_c_r_v_sink_dir in self.x_y_c_r_v_sink_dir_List:
-                worldX, worldY, origCol, origRow, value, isSink, steepestDir = x_y_c_r_v_sink_dir
-                if value is not None:
-                    upperLeft = self.toCanvasCoordinates(QgsPointXY(worldX - self.xRes/2, worldY + self.yRes/2))
-                    lowerRight = self.toCanvasCoordinates(QgsPointXY(worldX + self.xRes/2, worldY - self.yRes/2))
-                    rect = QRectF(upperLeft, lowerRight)
-                    # write col, row and value below each other inside the cell
-                    if self.draw_colrow:
-                        text = f"c: {origCol}\nr: {origRow}\nv: {value}"
-                    else:
-                        text = f"{value}"
-
-                    for dx in [-1, 0, 1]:
-                        for dy in [-1, 0, 1]:
-                            if dx == 0 and dy == 0:
-                                continue
-                            offset_rect = QRectF(rect)
-                            offset_rect.translate(dx, dy)
-                            painter.setPen(QPen(QColor(self.haloColorHex), 1))
-                            painter.drawText(offset_rect, Qt.AlignCenter, text)
-
-
-                    painter.setPen(QPen(QColor(self.textColorHex), 1))
-                    painter.drawText(rect, Qt.AlignCenter, text)
-
-    def drawSinks(self, painter):
+        devicePixelRatio = painter.device().devicePixelRatioF()
+        key = self.renderKey(devicePixelRatio)
+        if self._image is None or key != self._imageKey:
+            with profiler.stage("render", self.grid.rows * self.grid.cols):
+                image = self.incrementalImage(devicePixelRatio, painter.renderHints())
+                if image is None:
+                    image = self.renderImage(devicePixelRatio, painter.renderHints())
+            self._image = image
+            self._imageKey = key
+            self._imageState = (self.styleKey(devicePixelRatio), self.grid,
+                                self.toCanvasCoordinates(QgsPointXY(self.grid.west, self.grid.north)),
+                                self.sharedCellKey())
+        painter.drawImage(QPointF(0, 0), self._image)
+        if self.draw_hud:
+            self.drawHud(painter)
+
+    def renderKey(self, devicePixelRatio):
+        """Everything the rendered image depends on: data, map-to-pixel transform and style."""
+        extent = self._canvas.mapSettings().visibleExtent()
+        return (
+            self._dataGeneration,
+            extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum(),
+        ) + self.styleKey(devicePixelRatio)
+
+    def styleKey(self, devicePixelRatio):
+        """What the rendered image depends on besides the data and the position of the view."""
+        mapSettings = self._canvas.mapSettings()
+        outputSize = mapSettings.outputSize()
+        return (
+            mapSettings.mapUnitsPerPixel(), mapSettings.rotation(),
+            outputSize.width(), outputSize.height(), devicePixelRatio,
+            mapSettings.destinationCrs().authid(),
+            self.draw_pits, self.draw_flow, self.draw_values, self.draw_cells,
+            self.draw_colors, self.draw_colrow, self.fontSize, self.cellBorderColorHex,
+            self._colorRampName, self.colorSurface, self.draw_accumulation, self._trace,
+        )
+
+    def sharedCellKey(self):
+        """What the rendering of a single cell takes from the whole grid: the colour and the flow width scales."""
+        colorRange = self.colorRange() if self.draw_colors else None
+        accumulationScale = self.accumulationMaxWeight() if self.drawsAccumulation() else None
+        return colorRange, accumulationScale
+
+    def stickyRange(self, name, vmin, vmax):
+        """The range of a surface of the grid, as given unless sticky ranges are on.
+
+        With sticky ranges it is widened to the ranges the surface had before
+        at the same scale, so that while panning the colour and flow width
+        scales only change when the new cells fall outside them and the last
+        image can be reused; zooming or another overview level starts from
+        the grid range again.
+        """
+        if not self.stickyRanges:
+            return vmin, vmax
+        scaleKey = (self._canvas.mapSettings().mapUnitsPerPixel(), self.grid.factor)
+        if scaleKey != self._rangeScaleKey:
+            self._ranges = {}
+            self._rangeScaleKey = scaleKey
+        if name in self._ranges:
+            lastMin, lastMax = self._ranges[name]
+            vmin, vmax = min(vmin, lastMin), max(vmax, lastMax)
+        self._ranges[name] = (vmin, vmax)
+        return vmin, vmax
+
+    def colorRange(self):
+        """(vmin, vmax) the colour surface is scaled to, see stickyRange()."""
+        _, vmin, vmax = self.grid.surface(self.colorSurface)
+        return self.stickyRange(self.colorSurface, vmin, vmax)
+
+    def newImage(self, devicePixelRatio):
+        """A transparent canvas-sized image."""
+        size = self._canvas.size()
+        image = QImage(int(size.width() * devicePixelRatio), int(size.height() * devicePixelRatio),
+                       QImage.Format_ARGB32_Premultiplied)
+        image.setDevicePixelRatio(devicePixelRatio)
+        image.fill(Qt.transparent)
+        return image
+
+    def renderImage(self, devicePixelRatio, renderHints):
+        """Render all enabled passes into a transparent canvas-sized image."""
+        image = self.newImage(devicePixelRatio)
+        imagePainter = QPainter(image)
+        imagePainter.setRenderHints(renderHints)
+        with profiler.stage("model", self.grid.rows * self.grid.cols):
+            geometry = self.cellGeometry()
+        if geometry is not None:
+            self.renderCells(imagePainter, geometry)
+        imagePainter.end()
+        return image
+
+    def renderCells(self, painter, geometry):
+        """Draw all enabled passes for the cells of the geometry."""
+        for name, drawPass in (("color", self.drawColor), ("cells", self.drawCells),
+                               ("flow", self.drawFlow), ("sinks", self.drawSinks),
+                               ("trace", self.drawTrace), ("values", self.drawValues)):
+            with profiler.stage("draw." + name, geometry.count):
+                drawPass(painter, geometry)
+
+    def incrementalImage(self, devicePixelRatio, renderHints):
+        """Reuse the last image after a pan: shift its pixels and render only the newly exposed cells.
+
+        The last image is kept with the grid it shows and the canvas position of
+        that grid. Cells of the current grid that were fully on screen in the
+        last image and render the same are copied from it, the remaining rows
+        and columns are rendered as up to four strips. Returns None, for a full
+        render, when the style, scale or CRS changed, the view is rotated or
+        reprojected, a trace is shown, the colour or flow width scales changed
+        (the range of the new grid differs, see stickyRange()) or less than
+        half of the cells can be reused.
+        """
+        if self._image is None or self._imageState is None or self._trace is not None:
+            return None
+        styleKey, lastGrid, lastAnchor, lastSharedKey = self._imageState
+        grid = self.grid
+        if styleKey != self.styleKey(devicePixelRatio) or self._canvas.mapSettings().rotation() != 0 \
+                or not self.isAffine() or grid.factor != lastGrid.factor \
+                or grid.xRes != lastGrid.xRes or grid.yRes != lastGrid.yRes:
+            return None
+        # Offset, in cells of the current grid, of the last grid.
+        colOffset = (lastGrid.west - grid.west) / grid.xRes
+        rowOffset = (grid.north - lastGrid.north) / grid.yRes
+        if floor_cell(colOffset) != ceil_cell(colOffset) or floor_cell(rowOffset) != ceil_cell(rowOffset):
+            return None
+        colOffset = floor_cell(colOffset)
+        rowOffset = floor_cell(rowOffset)
+        if self.sharedCellKey() != lastSharedKey:
+            return None
+
+        # Cells shared with the last grid that were fully inside the last image.
+        shift = self.toCanvasCoordinates(QgsPointXY(lastGrid.west, lastGrid.north)) - lastAnchor
+        origin = self.toCanvasCoordinates(QgsPointXY(grid.west, grid.north))
+        cellWidth = self.toCanvasCoordinates(QgsPointXY(grid.west + grid.xRes, grid.north)).x() - origin.x()
+        cellHeight = self.toCanvasCoordinates(QgsPointXY(grid.west, grid.north - grid.yRes)).y() - origin.y()
+        if cellWidth <= 0 or cellHeight <= 0:
+            return None
+        size = self._canvas.size()
+        reused = (
+            max(colOffset, 0, ceil_cell((shift.x() - origin.x()) / cellWidth)),
+            max(rowOffset, 0, ceil_cell((shift.y() - origin.y()) / cellHeight)),
+            min(colOffset + lastGrid.cols, grid.cols, floor_cell((shift.x() + size.width() - origin.x()) / cellWidth)),
+            min(rowOffset + lastGrid.rows, grid.rows, floor_cell((shift.y() + size.height() - origin.y()) / cellHeight)),
+        )
+        firstCol, firstRow, endCol, endRow = reused
+        if endCol <= firstCol or endRow <= firstRow or \
+                2 * (endCol - firstCol) * (endRow - firstRow) < grid.cols * grid.rows:
+            return None
+        if grid is not lastGrid and not self.sameCells(lastGrid, reused, colOffset, rowOffset):
+            return None
+
+        image = self.newImage(devicePixelRatio)
+        imagePainter = QPainter(image)
+        imagePainter.setRenderHints(renderHints)
+        imagePainter.save()
+        imagePainter.setClipRect(QRectF(QPointF(origin.x() + firstCol * cellWidth, origin.y() + firstRow * cellHeight),
+                                        QPointF(origin.x() + endCol * cellWidth, origin.y() + endRow * cellHeight)))
+        imagePainter.drawImage(QPointF(shift.x(), shift.y()), self._image)
+        imagePainter.restore()
+
+        strips = ((0, 0, grid.cols, firstRow), (0, endRow, grid.cols, grid.rows),
+                  (0, firstRow, firstCol, endRow), (endCol, firstRow, grid.cols, endRow))
+        with profiler.stage("model", grid.rows * grid.cols - (endCol - firstCol) * (endRow - firstRow)):
+            geometries = [self.cellGeometry(strip) for strip in strips
+                          if strip[2] > strip[0] and strip[3] > strip[1]]
+        for geometry in geometries:
+            self.renderCells(imagePainter, geometry)
+        imagePainter.end()
+        return image
+
+    def sameCells(self, lastGrid, window, colOffset, rowOffset):
+        """Whether the cells of the window render as the same cells of the last grid, colOffset/rowOffset cells away."""
+        grid = self.grid
+        firstCol, firstRow, endCol, endRow = window
+        current = (slice(firstRow, endRow), slice(firstCol, endCol))
+        last = (slice(firstRow - rowOffset, endRow - rowOffset), slice(firstCol - colOffset, endCol - colOffset))
+        pairs = [(grid.nodata, lastGrid.nodata), (grid.values, lastGrid.values),
+                 (grid.directions, lastGrid.directions), (grid.sinks, lastGrid.sinks)]
+        if self.drawsAccumulation():
+            pairs.append((grid.accumulation, lastGrid.accumulation))
+        if len(grid.compared) != len(lastGrid.compared):
+            return False
+        for (values, nodata), (lastValues, lastNodata) in zip(grid.compared, lastGrid.compared):
+            pairs += [(nodata, lastNodata), (values, lastValues)]
+        if any(lastArray is None or not np.array_equal(array[current], lastArray[last])
+               for array, lastArray in pairs):
+            return False
+        if self.draw_colors:
+            surface = grid.surface(self.colorSurface)[0]
+            lastSurface = lastGrid.surface(self.colorSurface)[0]
+            return np.array_equal(surface[current], lastSurface[last], equal_nan=True)
+        return True
+
+    def drawHud(self, painter):
+        """Draw the cell counts, the latest stage timings and the cache hit rate in the upper-left corner."""
+        grid = self.grid
+        lines = [f"cells {grid.rows} x {grid.cols}, level factor {grid.factor}"]
+        for name, (ms, _) in sorted(profiler.latest.items()):
+            lines.append(f"{name:<14}{ms:8.1f} ms")
+        hitRate = self._hudTileCache.hitRate() if self._hudTileCache is not None else None
+        if hitRate is not None:
+            lines.append(f"tile cache hits {hitRate:.0%}, {len(self._hudTileCache)} tiles")
+
+        painter.save()
+        font = QFont("Monospace", 9)
+        font.setStyleHint(QFont.TypeWriter)
+        painter.setFont(font)
+        lineHeight = painter.fontMetrics().height()
+        width = max(painter.fontMetrics().horizontalAdvance(line) for line in lines)
+        painter.fillRect(QRectF(4, 4, width + 12, lineHeight * len(lines) + 8), QColor(0, 0, 0, 160))
+        painter.setPen(QColor("#FFFFFF"))
+        for i, line in enumerate(lines):
+            painter.drawText(QPointF(10, 8 + lineHeight * (i + 1) - painter.fontMetrics().descent()), line)
+        painter.restore()
+
+    def drawValues(self, painter, geometry):
+        if self.draw_values and geometry.count:
+            devicePixelRatio = painter.device().devicePixelRatioF()
+            cellWidth = abs(geometry.right[0] - geometry.left[0])
+            cellHeight = abs(geometry.bottom[0] - geometry.top[0])
+            # Level of detail: skip labels that do not fit in their cell.
+            lineCount = 3 if self.draw_colrow else 1
+            if cellHeight < lineCount * self._labels.metrics(self.fontSize).height():
+                return
+
+            values = geometry.values.tolist()
+            if geometry.comparedValues:
+                # values of the compared rasters side by side, "-" where they have no data
+                compared = zip(*(c.tolist() for c in geometry.comparedValues))
+                values = [" | ".join([str(value)] + ["-" if c != c else str(c) for c in others])
+                          for value, others in zip(values, compared)]
+            cells = zip(geometry.origCols.tolist(), geometry.origRows.tolist(), values)
+            for i, (origCol, origRow, value) in enumerate(cells):
+                # write col, row and value below each other inside the cell
+                if self.draw_colrow:
+                    text = f"c: {origCol}\nr: {origRow}\nv: {value}"
+                else:
+                    text = f"{value}"
+                if self._labels.textWidth(text, self.fontSize) > cellWidth:
+                    continue
+
+                self._labels.drawLabel(painter, geometry.centerX[i], geometry.centerY[i], text,
+                                       self.fontSize, devicePixelRatio)
+
+    def drawSinks(self, painter, geometry):
         if self.draw_pits:
-            painter.setPen(QPen(QColor(self.sinkColorHex), 1))
-            painter.setBrush(QColor(self.sinkColorHex))
-            for x_y_c_r_v_sink_dir in self.x_y_c_r_v_sink_dir_List:
-                worldX, worldY, origCol, origRow, value, isSink, steepestDir = x_y_c_r_v_sink_dir
-                if isSink:
-                    upperLeft = self.toCanvasCoordinates(QgsPointXY(worldX - self.xRes/2, worldY + self.yRes/2))
-                    lowerRight = self.toCanvasCoordinates(QgsPointXY(worldX + self.xRes/2, worldY - self.yRes/2))
-                    rect = QRectF(upperLeft, lowerRight)
-                    # draw a point at the center of the cell
-                    center = self.toCanvasCoordinates(QgsPointXY(worldX, worldY))
-
-                    radius = rect.width() / self.radiusRatio
-                    painter.drawEllipse(center, radius, radius)
-
-    def drawFlow(self, painter):
+            # draw a point at the center of the cell
+            radii = (geometry.right - geometry.left) / self.radiusRatio
+            self.drawCircles(painter, geometry, geometry.sinks, radii, self.sinkColorHex)
+
+    def drawFlow(self, painter, geometry):
         if self.draw_flow:
+            # distance between points
+            radii = np.hypot(geometry.flowEndX - geometry.centerX,
+                             geometry.flowEndY - geometry.centerY) / self.radiusRatio
+            hasFlow = ~geometry.sinks & (geometry.directions != NO_DIRECTION)
+            self.drawCircles(painter, geometry, hasFlow, radii, self.flowLinesColorHex)
             painter.setPen(QPen(QColor(self.flowLinesColorHex), 1))
-            painter.setBrush(QColor(self.flowLinesColorHex))
-            scale = 0.85 # to avoid touching the cell borders
-            
-            for x_y_c_r_v_sink_dir in self.x_y_c_r_v_sink_dir_List:
-                worldX, worldY, origCol, origRow, value, isSink, steepestDir = x_y_c_r_v_sink_dir
-                if isSink:
-                    continue
+            if self.drawsAccumulation():
+                # log scaled width classes, one batched call each
+                weights = np.log10(np.maximum(self.grid.accumulation[geometry.gridRows, geometry.gridCols], 1))
+                maxWeight = self.accumulationMaxWeight()
+                if maxWeight > 0:
+                    classes = np.minimum((weights / maxWeight * ACCUMULATION_CLASSES).astype(int),
+                                         ACCUMULATION_CLASSES - 1)
+                else:
+                    classes = np.zeros(weights.shape, dtype=int)
+                for widthClass in range(ACCUMULATION_CLASSES):
+                    mask = hasFlow & (classes == widthClass)
+                    if mask.any():
+                        painter.setPen(QPen(QColor(self.flowLinesColorHex), 1 + 1.5 * widthClass))
+                        painter.drawLines(geometry.flowLines(mask))
+            else:
+                painter.drawLines(geometry.flowLines(hasFlow))
+
+    def drawCircles(self, painter, geometry, mask, radii, colorHex):
+        """Filled circles on the centers of the masked cells, one drawPoints call per radius class.
+
+        A point drawn with a round cap pen is a filled circle of the pen
+        width; the width adds the one pixel outline the circles used to have.
+        """
+        for radius, centers in geometry.circleClasses(mask, radii):
+            pen = QPen(QColor(colorHex), 2 * radius + 1)
+            pen.setCapStyle(Qt.RoundCap)
+            painter.setPen(pen)
+            painter.drawPoints(centers)
 
-                center = QgsPointXY(worldX, worldY)
-
-                dx = dy = 0
-                if steepestDir == 1:   dx =  self.xRes / 2
-                elif steepestDir == 2: dx =  self.xRes / 2; dy =  self.yRes / 2
-                elif steepestDir == 3: dy =  self.yRes / 2
-                elif steepestDir == 4: dx = -self.xRes / 2; dy =  self.yRes / 2
-                elif steepestDir == 5: dx = -self.xRes / 2
-                elif steepestDir == 6: dx = -self.xRes / 2; dy = -self.yRes / 2
-                elif steepestDir == 7: dy = -self.yRes / 2
-                elif steepestDir == 8: dx =  self.xRes / 2; dy = -self.yRes / 2
-
-                if steepestDir is not None:
-                    end = QgsPointXY(worldX + dx * scale, worldY + dy * scale)
-                    canvas_center = self.toCanvasCoordinates(center)
-                    canvas_end = self.toCanvasCoordinates(end)
-                    
-                    # distance between points
-                    distance = math.sqrt((canvas_center.x() - canvas_end.x())**2 + (canvas_center.y() - canvas_end.y())**2)
-                    radius = distance / self.radiusRatio
-                    painter.drawEllipse(canvas_center, radius, radius)
-                    painter.drawLine(canvas_center, canvas_end)
-
-    def drawCells(self, painter):
+    def drawsAccumulation(self):
+        return self.draw_flow and self.draw_accumulation and self.grid.accumulation is not None
+
+    def accumulationMaxWeight(self):
+        """Largest log10 accumulation, which the flow width classes scale to, see stickyRange()."""
+        grid = self.grid
+        accumulation = grid.accumulation[~grid.nodata]
+        maxWeight = np.log10(max(accumulation.max(), 1)) if accumulation.size else 0
+        return self.stickyRange("accumulation", 0, float(maxWeight))[1]
+
+    def drawCells(self, painter, geometry):
         if self.draw_cells:
             painter.setPen(QPen(QColor(self.cellBorderColorHex), 1))
-            for x_y_c_r_v_sink_dir in self.x_y_c_r_v_sink_dir_List:
-                worldX, worldY, origCol, origRow, value, isSink, steepestDir = x_y_c_r_v_sink_dir
-                upperLeft = self.toCanvasCoordinates(QgsPointXY(worldX - self.xRes/2, worldY + self.yRes/2))
-                lowerRight = self.toCanvasCoordinates(QgsPointXY(worldX + self.xRes/2, worldY - self.yRes/2))
-                rect = QRectF(upperLeft, lowerRight)
-                painter.drawRect(rect)
-
-    def drawColor(self, painter):
+            if geometry.isAffine:
+                painter.drawLines(geometry.gridLines())
+            else:
+                for line in geometry.gridPolylines():
+                    painter.drawPolyline(line)
+
+    def drawColor(self, painter, geometry):
         if self.draw_colors:
-            for x_y_c_r_v_sink_dir in self.x_y_c_r_v_sink_dir_List:
-                worldX, worldY, origCol, origRow, value, isSink, steepestDir = x_y_c_r_v_sink_dir
-                upperLeft = self.toCanvasCoordinates(QgsPointXY(worldX - self.xRes/2, worldY + self.yRes/2))
-                lowerRight = self.toCanvasCoordinates(QgsPointXY(worldX + self.xRes/2, worldY - self.yRes/2))
-                rect = QRectF(upperLeft, lowerRight)
-                color = self.getColor(value)
-                painter.fillRect(rect, color)
-            
-    
+            values = self.grid.surface(self.colorSurface)[0]
+            vmin, vmax = self.colorRange()
+            lut = self.greyLut if self.colorSurface == "hillshade" else self.colorLut
+            self.drawCellImage(painter, geometry, apply_lut(values[geometry.slices()], vmin, vmax, lut))
+
+    def drawTrace(self, painter, geometry):
+        if self._trace is None:
+            return
+        x, y, mode = self._trace
+        grid = self.grid
+        col = int(np.floor((x - grid.west) / grid.xRes))
+        row = int(np.floor((grid.north - y) / grid.yRes))
+        if not (0 <= row < grid.rows and 0 <= col < grid.cols) or grid.nodata[row, col]:
+            return
 
-    def getColor(self, value):
-        if value is None:
-            return QColor(255, 255, 255, 0)  # transparent
+        color = QColor(self.traceColorHex)
+        if mode == TRACE_UPSTREAM:
+            mask = upstream_mask(grid.directions, grid.nodata, grid.sinks, row, col)
+            mask = mask[geometry.slices()]
+            rgba = np.zeros(mask.shape + (4,), dtype=np.uint8)
+            rgba[mask] = (color.red(), color.green(), color.blue(), 110)
+            self.drawCellImage(painter, geometry, rgba)
+        else:
+            pathRows, pathCols = downstream_path(grid.directions, grid.nodata, grid.sinks, row, col)
+            xs, ys = geometry.toCanvas(pathCols + 0.5, pathRows + 0.5)
+            painter.setPen(QPen(color, 3))
+            painter.drawPolyline(QPolygonF([QPointF(px, py) for px, py in zip(xs.tolist(), ys.tolist())]))
+
+    def drawCellImage(self, painter, geometry, rgba):
+        """Draw one RGBA pixel per cell of the geometry window, scaled over the window.
 
-        # Normalize
-        if self.elevMax == self.elevMin:
-            ratio = 0.5
+        On a reprojected grid the image is drawn in blocks of WARP_BLOCK cells,
+        each mapped onto the quad of its lattice corners.
+        """
+        rows, cols = rgba.shape[:2]
+        firstCol, firstRow, endCol, endRow = geometry.window
+        image = QImage(rgba.data, cols, rows, cols * 4, QImage.Format_RGBA8888).copy()
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform, False)
+        if geometry.isAffine:
+            target = QRectF(QPointF(*geometry.toCanvas(float(firstCol), float(firstRow))),
+                            QPointF(*geometry.toCanvas(float(endCol), float(endRow))))
+            painter.drawImage(target, image)
         else:
-            val = max(self.elevMin, min(self.elevMax, value))
-            ratio = (val - self.elevMin) / (self.elevMax - self.elevMin)
-
-        # convert hex to rgb
-        stops = [
-            (0.0, (0, 191, 191)),  # #00bfbf
-            (0.2, (0, 255, 0)),   # #00ff00
-            (0.4, (255, 255, 0)), # #ffff00
-            (0.6, (255, 127, 0)), # #ff7f00
-            (0.8, (191, 127, 63)),# #bf7f3f
-            (1.0, (20, 21, 20))   # #141514
-        ]
-
-        for i in range(len(stops) - 1):
-            r1, c1 = stops[i]
-            r2, c2 = stops[i + 1]
-            if r1 <= ratio <= r2:
-                # Interpolate between c1 and c2
-                t = (ratio - r1) / (r2 - r1)
-                r = int(c1[0] + (c2[0] - c1[0]) * t)
-                g = int(c1[1] + (c2[1] - c1[1]) * t)
-                b = int(c1[2] + (c2[2] - c1[2]) * t)
-                return QColor(r, g, b, 170)
-
-        return QColor(255, 0, 0)
+            baseTransform = painter.transform()
+            for row0 in range(0, rows, WARP_BLOCK):
+                row1 = min(row0 + WARP_BLOCK, rows)
+                for col0 in range(0, cols, WARP_BLOCK):
+                    col1 = min(col0 + WARP_BLOCK, cols)
+                    source = QPolygonF([QPointF(col0, row0), QPointF(col1, row0),
+                                        QPointF(col1, row1), QPointF(col0, row1)])
+                    target = geometry.latticeQuad(firstRow + row0, firstCol + col0, firstRow + row1, firstCol + col1)
+                    transform = QTransform()
+                    if not QTransform.quadToQuad(source, target, transform):
+                        continue
+                    painter.setTransform(transform * baseTransform)
+                    painter.drawImage(QRectF(col0, row0, col1 - col0, row1 - row0), image,
+                                      QRectF(col0, row0, col1 - col0, row1 - row0))
+        painter.restore()
+
+    def isAffine(self):
+        """Whether the grid is in the canvas CRS, so that it maps to the canvas with one affine transform."""
+        return self.sourceCrs is None or not self.sourceCrs.isValid() or \
+            self.sourceCrs == self._canvas.mapSettings().destinationCrs()
+
+    def cellGeometry(self, window=None):
+        """Canvas geometry of the cells of a (firstCol, firstRow, endCol, endRow) window, all cells by default.
+
+        In the canvas CRS the grid maps to the canvas with one affine transform.
+        Otherwise the cell corners are reprojected once per grid (see
+        LatticeCache) and mapped to the canvas with the affine map-to-pixel
+        transform; None if they cannot be reprojected.
+        """
+        grid = self.grid
+        destinationCrs = self._canvas.mapSettings().destinationCrs()
+        if self.isAffine():
+            origin = self.toCanvasCoordinates(QgsPointXY(grid.west, grid.north))
+            colStep = self.toCanvasCoordinates(QgsPointXY(grid.west + grid.xRes, grid.north)) - origin
+            rowStep = self.toCanvasCoordinates(QgsPointXY(grid.west, grid.north - grid.yRes)) - origin
+            return CellGeometry(grid, origin, colStep, rowStep, window=window)
+
+        lattice = self._lattices.lattice(grid, self.sourceCrs, destinationCrs)
+        if lattice is None:
+            return None
+        mapX, mapY = lattice
+        x0, y0 = float(mapX[0, 0]), float(mapY[0, 0])
+        origin = self.toCanvasCoordinates(QgsPointXY(x0, y0))
+        xStep = self.toCanvasCoordinates(QgsPointXY(x0 + 1, y0)) - origin
+        yStep = self.toCanvasCoordinates(QgsPointXY(x0, y0 + 1)) - origin
+        canvasX = origin.x() + (mapX - x0) * xStep.x() + (mapY - y0) * yStep.x()
+        canvasY = origin.y() + (mapX - x0) * xStep.y() + (mapY - y0) * yStep.y()
+        return CellGeometry(grid, origin, xStep, yStep, (canvasX, canvasY), window)
+
+
+class CellGeometry():
+    """Canvas coordinates of the overlay cells as NumPy arrays.
+
+    The world-to-canvas mapping of the regular grid is affine, so canvas
+    positions are origin + u * colStep + v * rowStep, where (u, v) is the
+    position in cells from the upper-left corner of the grid. On a reprojected
+    grid the mapping is given by the canvas positions of the cell corners
+    (lattice) instead, interpolated bilinearly inside each cell, so that the
+    cells become quads. Only the cells with data of the window
+    (firstCol, firstRow, endCol, endRow) are kept, by default all of them;
+    gridRows and gridCols index the whole grid.
+    """
+
+    # Flow arrow end, in half cells from the center, per direction code (0 = none).
+    FLOW_DX = np.array([0, 1, 1, 0, -1, -1, -1, 0, 1], dtype=np.float64)
+    FLOW_DY = np.array([0, 0, -1, -1, -1, 0, 1, 1, 1], dtype=np.float64)
+    FLOW_SCALE = 0.85 # to avoid touching the cell borders
+    RADIUS_STEP = 0.25 # pixels, the circle radii are rounded to
+
+    def __init__(self, grid:CellGrid, origin, colStep, rowStep, lattice=None, window=None):
+        self.readCols = grid.cols
+        self.readRows = grid.rows
+        self.window = (0, 0, grid.cols, grid.rows) if window is None else window
+        if window is None:
+            self.gridRows, self.gridCols = grid.validCells()
+        else:
+            firstCol, firstRow, endCol, endRow = window
+            self.gridRows, self.gridCols = np.nonzero(~grid.nodata[firstRow:endRow, firstCol:endCol])
+            self.gridRows += firstRow
+            self.gridCols += firstCol
+        self.count = len(self.gridRows)
+        self.values = grid.values[self.gridRows, self.gridCols]
+        self.comparedValues = grid.comparedValues(self.gridRows, self.gridCols)
+        self.origCols = grid.origCol(self.gridCols)
+        self.origRows = grid.origRow(self.gridRows)
+        self.sinks = grid.sinks[self.gridRows, self.gridCols]
+        self.directions = grid.directions[self.gridRows, self.gridCols]
+
+        self._origin = origin
+        self._colStep = colStep
+        self._rowStep = rowStep
+        self._lattice = lattice
+        self.isAffine = lattice is None
+
+        # cell centers, in cells from the upper-left corner of the grid
+        u = self.gridCols + 0.5
+        v = self.gridRows + 0.5
+
+        self.left, self.top = self.toCanvas(u - 0.5, v - 0.5)
+        self.right, self.bottom = self.toCanvas(u + 0.5, v + 0.5)
+        self.centerX, self.centerY = self.toCanvas(u, v)
+        self.flowEndX, self.flowEndY = self.toCanvas(
+            u + self.FLOW_DX[self.directions] * 0.5 * self.FLOW_SCALE,
+            v + self.FLOW_DY[self.directions] * 0.5 * self.FLOW_SCALE,
+        )
+
+    def toCanvas(self, u, v):
+        if self._lattice is None:
+            x = self._origin.x() + u * self._colStep.x() + v * self._rowStep.x()
+            y = self._origin.y() + u * self._colStep.y() + v * self._rowStep.y()
+            return x, y
+        latticeX, latticeY = self._lattice
+        u, v = np.broadcast_arrays(np.asarray(u, dtype=np.float64), np.asarray(v, dtype=np.float64))
+        col = np.clip(np.floor(u).astype(np.int64), 0, self.readCols - 1)
+        row = np.clip(np.floor(v).astype(np.int64), 0, self.readRows - 1)
+        fu = u - col
+        fv = v - row
+        w00 = (1 - fu) * (1 - fv)
+        w01 = fu * (1 - fv)
+        w10 = (1 - fu) * fv
+        w11 = fu * fv
+        x = w00 * latticeX[row, col] + w01 * latticeX[row, col + 1] + \
+            w10 * latticeX[row + 1, col] + w11 * latticeX[row + 1, col + 1]
+        y = w00 * latticeY[row, col] + w01 * latticeY[row, col + 1] + \
+            w10 * latticeY[row + 1, col] + w11 * latticeY[row + 1, col + 1]
+        return x, y
+
+    def latticeQuad(self, row0, col0, row1, col1):
+        """Canvas quad of the lattice corners of a block of cells, clockwise from the upper-left."""
+        latticeX, latticeY = self._lattice
+        return QPolygonF([QPointF(float(latticeX[r, c]), float(latticeY[r, c]))
+                          for r, c in ((row0, col0), (row0, col1), (row1, col1), (row1, col0))])
+
+    def gridPolylines(self):
+        """The cell borders of the window of a reprojected grid, one polyline per lattice row and column."""
+        firstCol, firstRow, endCol, endRow = self.window
+        latticeX, latticeY = self._lattice
+        latticeX = latticeX[firstRow:endRow + 1, firstCol:endCol + 1]
+        latticeY = latticeY[firstRow:endRow + 1, firstCol:endCol + 1]
+        lines = [QPolygonF([QPointF(x, y) for x, y in zip(xs.tolist(), ys.tolist())])
+                 for xs, ys in zip(latticeX, latticeY)]
+        lines.extend(QPolygonF([QPointF(x, y) for x, y in zip(xs.tolist(), ys.tolist())])
+                     for xs, ys in zip(latticeX.T, latticeY.T))
+        return lines
+
+    def slices(self):
+        """(rows, cols) slices of the window in the grid arrays."""
+        firstCol, firstRow, endCol, endRow = self.window
+        return slice(firstRow, endRow), slice(firstCol, endCol)
+
+    def cellRect(self, i):
+        return QRectF(QPointF(self.left[i], self.top[i]), QPointF(self.right[i], self.bottom[i]))
+
+    def gridLines(self):
+        """The lines of the cell borders of the window, one per column and row border."""
+        firstCol, firstRow, endCol, endRow = self.window
+        cols = np.arange(firstCol, endCol + 1, dtype=np.float64)
+        rows = np.arange(firstRow, endRow + 1, dtype=np.float64)
+        x0, y0 = self.toCanvas(cols, float(firstRow))
+        x1, y1 = self.toCanvas(cols, float(endRow))
+        lines = [QLineF(*l) for l in zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist())]
+        x0, y0 = self.toCanvas(float(firstCol), rows)
+        x1, y1 = self.toCanvas(float(endCol), rows)
+        lines.extend(QLineF(*l) for l in zip(x0.tolist(), y0.tolist(), x1.tolist(), y1.tolist()))
+        return lines
+
+    def flowLines(self, mask):
+        """Lines from the center to the flow end of the masked cells."""
+        return [QLineF(*l) for l in zip(self.centerX[mask].tolist(), self.centerY[mask].tolist(),
+                                        self.flowEndX[mask].tolist(), self.flowEndY[mask].tolist())]
+
+    def circleClasses(self, mask, radii):
+        """(radius, centers) of the masked cells, with the radii rounded to RADIUS_STEP pixels.
+
+        On an affine grid there are only a couple of classes (straight and
+        diagonal flow), on a reprojected one a few more.
+        """
+        radiusClasses = np.round(radii[mask] / self.RADIUS_STEP).astype(np.int64)
+        centerX = self.centerX[mask]
+        centerY = self.centerY[mask]
+        for radiusClass in np.unique(radiusClasses).tolist():
+            inClass = radiusClasses == radiusClass
+            yield radiusClass * self.RADIUS_STEP, self.pointsPolygon(centerX[inClass], centerY[inClass])
+
+    @staticmethod
+    def pointsPolygon(x, y):
+        """A polygon of the points, written straight into its buffer of (x, y) doubles."""
+        count = len(x)
+        polygon = QPolygonF(count)
+        if count:
+            buffer = polygon.data()
+            buffer.setsize(count * 2 * np.dtype(np.float64).itemsize)
+            points = np.frombuffer(buffer, dtype=np.float64).reshape(count, 2)
+            points[:, 0] = x
+            points[:, 1] = y
+        return polygon
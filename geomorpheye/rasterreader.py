@@ -0,0 +1,552 @@
+"""Tiled, cached reading of the raster cells GeomorphEye shows.
+
+Every block is read with a one-cell halo, a single provider request for the
+cells and their neighbours, so that the D8 analysis of a block needs nothing
+beyond it. The raster is read and analysed in TILE_SIZE tiles, cached in a
+TileCache under layerKey + (level, tileRow, tileCol), see tile_key():
+layerKey is the (layerId, dataTimestamp, band) of tile_layer_key(), level
+the overview level.
+
+plan_read_window() snaps a canvas extent to the cells it touches, on the
+native grid or on the finest overview level within maxCells, and
+read_raster_data() assembles that ReadWindow from its tiles.
+"""
+from qgis.core import Qgis, QgsRectangle
+import numpy as np
+import math
+
+from .accumulation import FlowGraph, flow_accumulation, stitch_accumulation
+from .analysis import aggregate_window, analyse_window, condition_window
+from .cellgrid import CellGrid
+from .geotransform import GeoTransform, clip_window, expand_window
+from .profiling import profiler
+from .tilecache import ConditionedWindow, Tile
+
+# Side, in cells, of the square tiles the raster is read and analysed in.
+TILE_SIZE = 128
+# Largest overview factor aggregated from native cells; beyond it the
+# provider is asked for the coarse resolution directly.
+MAX_AGGREGATE_FACTOR = 16
+# Cells read around the window for hydrological conditioning, so that its
+# depressions and flats are seen with some of their surroundings. The
+# conditioned window is then grown to whole tiles, so that it is reused while
+# panning within them.
+CONDITION_HALO = 32
+
+
+_QGIS_TO_NUMPY = {
+    Qgis.Byte: np.uint8,
+    Qgis.UInt16: np.uint16,
+    Qgis.Int16: np.int16,
+    Qgis.UInt32: np.uint32,
+    Qgis.Int32: np.int32,
+    Qgis.Float32: np.float32,
+    Qgis.Float64: np.float64,
+}
+if hasattr(Qgis, "Int8"):  # QGIS >= 3.30
+    _QGIS_TO_NUMPY[Qgis.Int8] = np.int8
+
+
+def read_block(provider, band, extent:QgsRectangle, cols:int, rows:int, feedback=None):
+    """Read an extent of the raster in a single provider.block() call.
+
+    Returns (values, nodata) where values is a float64 array of shape (rows, cols)
+    and nodata is a boolean mask of the same shape. Cells outside the raster extent
+    are flagged as nodata, so the extent may overhang the raster (e.g. for a halo).
+    An optional QgsRasterBlockFeedback allows the read to be cancelled.
+    """
+    block = provider.block(band, extent, cols, rows, feedback)
+    dtype = _QGIS_TO_NUMPY.get(block.dataType()) if block.isValid() else None
+    if dtype is None:
+        values = np.full((rows, cols), np.nan)
+        return values, np.ones((rows, cols), dtype=bool)
+
+    raw = np.frombuffer(bytes(block.data()), dtype=dtype, count=rows * cols)
+    values = raw.reshape(rows, cols).astype(np.float64)
+
+    nodata = np.isnan(values)
+    if block.hasNoDataValue():
+        nodata |= values == block.noDataValue()
+    for noDataRange in provider.userNoDataValues(band):
+        nodata |= (values >= noDataRange.min()) & (values <= noDataRange.max())
+
+    # Parts of the request that fall outside the raster come back as filler.
+    rasterExtent = provider.extent()
+    xRes = extent.width() / cols
+    yRes = extent.height() / rows
+    centerX = extent.xMinimum() + (np.arange(cols) + 0.5) * xRes
+    centerY = extent.yMaximum() - (np.arange(rows) + 0.5) * yRes
+    outsideCols = (centerX < rasterExtent.xMinimum()) | (centerX > rasterExtent.xMaximum())
+    outsideRows = (centerY < rasterExtent.yMinimum()) | (centerY > rasterExtent.yMaximum())
+    nodata |= outsideRows[:, None] | outsideCols[None, :]
+
+    return values, nodata
+
+
+def read_window_with_halo(provider, band, readExtent:QgsRectangle, xRes:float, yRes:float,
+                          readCols:int, readRows:int, feedback=None):
+    """Read the snapped read extent plus a one-cell halo in a single block request.
+
+    Returns (values, nodata) of shape (readRows + 2, readCols + 2); the cell at
+    [row + 1, col + 1] corresponds to cell (col, row) of the read extent.
+    """
+    haloExtent = QgsRectangle(
+        readExtent.xMinimum() - xRes, readExtent.yMinimum() - yRes,
+        readExtent.xMaximum() + xRes, readExtent.yMaximum() + yRes,
+    )
+    return read_block(provider, band, haloExtent, readCols + 2, readRows + 2, feedback)
+
+
+def tile_layer_key(rasterLayer, band=1):
+    """Return the (layerId, dataTimestamp, band) prefix of the tile cache keys of a layer band."""
+    timestamp = rasterLayer.dataProvider().dataTimestamp().toMSecsSinceEpoch()
+    return (rasterLayer.id(), timestamp, band)
+
+
+def same_grid(rasterLayer, otherLayer):
+    """True if two raster layers share CRS, cell size and upper-left corner, so that their tiles coincide."""
+    xRes = rasterLayer.rasterUnitsPerPixelX()
+    yRes = rasterLayer.rasterUnitsPerPixelY()
+    extent = rasterLayer.extent()
+    otherExtent = otherLayer.extent()
+    tolerance = 1e-6
+    return rasterLayer.crs() == otherLayer.crs() \
+        and abs(otherLayer.rasterUnitsPerPixelX() - xRes) <= tolerance * xRes \
+        and abs(otherLayer.rasterUnitsPerPixelY() - yRes) <= tolerance * yRes \
+        and abs(otherExtent.xMinimum() - extent.xMinimum()) <= tolerance * xRes \
+        and abs(otherExtent.yMaximum() - extent.yMaximum()) <= tolerance * yRes
+
+
+def has_overviews(provider):
+    """True if the raster has pyramids (e.g. GDAL overviews) the provider can read from."""
+    for pyramid in provider.buildPyramidList():
+        exists = pyramid.getExists() if hasattr(pyramid, "getExists") else pyramid.exists
+        if exists:
+            return True
+    return False
+
+
+def read_tile(provider, rasterExtent:QgsRectangle, xRes:float, yRes:float,
+              tileRow:int, tileCol:int, feedback=None, factor=1, aggregate="mean",
+              useOverviews=False, band=1, analyse=True):
+    """Read and analyse one TILE_SIZE x TILE_SIZE tile of a band of the raster grid.
+
+    xRes and yRes are the native resolution; with factor > 1 the tile belongs to
+    the overview level whose cells are factor x factor native cells. Such a tile is
+    read at the coarse resolution when the raster has overviews (or when the factor
+    is too large to read the native cells), otherwise it is read at the native
+    resolution and aggregated with the given method ("mean" or "min").
+
+    The tile is read with a one-cell halo, so its directions and sinks are exact
+    also along the tile borders. Without analyse only the values are kept, as
+    for compared rasters. Returns None if the read was cancelled.
+    """
+    tileXres = xRes * factor
+    tileYres = yRes * factor
+    west  = rasterExtent.xMinimum() + tileCol * TILE_SIZE * tileXres
+    north = rasterExtent.yMaximum() - tileRow * TILE_SIZE * tileYres
+    tileExtent = QgsRectangle(west, north - TILE_SIZE * tileYres, west + TILE_SIZE * tileXres, north)
+    with profiler.stage("tile.read", TILE_SIZE * TILE_SIZE):
+        if not aggregates_native_cells(factor, useOverviews):
+            values, nodata = read_window_with_halo(
+                provider, band, tileExtent, tileXres, tileYres, TILE_SIZE, TILE_SIZE, feedback)
+        else:
+            haloExtent = QgsRectangle(
+                tileExtent.xMinimum() - tileXres, tileExtent.yMinimum() - tileYres,
+                tileExtent.xMaximum() + tileXres, tileExtent.yMaximum() + tileYres,
+            )
+            haloSize = (TILE_SIZE + 2) * factor
+            values, nodata = read_block(provider, band, haloExtent, haloSize, haloSize, feedback)
+            values, nodata = aggregate_window(values, nodata, factor, aggregate)
+    if feedback is not None and feedback.isCanceled():
+        return None
+    if not analyse:
+        return Tile(values, nodata)
+    with profiler.stage("tile.analyse", TILE_SIZE * TILE_SIZE):
+        directions, sinks, _, _ = analyse_window(values, nodata)
+    return Tile(values, nodata, directions, sinks)
+
+
+def with_flow(tile):
+    """The tile with its FlowGraph, built on first use since only the accumulation needs it."""
+    if tile.flow is not None:
+        return tile
+    return Tile(tile.paddedValues, tile.paddedNodata, tile.directions, tile.sinks,
+                FlowGraph(tile.directions, tile.nodata, tile.sinks))
+
+
+def snap_read_window(gridTransform:GeoTransform, gridCols:int, gridRows:int, canvasExtent:QgsRectangle):
+    """(firstCol, firstRow, endCol, endRow) of the grid cells the canvas extent touches, clipped to the grid."""
+    window = gridTransform.snapWindow(canvasExtent.xMinimum(), canvasExtent.yMinimum(),
+                                      canvasExtent.xMaximum(), canvasExtent.yMaximum())
+    return clip_window(window, gridCols, gridRows)
+
+
+class ReadWindow():
+    """Where a canvas extent falls on the native or an overview grid of a raster.
+
+    Level 0 is the native grid; on level n every cell covers factor = 2 ** n
+    native cells per side. firstCol/firstRow and readCols/readRows locate the
+    window in cells of that level, gridCols/gridRows is the size of the level grid.
+    """
+
+    def __init__(self, level, xRes, yRes, readExtent, firstCol, firstRow, readCols, readRows,
+                 gridCols=None, gridRows=None):
+        self.level = level
+        self.factor = 2 ** level
+        self.xRes = xRes
+        self.yRes = yRes
+        self.readExtent = readExtent
+        self.firstCol = firstCol
+        self.firstRow = firstRow
+        self.readCols = readCols
+        self.readRows = readRows
+        self.gridCols = gridCols
+        self.gridRows = gridRows
+
+    @classmethod
+    def fromWindow(cls, level, gridTransform:GeoTransform, window, gridCols=None, gridRows=None):
+        """The ReadWindow of a (firstCol, firstRow, endCol, endRow) window of the level grid."""
+        firstCol, firstRow, endCol, endRow = window
+        readExtent = QgsRectangle(*gridTransform.windowExtent(window))
+        return cls(level, gridTransform.xRes, gridTransform.yRes, readExtent,
+                   firstCol, firstRow, endCol - firstCol, endRow - firstRow, gridCols, gridRows)
+
+    def window(self):
+        """(firstCol, firstRow, endCol, endRow) of the window."""
+        return self.firstCol, self.firstRow, self.firstCol + self.readCols, self.firstRow + self.readRows
+
+    def gridTransform(self):
+        """GeoTransform of the whole grid of the level."""
+        return GeoTransform(self.readExtent.xMinimum() - self.firstCol * self.xRes,
+                            self.readExtent.yMaximum() + self.firstRow * self.yRes, self.xRes, self.yRes)
+
+    def expanded(self, cells):
+        """The window grown by the given number of cells on every side, clipped to the grid."""
+        window = clip_window(expand_window(self.window(), cells), self.gridCols, self.gridRows)
+        return ReadWindow.fromWindow(self.level, self.gridTransform(), window, self.gridCols, self.gridRows)
+
+    def tileAligned(self):
+        """The window grown to the borders of the tiles it overlaps, clipped to the grid."""
+        firstCol, firstRow, endCol, endRow = self.window()
+        window = (firstCol - firstCol % TILE_SIZE, firstRow - firstRow % TILE_SIZE,
+                  -(-endCol // TILE_SIZE) * TILE_SIZE, -(-endRow // TILE_SIZE) * TILE_SIZE)
+        window = clip_window(window, self.gridCols, self.gridRows)
+        return ReadWindow.fromWindow(self.level, self.gridTransform(), window, self.gridCols, self.gridRows)
+
+    def tiles(self):
+        """(tileRow, tileCol) of every tile the window overlaps."""
+        for tileRow in range(self.firstRow // TILE_SIZE, (self.firstRow + self.readRows - 1) // TILE_SIZE + 1):
+            for tileCol in range(self.firstCol // TILE_SIZE, (self.firstCol + self.readCols - 1) // TILE_SIZE + 1):
+                yield tileRow, tileCol
+
+    def tileOverlap(self, tileRow, tileCol, halo=0):
+        """(inWindow, inTile) slices of the part of a tile that overlaps the window.
+
+        With halo=1 both the window and the tile are taken with their one-cell
+        halo, as in the halo-padded arrays.
+        """
+        windowRow = self.firstRow - halo
+        windowCol = self.firstCol - halo
+        tileFirstRow = tileRow * TILE_SIZE - halo
+        tileFirstCol = tileCol * TILE_SIZE - halo
+        rowStart = max(windowRow, tileFirstRow)
+        rowEnd   = min(self.firstRow + self.readRows + halo, (tileRow + 1) * TILE_SIZE + halo)
+        colStart = max(windowCol, tileFirstCol)
+        colEnd   = min(self.firstCol + self.readCols + halo, (tileCol + 1) * TILE_SIZE + halo)
+        inWindow = (slice(rowStart - windowRow, rowEnd - windowRow),
+                    slice(colStart - windowCol, colEnd - windowCol))
+        inTile = (slice(rowStart - tileFirstRow, rowEnd - tileFirstRow),
+                  slice(colStart - tileFirstCol, colEnd - tileFirstCol))
+        return inWindow, inTile
+
+
+def plan_read_window(rasterExtent:QgsRectangle, rasterXres:float, rasterYres:float,
+                     canvasExtent:QgsRectangle, maxCells:int):
+    """Return the ReadWindow of the canvas extent, None if it is outside the raster.
+
+    When the view holds more than maxCells native cells, the finest overview
+    level that fits is used instead.
+    """
+    if not canvasExtent.intersects(rasterExtent):
+        return None
+
+    rasterCols = int(round(rasterExtent.width() / rasterXres))
+    rasterRows = int(round(rasterExtent.height() / rasterYres))
+    rasterWest  = rasterExtent.xMinimum()
+    rasterNorth = rasterExtent.yMaximum()
+
+    # Start from an estimate of the level, then coarsen until the window fits.
+    visibleCells = (min(canvasExtent.width(), rasterExtent.width()) / rasterXres) * \
+        (min(canvasExtent.height(), rasterExtent.height()) / rasterYres)
+    level = int(math.log(visibleCells / maxCells, 4)) if visibleCells > maxCells else 0
+    while True:
+        factor = 2 ** level
+        xRes = rasterXres * factor
+        yRes = rasterYres * factor
+        gridCols = -(-rasterCols // factor)
+        gridRows = -(-rasterRows // factor)
+        gridTransform = GeoTransform(rasterWest, rasterNorth, xRes, yRes)
+        window = snap_read_window(gridTransform, gridCols, gridRows, canvasExtent)
+        firstCol, firstRow, endCol, endRow = window
+        if (endCol - firstCol) * (endRow - firstRow) <= maxCells or (gridCols == 1 and gridRows == 1):
+            break
+        level += 1
+
+    if endCol == firstCol or endRow == firstRow:
+        return None  # the extents only touch
+    return ReadWindow.fromWindow(level, gridTransform, window, gridCols, gridRows)
+
+
+def aggregates_native_cells(factor, useOverviews):
+    """True if the tiles of an overview factor are aggregated from native cells, not read at their resolution."""
+    return factor > 1 and not useOverviews and factor <= MAX_AGGREGATE_FACTOR
+
+
+def tile_key(layerKey, level, tileRow, tileCol, analyse=True, aggregate="mean", useOverviews=False):
+    """Cache key of a tile; tiles read without analysis have keys of their own.
+
+    The aggregate method is part of the key of the tiles aggregated from
+    native cells, so a tile of another method is never served.
+    """
+    key = layerKey + (level, tileRow, tileCol)
+    if aggregates_native_cells(2 ** level, useOverviews):
+        key += (aggregate,)
+    return key if analyse else key + ("values",)
+
+
+def conditioned_key(layerKey, window, aggregate="mean", useOverviews=False):
+    """Cache key of the conditioned surface of a tile-aligned read window, see tile_key."""
+    key = layerKey + (window.level, "conditioned") + window.window()
+    if aggregates_native_cells(window.factor, useOverviews):
+        key += (aggregate,)
+    return key
+
+
+def cached_tile(provider, rasterExtent:QgsRectangle, rasterXres:float, rasterYres:float,
+                level:int, tileRow:int, tileCol:int, feedback=None, tileCache=None,
+                layerKey=None, aggregate="mean", useOverviews=False, band=1, analyse=True):
+    """Return a tile from the cache, reading, analysing and caching it if missing.
+
+    Without analyse an analysed tile of the cache serves as well. A tile
+    another thread is reading already is waited for rather than read again.
+    Returns None if the read was cancelled.
+    """
+    if tileCache is None:
+        return read_tile(provider, rasterExtent, rasterXres, rasterYres, tileRow, tileCol,
+                         feedback, 2 ** level, aggregate, useOverviews, band, analyse)
+    analysedKey = tile_key(layerKey, level, tileRow, tileCol, True, aggregate, useOverviews)
+    key = tile_key(layerKey, level, tileRow, tileCol, analyse, aggregate, useOverviews)
+    lookup = tileCache.get
+    while True:
+        tile = lookup(analysedKey)
+        if tile is None and not analyse:
+            tile = lookup(key)
+        if tile is not None:
+            return tile
+        if feedback is not None and feedback.isCanceled():
+            return None
+        if tileCache.claim(key, feedback):
+            break
+        # read by another thread meanwhile, or its read was cancelled: look again
+        lookup = tileCache.peek
+    try:
+        tile = read_tile(provider, rasterExtent, rasterXres, rasterYres, tileRow, tileCol,
+                         feedback, 2 ** level, aggregate, useOverviews, band, analyse)
+        if tile is not None:
+            tileCache.put(key, tile)
+    finally:
+        tileCache.release(key)
+    return tile
+
+
+def assemble_window(provider, rasterExtent:QgsRectangle, rasterXres:float, rasterYres:float,
+                    window, feedback=None, tileCache=None, layerKey=None, aggregate="mean",
+                    useOverviews=False, tiles=None, band=1, compare=(), compared=None):
+    """Copy the cells of the window out of its tiles.
+
+    Returns (paddedValues, paddedNodata, directions, sinks), or None if the
+    read was cancelled. The values and the nodata mask come with a one-cell
+    halo, taken from the halos of the tiles; all arrays are
+    (window.readRows, window.readCols) without it. The tiles used are added to
+    the tiles dict, if given, by (tileRow, tileCol).
+
+    compare holds the (provider, band, layerKey) of rasters on the same grid
+    whose values are wanted too; their tiles are read in the same pass, tile
+    by tile, and the (paddedValues, paddedNodata) of each are appended to the
+    compared list.
+    """
+    readCols = window.readCols
+    readRows = window.readRows
+
+    values     = np.empty((readRows + 2, readCols + 2), dtype=np.float64)
+    nodata     = np.empty((readRows + 2, readCols + 2), dtype=bool)
+    directions = np.empty((readRows, readCols), dtype=np.uint8)
+    sinks      = np.empty((readRows, readCols), dtype=bool)
+    compareArrays = [(np.empty_like(values), np.empty_like(nodata)) for _ in compare]
+    compareOverviews = [window.level > 0 and has_overviews(source[0]) for source in compare]
+
+    for tileRow, tileCol in window.tiles():
+        tile = cached_tile(provider, rasterExtent, rasterXres, rasterYres, window.level,
+                           tileRow, tileCol, feedback, tileCache, layerKey, aggregate, useOverviews, band)
+        if tile is None:
+            return None
+        if tiles is not None:
+            tiles[(tileRow, tileCol)] = tile
+
+        # Copy the part of the tile that overlaps the window.
+        inWindow, inTile = window.tileOverlap(tileRow, tileCol, halo=1)
+        values[inWindow]     = tile.paddedValues[inTile]
+        nodata[inWindow]     = tile.paddedNodata[inTile]
+        for (compareProvider, compareBand, compareKey), overviews, (compareValues, compareNodata) in \
+                zip(compare, compareOverviews, compareArrays):
+            compareTile = cached_tile(compareProvider, rasterExtent, rasterXres, rasterYres, window.level,
+                                      tileRow, tileCol, feedback, tileCache, compareKey, aggregate,
+                                      overviews, compareBand, analyse=False)
+            if compareTile is None:
+                return None
+            compareValues[inWindow] = compareTile.paddedValues[inTile]
+            compareNodata[inWindow] = compareTile.paddedNodata[inTile]
+        inWindow, inTile = window.tileOverlap(tileRow, tileCol)
+        directions[inWindow] = tile.directions[inTile]
+        sinks[inWindow]      = tile.sinks[inTile]
+
+    if compared is not None:
+        compared.extend(compareArrays)
+    return values, nodata, directions, sinks
+
+
+def read_raster_data(provider, rasterExtent:QgsRectangle, rasterXres:float, rasterYres:float,
+                     canvasExtent:QgsRectangle, maxCells:int, feedback=None,
+                     tileCache=None, layerKey=None, aggregate="mean", condition=False,
+                     accumulate=False, band=1, compare=()):
+    """Read and analyse the cells of a raster band covering the canvas extent.
+
+    When the view holds more than maxCells native cells, the smallest overview
+    level (cells of 2, 4, 8, ... native cells per side) that fits is used instead.
+    Cells are read and analysed per tile; with a tileCache, tiles are looked up
+    under layerKey + (level, tileRow, tileCol) and only the missing ones are read.
+
+    With condition, the window plus CONDITION_HALO cells on every side, grown
+    to whole tiles, is depression filled and its flats resolved, and directions
+    and sinks come from the conditioned surface; the grid then also carries the
+    fill depth. With a tileCache the conditioned window is cached too, so views
+    within the same tiles, and restyles, do not condition again.
+
+    With accumulate, the grid carries the D8 flow accumulation: over the
+    conditioned window, or else stitched from the flow graphs of the tiles, so
+    it counts all the cells of the tiles the window overlaps.
+
+    compare holds the (provider, band, layerKey) of rasters on the same grid,
+    e.g. a filled DEM or a second epoch; their values come with the grid, read
+    tile by tile along with the analysed band and cached alike.
+
+    Returns a CellGrid at the resolution of the level used, or None when the view
+    is outside the raster or the read was cancelled through the feedback.
+    """
+    window = plan_read_window(rasterExtent, rasterXres, rasterYres, canvasExtent, maxCells)
+    if window is None:
+        return None
+    useOverviews = window.level > 0 and has_overviews(provider)
+
+    readWindow = window.expanded(CONDITION_HALO).tileAligned() if condition else window
+    tiles = {}
+    compared = []
+    with profiler.stage("read", readWindow.readRows * readWindow.readCols):
+        cells = assemble_window(provider, rasterExtent, rasterXres, rasterYres, readWindow,
+                                feedback, tileCache, layerKey, aggregate, useOverviews, tiles,
+                                band, compare, compared)
+    if cells is None:
+        return None
+    paddedValues, paddedNodata, directions, sinks = cells
+    values = paddedValues[1:-1, 1:-1]
+    nodata = paddedNodata[1:-1, 1:-1]
+
+    fillDepth = None
+    accumulation = None
+    if condition:
+        conditionKey = conditioned_key(layerKey, readWindow, aggregate, useOverviews)
+        conditioned = tileCache.peek(conditionKey) if tileCache is not None else None
+        cachedConditioned = conditioned
+        if conditioned is None:
+            with profiler.stage("condition", values.size):
+                filled, conditionedDirections, undrained = condition_window(values, nodata)
+            conditioned = ConditionedWindow(filled - values, conditionedDirections, undrained)
+        if accumulate and conditioned.accumulation is None:
+            with profiler.stage("accumulation", values.size):
+                conditioned = ConditionedWindow(
+                    conditioned.fillDepth, conditioned.directions, conditioned.sinks,
+                    flow_accumulation(conditioned.directions, nodata, conditioned.sinks))
+        if tileCache is not None and conditioned is not cachedConditioned:
+            tileCache.put(conditionKey, conditioned)
+        directions, sinks, fillDepth = conditioned.directions, conditioned.sinks, conditioned.fillDepth
+        if accumulate:
+            accumulation = conditioned.accumulation
+        rowOffset = window.firstRow - readWindow.firstRow
+        colOffset = window.firstCol - readWindow.firstCol
+        inner = (slice(rowOffset, rowOffset + window.readRows),
+                 slice(colOffset, colOffset + window.readCols))
+        padded = (slice(rowOffset, rowOffset + window.readRows + 2),
+                  slice(colOffset, colOffset + window.readCols + 2))
+        directions, sinks, fillDepth = (array[inner].copy() for array in (directions, sinks, fillDepth))
+        paddedValues = paddedValues[padded].copy()
+        paddedNodata = paddedNodata[padded].copy()
+        values = paddedValues[1:-1, 1:-1]
+        nodata = paddedNodata[1:-1, 1:-1]
+        if accumulation is not None:
+            accumulation = accumulation[inner].copy()
+        compared = [(compareValues[padded].copy(), compareNodata[padded].copy())
+                    for compareValues, compareNodata in compared]
+    elif accumulate:
+        with profiler.stage("accumulation", values.size):
+            for (tileRow, tileCol), tile in list(tiles.items()):
+                if tile.flow is None:
+                    # cached again in place of the tile without its graph
+                    tile = tiles[(tileRow, tileCol)] = with_flow(tile)
+                    if tileCache is not None:
+                        tileCache.put(tile_key(layerKey, window.level, tileRow, tileCol, True,
+                                               aggregate, useOverviews), tile)
+            accumulation = np.empty((window.readRows, window.readCols), dtype=np.float64)
+            for (tileRow, tileCol), tileAccumulation in stitch_accumulation(tiles, TILE_SIZE).items():
+                inWindow, inTile = window.tileOverlap(tileRow, tileCol)
+                accumulation[inWindow] = tileAccumulation[inTile]
+
+    readExtent = window.readExtent
+    return CellGrid(readExtent.xMinimum(), readExtent.yMaximum(), window.xRes, window.yRes,
+                    window.firstCol, window.firstRow, values, nodata, directions, sinks,
+                    window.factor, fillDepth, accumulation, paddedValues, paddedNodata,
+                    [(compareValues[1:-1, 1:-1], compareNodata[1:-1, 1:-1])
+                     for compareValues, compareNodata in compared])
+
+
+def prefetch_tiles(provider, rasterExtent:QgsRectangle, rasterXres:float, rasterYres:float,
+                   canvasExtent:QgsRectangle, maxCells:int, tileCache, layerKey,
+                   aggregate="mean", feedback=None, condition=False, band=1, compare=()):
+    """Read and cache the tiles read_raster_data would need for the canvas extent.
+
+    Returns the number of tiles that were read, i.e. were not cached yet.
+    """
+    window = plan_read_window(rasterExtent, rasterXres, rasterYres, canvasExtent, maxCells)
+    if window is None:
+        return 0
+    # (provider, band, layerKey, analyse, useOverviews) of every raster to read.
+    sources = [(provider, band, layerKey, True, window.level > 0 and has_overviews(provider))]
+    sources.extend((compareProvider, compareBand, compareKey, False,
+                    window.level > 0 and has_overviews(compareProvider))
+                   for compareProvider, compareBand, compareKey in compare)
+    if condition:
+        window = window.expanded(CONDITION_HALO).tileAligned()
+    readCount = 0
+    for tileRow, tileCol in window.tiles():
+        for sourceProvider, sourceBand, sourceKey, analyse, useOverviews in sources:
+            if tile_key(sourceKey, window.level, tileRow, tileCol, True, aggregate, useOverviews) in tileCache or \
+                    tile_key(sourceKey, window.level, tileRow, tileCol, analyse, aggregate,
+                             useOverviews) in tileCache:
+                continue
+            if feedback is not None and feedback.isCanceled():
+                return readCount
+            if cached_tile(sourceProvider, rasterExtent, rasterXres, rasterYres, window.level,
+                           tileRow, tileCol, feedback, tileCache, sourceKey, aggregate,
+                           useOverviews, sourceBand, analyse) is not None:
+                readCount += 1
+    return readCount
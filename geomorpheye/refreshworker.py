@@ -0,0 +1,132 @@
+from qgis.PyQt.QtCore import QThread, pyqtSignal
+from qgis.core import QgsRasterBlockFeedback
+
+from .rasterreader import cached_tile, prefetch_tiles, read_raster_data, tile_layer_key
+
+
+def compare_sources(compareLayers):
+    """(provider clone, band, layerKey) of every (rasterLayer, band) to compare, for a worker thread."""
+    return [(layer.dataProvider().clone(), band, tile_layer_key(layer, band)) for layer, band in compareLayers]
+
+
+class OverlayRefreshWorker(QThread):
+    """Reads and analyses the visible raster window in a background thread.
+
+    The worker owns a clone of the data provider, and of the providers of the
+    compared layers, since providers must not be shared between threads.
+    Every job carries the generation it was started for, so the dialog can
+    drop results that belong to an outdated extent.
+
+    Emits:
+        dataReady(generation, grid) — CellGrid as returned by read_raster_data, or None
+    """
+
+    dataReady = pyqtSignal(int, object)
+
+    def __init__(self, generation, rasterLayer, canvasExtent, maxCells, tileCache=None,
+                 aggregate="mean", condition=False, accumulate=False, band=1, compareLayers=()):
+        super().__init__()
+        self.generation = generation
+        self._provider = rasterLayer.dataProvider().clone()
+        self._band = band
+        self._compare = compare_sources(compareLayers)
+        self._rasterExtent = rasterLayer.extent()
+        self._xRes = rasterLayer.rasterUnitsPerPixelX()
+        self._yRes = rasterLayer.rasterUnitsPerPixelY()
+        self._canvasExtent = canvasExtent
+        self._maxCells = maxCells
+        self._tileCache = tileCache
+        self._layerKey = tile_layer_key(rasterLayer, band)
+        self._aggregate = aggregate
+        self._condition = condition
+        self._accumulate = accumulate
+        self._feedback = QgsRasterBlockFeedback()
+
+    def stop(self):
+        """Request cancellation; a cancelled job never emits dataReady."""
+        self._feedback.cancel()
+
+    def isCancelled(self):
+        return self._feedback.isCanceled()
+
+    def run(self):
+        grid = read_raster_data(
+            self._provider, self._rasterExtent, self._xRes, self._yRes,
+            self._canvasExtent, self._maxCells, self._feedback,
+            self._tileCache, self._layerKey, self._aggregate, self._condition,
+            self._accumulate, self._band, self._compare,
+        )
+        if not self._feedback.isCanceled():
+            self.dataReady.emit(self.generation, grid)
+
+
+class TilePrefetchWorker(QThread):
+    """Reads and analyses the tiles of an extent into the tile cache in the background.
+
+    Used to keep the tiles warm that the view is heading to while panning.
+    """
+
+    def __init__(self, rasterLayer, extent, maxCells, tileCache, aggregate="mean", condition=False,
+                 band=1, compareLayers=()):
+        super().__init__()
+        self._provider = rasterLayer.dataProvider().clone()
+        self._band = band
+        self._compare = compare_sources(compareLayers)
+        self._rasterExtent = rasterLayer.extent()
+        self._xRes = rasterLayer.rasterUnitsPerPixelX()
+        self._yRes = rasterLayer.rasterUnitsPerPixelY()
+        self._extent = extent
+        self._maxCells = maxCells
+        self._tileCache = tileCache
+        self._layerKey = tile_layer_key(rasterLayer, band)
+        self._aggregate = aggregate
+        self._condition = condition
+        self._feedback = QgsRasterBlockFeedback()
+
+    def stop(self):
+        self._feedback.cancel()
+
+    def run(self):
+        prefetch_tiles(
+            self._provider, self._rasterExtent, self._xRes, self._yRes,
+            self._extent, self._maxCells, self._tileCache, self._layerKey,
+            self._aggregate, self._feedback, self._condition, self._band, self._compare,
+        )
+
+
+class TileFetchWorker(QThread):
+    """Reads and analyses one native tile into the tile cache in the background.
+
+    Used by the cell inspector for the cells under the cursor that no tile
+    covers yet.
+
+    Emits:
+        tileReady(tileRow, tileCol) — the tile is in the cache
+    """
+
+    tileReady = pyqtSignal(int, int)
+
+    def __init__(self, rasterLayer, tileCache, tileRow, tileCol, band=1):
+        super().__init__()
+        self.tileRow = tileRow
+        self.tileCol = tileCol
+        self._provider = rasterLayer.dataProvider().clone()
+        self._band = band
+        self._rasterExtent = rasterLayer.extent()
+        self._xRes = rasterLayer.rasterUnitsPerPixelX()
+        self._yRes = rasterLayer.rasterUnitsPerPixelY()
+        self._tileCache = tileCache
+        self._layerKey = tile_layer_key(rasterLayer, band)
+        self._feedback = QgsRasterBlockFeedback()
+
+    def stop(self):
+        self._feedback.cancel()
+
+    def run(self):
+        tile = cached_tile(
+            self._provider, self._rasterExtent, self._xRes, self._yRes, 0,
+            self.tileRow, self.tileCol, self._feedback, self._tileCache, self._layerKey,
+            band=self._band,
+        )
+        if tile is not None:
+            self.tileReady.emit(self.tileRow, self.tileCol)
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+from qgis.core import QgsCoordinateTransform, QgsCsException, QgsLineString, QgsProject
+import numpy as np
+
+from .cellgrid import CellGrid
+
+
+def corner_lattice(grid:CellGrid, transform:QgsCoordinateTransform):
+    """Map coordinates of the (rows + 1) x (cols + 1) cell corners of a grid.
+
+    All corners are transformed in one batched call. Returns (x, y) arrays,
+    or None if the transformation failed.
+    """
+    cornerX = grid.west + np.arange(grid.cols + 1) * grid.xRes
+    cornerY = grid.north - np.arange(grid.rows + 1) * grid.yRes
+    x, y = np.meshgrid(cornerX, cornerY)
+    corners = QgsLineString(x.ravel().tolist(), y.ravel().tolist())
+    try:
+        corners.transform(transform)
+    except QgsCsException:
+        return None
+    shape = (grid.rows + 1, grid.cols + 1)
+    return np.array(corners.xVector()).reshape(shape), np.array(corners.yVector()).reshape(shape)
+
+
+class LatticeCache():
+    """Corner lattices of the last few grids, by grid extent, shape and CRS pair.
+
+    Restyling or zooming without new data then reuses the lattice; a pan reads
+    a new grid and transforms its corners once.
+    """
+
+    def __init__(self, maxEntries=4):
+        self.maxEntries = maxEntries
+        self._lattices = OrderedDict()
+
+    def lattice(self, grid:CellGrid, sourceCrs, destinationCrs):
+        key = (grid.west, grid.north, grid.xRes, grid.yRes, grid.rows, grid.cols,
+               sourceCrs.toWkt(), destinationCrs.toWkt())
+        if key in self._lattices:
+            self._lattices.move_to_end(key)
+            return self._lattices[key]
+        transform = QgsCoordinateTransform(sourceCrs, destinationCrs, QgsProject.instance())
+        lattice = corner_lattice(grid, transform)
+        self._lattices[key] = lattice
+        while len(self._lattices) > self.maxEntries:
+            self._lattices.popitem(last=False)
+        return lattice
+
+    def clear(self):
+        self._lattices.clear()
+
+
+def transform_extent(extent, sourceCrs, destinationCrs):
+    """The bounding box of the extent in the destination CRS, None if it cannot be transformed."""
+    if sourceCrs == destinationCrs:
+        return extent
+    transform = QgsCoordinateTransform(sourceCrs, destinationCrs, QgsProject.instance())
+    try:
+        return transform.transformBoundingBox(extent)
+    except QgsCsException:
+        return None
+
+
+def transform_point(point, sourceCrs, destinationCrs):
+    """The point in the destination CRS, None if it cannot be transformed."""
+    if sourceCrs == destinationCrs:
+        return point
+    transform = QgsCoordinateTransform(sourceCrs, destinationCrs, QgsProject.instance())
+    try:
+        return transform.transform(point)
+    except QgsCsException:
+        return None
@@ -0,0 +1,155 @@
+from collections import OrderedDict
+import threading
+
+
+class Tile():
+    """Raw values and derived D8 arrays of one square block of raster cells.
+
+    The values and nodata mask are kept with the one-cell halo the tile was
+    analysed with; values and nodata are views of their inner cells. flow is
+    the FlowGraph of the tile, used to stitch the flow accumulation of a
+    window from its tiles; it is only built once the accumulation is asked
+    for. Tiles of compared rasters are not analysed and only have values.
+    """
+
+    def __init__(self, paddedValues, paddedNodata, directions=None, sinks=None, flow=None):
+        self.paddedValues = paddedValues
+        self.paddedNodata = paddedNodata
+        self.values = paddedValues[1:-1, 1:-1]
+        self.nodata = paddedNodata[1:-1, 1:-1]
+        self.directions = directions
+        self.sinks = sinks
+        self.flow = flow
+        self.nbytes = paddedValues.nbytes + paddedNodata.nbytes
+        for derived in (directions, sinks, flow):
+            if derived is not None:
+                self.nbytes += derived.nbytes
+
+
+class ConditionedWindow():
+    """Hydrologically conditioned surface of a tile-aligned read window.
+
+    Cached next to the tiles it was conditioned from: the fill depth, the D8
+    directions and the undrained cells, and the flow accumulation once it is
+    asked for.
+    """
+
+    def __init__(self, fillDepth, directions, sinks, accumulation=None):
+        self.fillDepth = fillDepth
+        self.directions = directions
+        self.sinks = sinks
+        self.accumulation = accumulation
+        self.nbytes = fillDepth.nbytes + directions.nbytes + sinks.nbytes
+        if accumulation is not None:
+            self.nbytes += accumulation.nbytes
+
+
+class TileCache():
+    """Thread-safe LRU cache of tiles bounded by a memory budget.
+
+    Keys are tuples starting with the layer id, usually
+    (layerId, dataTimestamp, band, level, tileRow, tileCol), so that all
+    tiles of a layer can be dropped at once when its data changes; the
+    ConditionedWindows of a layer are kept alike. get() counts hits and
+    misses for hitRate().
+
+    claim() and release() track the tiles being read, so that a refresh and a
+    prefetch never read the same missing tile at once.
+    """
+
+    def __init__(self, maxBytes):
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.maxBytes = maxBytes
+        self.hits = 0
+        self.misses = 0
+        self._reading = set()
+        self._readDone = threading.Condition()
+
+    def get(self, key):
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return tile
+
+    def peek(self, key):
+        """Like get(), but without counting towards hitRate()."""
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+            return tile
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._tiles
+
+    def put(self, key, tile):
+        with self._lock:
+            old = self._tiles.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._tiles[key] = tile
+            self._bytes += tile.nbytes
+            self._evict()
+
+    def claim(self, key, feedback=None, pollSeconds=0.05):
+        """Claim the read of a missing tile; True if the caller is to read it.
+
+        While another thread reads it, waits until it is done and returns
+        False, so that the caller looks it up again; the wait ends early, also
+        with False, once the feedback is cancelled. Every claim that returned
+        True must be followed by release().
+        """
+        with self._readDone:
+            while key in self._reading:
+                if feedback is not None and feedback.isCanceled():
+                    return False
+                self._readDone.wait(pollSeconds)
+            if key in self:
+                return False
+            self._reading.add(key)
+            return True
+
+    def release(self, key):
+        """End a read claimed with claim(), whether the tile was put or not."""
+        with self._readDone:
+            self._reading.discard(key)
+            self._readDone.notify_all()
+
+    def setMaxBytes(self, maxBytes):
+        with self._lock:
+            self.maxBytes = maxBytes
+            self._evict()
+
+    def invalidateLayer(self, layerId):
+        with self._lock:
+            for key in [k for k in self._tiles if k[0] == layerId]:
+                self._bytes -= self._tiles.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+            self._bytes = 0
+
+    def hitRate(self):
+        """Share of the get() calls that found their tile, None before the first one."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def sizeBytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def _evict(self):
+        # Always keep the most recent tile, even if it alone exceeds the budget.
+        while self._bytes > self.maxBytes and len(self._tiles) > 1:
+            _, tile = self._tiles.popitem(last=False)
+            self._bytes -= tile.nbytes
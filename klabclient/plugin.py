@@ -11,6 +11,7 @@ from qgis.utils import iface
 
 from .klabclient_dialog import Ui_Dialog
 from .klab_worker import KlabConnectionWorker, KlabInstallWorker, KlabObservationWorker
+from .geotransform import snap_extent
 from .ui import IconKlabClient
 
 
@@ -170,7 +171,6 @@ class KlabClientDialog(QDialog, Ui_Dialog):
 
     def _snap_extent_to_grid(self, xmin, ymin, xmax, ymax, crs_id, resolution_str):
         """Expand the extent so all four edges fall on resolution-grid lines."""
-        import math
         res = self._resolution_in_crs_units(resolution_str, crs_id)
         if res is None or res <= 0:
             iface.messageBar().pushWarning(
@@ -178,12 +178,7 @@ class KlabClientDialog(QDialog, Ui_Dialog):
                 f"Could not parse resolution '{resolution_str}' — extent unchanged",
             )
             return xmin, ymin, xmax, ymax
-        return (
-            math.floor(xmin / res) * res,
-            math.floor(ymin / res) * res,
-            math.ceil(xmax / res) * res,
-            math.ceil(ymax / res) * res,
-        )
+        return snap_extent(xmin, ymin, xmax, ymax, res)
 
     def _resolution_in_crs_units(self, resolution_str, crs_id):
         """Return the resolution value expressed in the native units of crs_id."""
@@ -0,0 +1,73 @@
+from bisect import bisect_left
+import os
+import sys
+
+RASTER_EXTENSIONS = ('.asc', '.tif', '.tiff')
+# File names are matched regardless of case where the file systems usually
+# ignore it, as os.path.exists does there.
+CASE_INSENSITIVE = sys.platform.startswith(('win', 'darwin'))
+
+
+class FolderIndex():
+    """The entry names of a raster folder, scanned once, for exact and prefix lookups.
+
+    Exact lookups go through a dict; prefix lookups bisect the sorted names of
+    the raster files, so both are O(log n) at most, whatever the folder size.
+    With case_insensitive, on Windows and macOS by default, the names are
+    indexed casefolded and looked up alike, and the entry name found is used.
+    """
+
+    def __init__(self, folder, mtime, names, case_insensitive=CASE_INSENSITIVE):
+        self.folder = folder
+        self.mtime = mtime
+        self.case_insensitive = case_insensitive
+        # entry name by indexed name, and the sorted (indexed name, entry name) of the rasters
+        self.names = {self.key(name): name for name in names}
+        self.raster_names = sorted((key, name) for key, name in self.names.items()
+                                   if key.endswith(RASTER_EXTENSIONS))
+        self.raster_keys = [key for key, _ in self.raster_names]
+
+    def key(self, name):
+        """The name as indexed: casefolded if the index is case insensitive."""
+        return name.casefold() if self.case_insensitive else name
+
+    @classmethod
+    def scan(cls, folder):
+        # stat before scanning: an entry added meanwhile changes the mtime and triggers a rescan
+        mtime = os.stat(folder).st_mtime_ns
+        with os.scandir(folder) as entries:
+            names = [entry.name for entry in entries]
+        return cls(folder, mtime, names)
+
+    def find_prefix(self, prefix):
+        """The first raster file name, in sorted order, that starts with prefix, None if there is none."""
+        prefix = self.key(prefix)
+        i = bisect_left(self.raster_keys, prefix)
+        if i < len(self.raster_keys) and self.raster_keys[i].startswith(prefix):
+            return self.raster_names[i][1]
+        return None
+
+    def resolve(self, raster_name):
+        """Path of the raster named raster_name, or of a raster file starting with it, None if missing."""
+        if os.sep in raster_name or (os.altsep and os.altsep in raster_name):
+            # a path below the folder, not one of its entries
+            raster_path = os.path.join(self.folder, raster_name)
+            return raster_path if os.path.exists(raster_path) else None
+        entry_name = self.names.get(self.key(raster_name)) or self.find_prefix(raster_name)
+        if entry_name is None:
+            # e.g. a case insensitive folder on a platform assumed case sensitive
+            raster_path = os.path.join(self.folder, raster_name)
+            return raster_path if os.path.exists(raster_path) else None
+        return os.path.join(self.folder, entry_name)
+
+
+_indexes = {}
+
+
+def folder_index(folder):
+    """The FolderIndex of a folder, cached until the folder mtime changes."""
+    index = _indexes.get(folder)
+    if index is None or index.mtime != os.stat(folder).st_mtime_ns:
+        index = FolderIndex.scan(folder)
+        _indexes[folder] = index
+    return index
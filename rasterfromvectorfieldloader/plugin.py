@@ -8,6 +8,7 @@ from qgis.PyQt.QtWidgets import QApplication
 from qgis.PyQt.QtCore import Qt
 from qgis.PyQt.QtGui import QIcon
 from .ui import IconRasterLoader
+from .folderindex import folder_index
 
 class RasterLoaderPlugin(QDialog, Ui_Dialog):
     def __init__(self, iface):
@@ -99,6 +100,9 @@ class RasterLoaderPlugin(QDialog, Ui_Dialog):
             self.reset_ui()
             return
 
+        # scanned once per folder change instead of listing the folder for every missing name
+        index = folder_index(raster_folder)
+
         total = len(features)
         loaded_rasters = set()
         for i, feature in enumerate(features, start=1):
@@ -107,17 +111,11 @@ class RasterLoaderPlugin(QDialog, Ui_Dialog):
             if not raster_name:
                 continue
 
-            raster_path = os.path.join(raster_folder, raster_name)
-            if not os.path.exists(raster_path):
-                # try to find in the folder anything that starts with that name and ends with .asc, .tif or .tiff
-                for f in os.listdir(raster_folder):
-                    if f.startswith(raster_name) and f.endswith(('.asc', '.tif', '.tiff')):
-                        raster_path = os.path.join(raster_folder, f)
-                        break
-
-                if raster_path is None or not os.path.exists(raster_path):
-                    iface.messageBar().pushWarning("Raster Missing", f"Raster '{raster_name}' not found.")
-                    continue
+            # the exact name, else anything that starts with that name and ends with .asc, .tif or .tiff
+            raster_path = index.resolve(raster_name)
+            if raster_path is None:
+                iface.messageBar().pushWarning("Raster Missing", f"Raster '{raster_name}' not found.")
+                continue
 
 
             if raster_path in loaded_rasters:
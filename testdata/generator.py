@@ -1,27 +1,288 @@
-ncols = 40
-nrows = 50
-xllcorner = 500000
-yllcorner = 5100000
-cellsize = 10
-nodata = -9999
-testFileName = f"test_{nrows}x{ncols}.asc"
-novaluePosition = 10
-
-with open(testFileName, "w") as f:
-    f.write(f"ncols         {ncols}\n")
-    f.write(f"nrows         {nrows}\n")
-    f.write(f"xllcorner     {xllcorner}\n")
-    f.write(f"yllcorner     {yllcorner}\n")
-    f.write(f"cellsize      {cellsize}\n")
-    f.write(f"NODATA_value  {nodata}\n")
-
-    val = 1.0
-    for i in range(nrows):
-        for j in range(ncols):
-            if i == novaluePosition and j == novaluePosition:
-                f.write(f"{nodata} ")
-            else:
-                f.write(f"{val} ")
-                val += 1.0
-        f.write("\n")
-print(f"Test file '{testFileName}' generated with dimensions {ncols}x{nrows}, NODATA value at position ({novaluePosition}, {novaluePosition}).")
+"""Synthetic DEM generator for testing and benchmarking the plugins.
+
+Library:
+
+    values, nodata = generate_dem(1000, 1000, seed=1, pits=50, flats=5, holes=3)
+    write_dem("dem.tif", values, nodata)
+
+Command line:
+
+    python generator.py dem.tif --rows 1000 --cols 1000 --pits 50 --flats 5 --holes 3
+    python generator.py tiles/ --tiles 2000 --rows 200 --cols 200 --format tif
+    python generator.py --legacy
+
+--legacy writes the checked-in fixture test_50x40.asc again: the values 1, 2, 3, ...
+row by row, with one nodata cell.
+
+Terrain is fractal value noise evaluated on the global cell lattice, so adjacent
+windows of the same seed (e.g. the tiles of a folder) join without seams. GeoTIFF
+output needs GDAL (osgeo); ASCII grids are written with np.savetxt.
+"""
+import argparse
+import math
+import os
+
+import numpy as np
+
+NODATA_VALUE = -9999.0
+DEFAULT_XLL = 500000.0
+DEFAULT_YLL = 5100000.0
+DEFAULT_CELLSIZE = 10.0
+
+
+def _lattice(ix, iy, seed, octave):
+    """Deterministic pseudo random values in [0, 1) for integer lattice points."""
+    h = (ix.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) \
+        ^ (iy.astype(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)) \
+        ^ np.uint64((seed * 0x165667B19E3779F9 + octave * 0x27D4EB2F165667C5) % 2**64)
+    # splitmix64 finalizer
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    return (h >> np.uint64(11)).astype(np.float64) / float(2**53)
+
+
+def _value_noise(rows, cols, firstRow, firstCol, scale, seed, octave):
+    """Smoothly interpolated lattice noise with one lattice point every scale cells."""
+    y = (firstRow + np.arange(rows)) / scale
+    x = (firstCol + np.arange(cols)) / scale
+    iy0 = np.floor(y).astype(np.int64)
+    ix0 = np.floor(x).astype(np.int64)
+    ty = y - iy0
+    tx = x - ix0
+    ty = ty * ty * (3 - 2 * ty)
+    tx = tx * tx * (3 - 2 * tx)
+
+    # Lattice values only for the points the window touches.
+    latY = np.arange(iy0[0], iy0[-1] + 2)
+    latX = np.arange(ix0[0], ix0[-1] + 2)
+    lattice = _lattice(latX[np.newaxis, :], latY[:, np.newaxis], seed, octave)
+    r0 = (iy0 - latY[0])[:, np.newaxis]
+    c0 = (ix0 - latX[0])[np.newaxis, :]
+    top = lattice[r0, c0] * (1 - tx) + lattice[r0, c0 + 1] * tx
+    bottom = lattice[r0 + 1, c0] * (1 - tx) + lattice[r0 + 1, c0 + 1] * tx
+    return top * (1 - ty[:, np.newaxis]) + bottom * ty[:, np.newaxis]
+
+
+def fractal_terrain(rows, cols, firstRow=0, firstCol=0, seed=0, octaves=6,
+                    baseScale=256.0, persistence=0.5, relief=1000.0, base=100.0):
+    """Fractal (fBm) value noise elevations of the window at (firstRow, firstCol)."""
+    terrain = np.zeros((rows, cols), dtype=np.float64)
+    amplitude = 1.0
+    totalAmplitude = 0.0
+    for octave in range(octaves):
+        scale = max(baseScale / 2**octave, 1.0)
+        terrain += amplitude * _value_noise(rows, cols, firstRow, firstCol, scale, seed, octave)
+        totalAmplitude += amplitude
+        amplitude *= persistence
+    return base + relief * terrain / totalAmplitude
+
+
+def inject_pits(values, count, depth, rng):
+    """Lower count random cells by depth below their lowest neighbour."""
+    rows, cols = values.shape
+    if count <= 0 or rows < 3 or cols < 3:
+        return
+    r = rng.integers(1, rows - 1, count)
+    c = rng.integers(1, cols - 1, count)
+    lowest = np.min([values[r + dr, c + dc]
+                     for dr in (-1, 0, 1) for dc in (-1, 0, 1) if dr or dc], axis=0)
+    values[r, c] = lowest - depth
+
+
+def inject_flats(values, count, size, rng):
+    """Replace count random square areas of side size with their mean elevation."""
+    rows, cols = values.shape
+    size = min(size, rows, cols)
+    for r, c in zip(rng.integers(0, rows - size + 1, count), rng.integers(0, cols - size + 1, count)):
+        area = values[r:r + size, c:c + size]
+        area[:] = area.mean()
+
+
+def nodata_holes(shape, count, radius, rng):
+    """Mask of count random circular holes of the given radius."""
+    rows, cols = shape
+    nodata = np.zeros(shape, dtype=bool)
+    for r, c in zip(rng.integers(0, rows, count), rng.integers(0, cols, count)):
+        r0, r1 = max(0, r - radius), min(rows, r + radius + 1)
+        c0, c1 = max(0, c - radius), min(cols, c + radius + 1)
+        dy = np.arange(r0, r1)[:, np.newaxis] - r
+        dx = np.arange(c0, c1)[np.newaxis, :] - c
+        nodata[r0:r1, c0:c1] |= dx * dx + dy * dy <= radius * radius
+    return nodata
+
+
+def generate_dem(rows, cols, seed=0, firstRow=0, firstCol=0, pits=0, pitDepth=5.0,
+                 flats=0, flatSize=16, holes=0, holeRadius=8, **terrainArgs):
+    """Generate a synthetic DEM window.
+
+    Returns (values, nodata): float64 elevations of shape (rows, cols) and the
+    boolean mask of the nodata holes. Extra keyword arguments go to fractal_terrain.
+    """
+    values = fractal_terrain(rows, cols, firstRow, firstCol, seed, **terrainArgs)
+    rng = np.random.default_rng([seed, firstRow, firstCol])
+    inject_flats(values, flats, flatSize, rng)
+    inject_pits(values, pits, pitDepth, rng)
+    nodata = nodata_holes(values.shape, holes, holeRadius, rng)
+    return values, nodata
+
+
+def write_asc(path, values, nodata=None, xll=DEFAULT_XLL, yll=DEFAULT_YLL,
+              cellsize=DEFAULT_CELLSIZE, nodataValue=NODATA_VALUE, fmt="%.3f"):
+    rows, cols = values.shape
+    if nodata is not None:
+        values = np.where(nodata, nodataValue, values)
+    header = (f"ncols         {cols}\n"
+              f"nrows         {rows}\n"
+              f"xllcorner     {xll}\n"
+              f"yllcorner     {yll}\n"
+              f"cellsize      {cellsize}\n"
+              f"NODATA_value  {nodataValue}")
+    np.savetxt(path, values, fmt=fmt, header=header, comments="")
+
+
+def write_geotiff(path, values, nodata=None, xll=DEFAULT_XLL, yll=DEFAULT_YLL,
+                  cellsize=DEFAULT_CELLSIZE, nodataValue=NODATA_VALUE, epsg=32632,
+                  blockSize=256, overviews=True):
+    """Write a tiled, DEFLATE compressed Float32 GeoTIFF, with internal overviews."""
+    from osgeo import gdal, osr
+
+    gdal.UseExceptions()
+    rows, cols = values.shape
+    if nodata is not None:
+        values = np.where(nodata, nodataValue, values)
+    options = ["TILED=YES", f"BLOCKXSIZE={blockSize}", f"BLOCKYSIZE={blockSize}",
+               "COMPRESS=DEFLATE", "PREDICTOR=3", "BIGTIFF=IF_SAFER"]
+    dataset = gdal.GetDriverByName("GTiff").Create(path, cols, rows, 1, gdal.GDT_Float32, options)
+    dataset.SetGeoTransform((xll, cellsize, 0.0, yll + rows * cellsize, 0.0, -cellsize))
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    dataset.SetProjection(srs.ExportToWkt())
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(nodataValue)
+    band.WriteArray(values.astype(np.float32))
+
+    if overviews:
+        levels = []
+        factor = 2
+        while min(rows, cols) / factor >= blockSize / 2:
+            levels.append(factor)
+            factor *= 2
+        if levels:
+            dataset.BuildOverviews("AVERAGE", levels)
+    dataset.FlushCache()
+    dataset = None
+
+
+def write_dem(path, values, nodata=None, **kwargs):
+    """Write an ASCII grid or a GeoTIFF, depending on the path extension."""
+    if path.lower().endswith((".tif", ".tiff")):
+        write_geotiff(path, values, nodata, **kwargs)
+    else:
+        kwargs.pop("epsg", None)
+        write_asc(path, values, nodata, **kwargs)
+
+
+def legacy_dem(rows=50, cols=40, nodataPosition=10):
+    """The increasing values of the test_<rows>x<cols>.asc fixtures, nodata at (nodataPosition, nodataPosition).
+
+    Returns (values, nodata); the values count up from 1 row by row, skipping the nodata cell.
+    """
+    nodata = np.zeros((rows, cols), dtype=bool)
+    if nodataPosition < rows and nodataPosition < cols:
+        nodata[nodataPosition, nodataPosition] = True
+    values = np.zeros((rows, cols))
+    values[~nodata] = np.arange(1, rows * cols - nodata.sum() + 1)
+    return values, nodata
+
+
+def write_legacy_asc(path, values, nodata, xll=int(DEFAULT_XLL), yll=int(DEFAULT_YLL),
+                     cellsize=int(DEFAULT_CELLSIZE), nodataValue=int(NODATA_VALUE)):
+    """Write an ASCII grid in the layout of the checked-in fixtures, so that they are reproduced byte for byte."""
+    rows, cols = values.shape
+    cells = np.where(nodata, str(nodataValue), values.astype(str))
+    with open(path, "w") as f:
+        f.write(f"ncols         {cols}\n"
+                f"nrows         {rows}\n"
+                f"xllcorner     {xll}\n"
+                f"yllcorner     {yll}\n"
+                f"cellsize      {cellsize}\n"
+                f"NODATA_value  {nodataValue}\n")
+        for row in cells:
+            f.write(" ".join(row) + " \n")
+
+
+def generate_tiles(folder, count, rows, cols, extension="tif", prefix="tile", seed=0,
+                   xll=DEFAULT_XLL, yll=DEFAULT_YLL, cellsize=DEFAULT_CELLSIZE, **demArgs):
+    """Write count adjacent tiles of rows x cols cells, arranged in a near square mosaic.
+
+    Tiles are named <prefix>_<row>_<col>.<extension>, row 0 being the northernmost.
+    Returns the list of written paths.
+    """
+    os.makedirs(folder, exist_ok=True)
+    tileCols = math.ceil(math.sqrt(count))
+    tileRows = math.ceil(count / tileCols)
+    digits = len(str(max(tileRows, tileCols)))
+    paths = []
+    for i in range(count):
+        tileRow, tileCol = divmod(i, tileCols)
+        values, nodata = generate_dem(rows, cols, seed, tileRow * rows, tileCol * cols, **demArgs)
+        path = os.path.join(folder, f"{prefix}_{tileRow:0{digits}d}_{tileCol:0{digits}d}.{extension}")
+        write_dem(path, values, nodata, xll=xll + tileCol * cols * cellsize,
+                  yll=yll + (tileRows - tileRow - 1) * rows * cellsize, cellsize=cellsize)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic DEMs.")
+    parser.add_argument("output", nargs="?", default=None,
+                        help="output .asc/.tif file, or folder with --tiles "
+                             "(default dem_<rows>x<cols>.asc, test_<rows>x<cols>.asc with --legacy)")
+    parser.add_argument("--rows", type=int, default=50)
+    parser.add_argument("--cols", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--relief", type=float, default=1000.0, help="elevation range of the noise")
+    parser.add_argument("--octaves", type=int, default=6)
+    parser.add_argument("--scale", type=float, default=256.0, help="cells of the coarsest noise feature")
+    parser.add_argument("--pits", type=int, default=0, help="number of single cell pits")
+    parser.add_argument("--flats", type=int, default=0, help="number of flat square areas")
+    parser.add_argument("--flat-size", type=int, default=16)
+    parser.add_argument("--holes", type=int, default=0, help="number of circular nodata holes")
+    parser.add_argument("--hole-radius", type=int, default=8)
+    parser.add_argument("--cellsize", type=float, default=DEFAULT_CELLSIZE)
+    parser.add_argument("--xll", type=float, default=DEFAULT_XLL)
+    parser.add_argument("--yll", type=float, default=DEFAULT_YLL)
+    parser.add_argument("--tiles", type=int, default=0, help="write this many tiles into the output folder")
+    parser.add_argument("--format", choices=["asc", "tif"], default="tif", help="tile format with --tiles")
+    parser.add_argument("--legacy", action="store_true",
+                        help="write the increasing values of the test_<rows>x<cols>.asc fixtures instead")
+    args = parser.parse_args(argv)
+
+    demArgs = dict(pits=args.pits, flats=args.flats, flatSize=args.flat_size, holes=args.holes,
+                   holeRadius=args.hole_radius, relief=args.relief, octaves=args.octaves,
+                   baseScale=args.scale)
+    if args.tiles:
+        folder = args.output or "tiles"
+        paths = generate_tiles(folder, args.tiles, args.rows, args.cols, args.format, seed=args.seed,
+                               xll=args.xll, yll=args.yll, cellsize=args.cellsize, **demArgs)
+        print(f"{len(paths)} tiles of {args.rows}x{args.cols} cells written to '{folder}'.")
+        return
+
+    if args.legacy:
+        output = args.output or f"test_{args.rows}x{args.cols}.asc"
+        values, nodata = legacy_dem(args.rows, args.cols)
+        write_legacy_asc(output, values, nodata)
+        print(f"Test file '{output}' generated with {args.rows} rows and {args.cols} cols.")
+        return
+
+    output = args.output or f"dem_{args.rows}x{args.cols}.asc"
+    values, nodata = generate_dem(args.rows, args.cols, args.seed, **demArgs)
+    write_dem(output, values, nodata, xll=args.xll, yll=args.yll, cellsize=args.cellsize)
+    print(f"DEM '{output}' generated with {args.rows} rows and {args.cols} cols.")
+
+
+if __name__ == "__main__":
+    main()
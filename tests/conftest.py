@@ -0,0 +1,18 @@
+"""Tests of the Qt-free plugin modules (GeomorphEye analysis, accumulation, ...).
+
+They run without QGIS: the plugin packages are registered without running
+their __init__, which loads the plugin and with it QGIS. Run with
+
+    pytest tests
+"""
+import os
+import sys
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for name in ("geomorpheye", "rasterfromvectorfieldloader"):
+    if name not in sys.modules:
+        package = types.ModuleType(name)
+        package.__path__ = [os.path.join(ROOT, name)]
+        sys.modules[name] = package
@@ -0,0 +1,64 @@
+"""Stitched accumulation against the accumulation of the whole window."""
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from geomorpheye.accumulation import FlowGraph, flow_accumulation, stitch_accumulation
+from geomorpheye.analysis import NO_DIRECTION, analyse_window
+
+
+def tiles_of(values, nodata, tileSize):
+    """The tiles of a window, each analysed with its one-cell halo as read_tile does."""
+    paddedValues = np.pad(values, 1)
+    paddedNodata = np.pad(nodata, 1, constant_values=True)
+    tiles = {}
+    for tileRow in range(values.shape[0] // tileSize):
+        for tileCol in range(values.shape[1] // tileSize):
+            halo = (slice(tileRow * tileSize, (tileRow + 1) * tileSize + 2),
+                    slice(tileCol * tileSize, (tileCol + 1) * tileSize + 2))
+            directions, sinks, _, _ = analyse_window(paddedValues[halo], paddedNodata[halo])
+            tileNodata = paddedNodata[halo][1:-1, 1:-1]
+            tiles[(tileRow, tileCol)] = SimpleNamespace(
+                nodata=tileNodata, directions=directions, sinks=sinks,
+                flow=FlowGraph(directions, tileNodata, sinks))
+    return tiles
+
+
+def stitched(values, nodata, tileSize):
+    accumulation = np.zeros(values.shape)
+    for (tileRow, tileCol), tileAccumulation in stitch_accumulation(tiles_of(values, nodata, tileSize),
+                                                                    tileSize).items():
+        accumulation[tileRow * tileSize:(tileRow + 1) * tileSize,
+                     tileCol * tileSize:(tileCol + 1) * tileSize] = tileAccumulation
+    return accumulation
+
+
+def whole(values, nodata):
+    directions, sinks, _, _ = analyse_window(np.pad(values, 1), np.pad(nodata, 1, constant_values=True))
+    return flow_accumulation(directions, nodata, sinks)
+
+
+def test_flat_across_tile_border():
+    # A bowl whose 2x2 flat bottom straddles the border of two 4x4 tiles:
+    # its upper cells point at each other across the border, a direction cycle.
+    rows, cols = np.mgrid[0:8, 0:8]
+    values = np.floor(np.maximum(np.abs(rows - 3.5), np.abs(cols - 3.5)))
+    nodata = np.zeros(values.shape, dtype=bool)
+    directions, sinks, _, _ = analyse_window(np.pad(values, 1), np.pad(nodata, 1, constant_values=True))
+    assert directions[3, 3] != NO_DIRECTION and not sinks[3:5, 3:5].any()
+
+    expected = whole(values, nodata)
+    assert expected.sum() > 0
+    np.testing.assert_array_equal(stitched(values, nodata, 4), expected)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_integer_flats(seed):
+    rng = np.random.default_rng(seed)
+    tileSize = int(rng.integers(3, 7))
+    shape = (tileSize * int(rng.integers(1, 4)), tileSize * int(rng.integers(1, 4)))
+    values = rng.integers(0, 3, shape).astype(float)
+    nodata = rng.random(shape) < 0.05
+    valid = ~nodata
+    np.testing.assert_array_equal(stitched(values, nodata, tileSize)[valid], whole(values, nodata)[valid])
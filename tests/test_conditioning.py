@@ -0,0 +1,74 @@
+"""Depression filling and flat resolution against plain reference implementations."""
+import numpy as np
+import pytest
+
+from geomorpheye.analysis import (D8_OFFSETS, NO_DIRECTION, _drains_off, _flat_maxima,
+                                  neighbour_stack, priority_flood, resolve_flats)
+
+
+# Row and col offsets by D8 direction code, none for NO_DIRECTION.
+CODE_ROWS = np.zeros(9, dtype=np.int64)
+CODE_COLS = np.zeros(9, dtype=np.int64)
+for dRow, dCol, code in D8_OFFSETS:
+    CODE_ROWS[code] = dRow
+    CODE_COLS[code] = dCol
+
+
+def reference_fill(values, nodata):
+    """Filled surface by iterated reconstruction: lower every cell to its lowest way out."""
+    drainsOff = _drains_off(nodata)
+    filled = np.where(drainsOff, values, np.inf)
+    while True:
+        neighbours = neighbour_stack(np.pad(np.where(nodata, np.inf, filled), 1, constant_values=np.inf))
+        lowered = np.where(drainsOff | nodata, filled, np.maximum(values, np.minimum(filled, neighbours.min(axis=0))))
+        if np.array_equal(lowered, filled):
+            return filled
+        filled = lowered
+
+
+def random_window(seed):
+    rng = np.random.default_rng(seed)
+    rows, cols = rng.integers(1, 30, 2)
+    values = rng.integers(0, 6, (rows, cols)).astype(np.float64)
+    if seed % 2:
+        values += rng.random((rows, cols))
+    return values, rng.random((rows, cols)) < 0.1
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_priority_flood(seed):
+    values, nodata = random_window(seed)
+    filled = priority_flood(values, nodata)
+    assert np.array_equal(filled[~nodata], reference_fill(values, nodata)[~nodata])
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_resolved_flats_drain_off(seed):
+    values, nodata = random_window(seed)
+    filled = priority_flood(values, nodata)
+    directions, undrained = resolve_flats(filled, nodata)
+    assert not undrained.any()
+    # every cell reaches the window border or nodata by following its directions
+    drainsOff = _drains_off(nodata)
+    rows, cols = np.nonzero(~nodata)
+    for _ in range(values.size):
+        code = directions[rows, cols]
+        if not (code != NO_DIRECTION).any():
+            break
+        rows, cols = rows + CODE_ROWS[code], cols + CODE_COLS[code]
+    assert not (directions[rows, cols] != NO_DIRECTION).any()
+    assert drainsOff[rows, cols].all()
+
+
+def test_flat_maxima_per_flat():
+    flat = np.array([[1, 1, 0, 1],
+                     [0, 1, 0, 1],
+                     [0, 0, 0, 1]], dtype=bool)
+    away = np.array([[1, 3, 0, 2],
+                     [0, 2, 0, 5],
+                     [0, 0, 0, 1]])
+    flatLinks = neighbour_stack(np.pad(flat, 1)) & flat
+    expected = np.array([[3, 3, 0, 5],
+                         [0, 3, 0, 5],
+                         [0, 0, 0, 5]])
+    assert np.array_equal(_flat_maxima(flat, away, flatLinks), expected)
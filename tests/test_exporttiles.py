@@ -0,0 +1,99 @@
+"""Tiled export against the analysis of the whole raster."""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from geomorpheye.analysis import NO_DIRECTION, analyse_window
+from geomorpheye.exporttiles import (BYTE_NODATA, FLOAT_NODATA, analyse_export_tile,
+                                     export_windows, map_bounded, parallel_map)
+
+
+def export_raster(values, nodata, size):
+    """Directions, sinks and slope of a raster, analysed and assembled tile by tile."""
+    paddedValues = np.pad(values, 1)
+    paddedNodata = np.pad(nodata, 1, constant_values=True)
+    rows, cols = values.shape
+    directions = np.full((rows, cols), 77, dtype=np.uint8)
+    sinks = np.full((rows, cols), 77, dtype=np.uint8)
+    slopes = np.full((rows, cols), np.nan, dtype=np.float32)
+    sinkCells = []
+    for window in export_windows(cols, rows, size):
+        firstCol, firstRow, endCol, endRow = window
+        halo = (slice(firstRow, endRow + 2), slice(firstCol, endCol + 2))
+        _, tileDirections, tileSinks, tileSlope, (sinkRows, sinkCols, sinkValues) = analyse_export_tile(
+            window, paddedValues[halo], paddedNodata[halo], 10.0, 10.0)
+        inRaster = (slice(firstRow, endRow), slice(firstCol, endCol))
+        directions[inRaster] = tileDirections
+        sinks[inRaster] = tileSinks
+        slopes[inRaster] = tileSlope
+        sinkCells.extend(zip((sinkRows + firstRow).tolist(), (sinkCols + firstCol).tolist(),
+                             sinkValues.tolist()))
+    return directions, sinks, slopes, sinkCells
+
+
+def test_export_windows_cover_the_raster():
+    windows = list(export_windows(10, 7, 4))
+    assert windows == [(0, 0, 4, 4), (4, 0, 8, 4), (8, 0, 10, 4),
+                       (0, 4, 4, 7), (4, 4, 8, 7), (8, 4, 10, 7)]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_tiles_match_the_whole_raster(seed):
+    rng = np.random.default_rng(seed)
+    rows, cols = rng.integers(5, 23, 2)
+    values = rng.integers(0, 5, (rows, cols)).astype(np.float64)
+    nodata = rng.random((rows, cols)) < 0.15
+    directions, sinks, slopes, sinkCells = export_raster(values, nodata, 4)
+
+    wholeDirections, wholeSinks, _, _ = analyse_window(np.pad(values, 1),
+                                                       np.pad(nodata, 1, constant_values=True))
+    assert np.array_equal(directions[~nodata], wholeDirections[~nodata])
+    assert np.array_equal(sinks[~nodata], wholeSinks[~nodata].astype(np.uint8))
+    assert (directions[nodata] == BYTE_NODATA).all()
+    assert (sinks[nodata] == BYTE_NODATA).all()
+    assert (slopes[nodata] == FLOAT_NODATA).all()
+    assert (slopes[~nodata] >= 0).all()
+    sinkRows, sinkCols = np.nonzero(wholeSinks & ~nodata)
+    assert sorted(sinkCells) == sorted(zip(sinkRows.tolist(), sinkCols.tolist(),
+                                           values[sinkRows, sinkCols].tolist()))
+
+
+def test_direction_codes():
+    # a pit on a tile corner, and a cell cut off by nodata
+    values = np.array([[5, 6, 7, 9],
+                       [6, 1, 8, 9],
+                       [7, 8, 9, 3],
+                       [9, 9, 9, 9]], dtype=np.float64)
+    nodata = np.zeros(values.shape, dtype=bool)
+    nodata[1:4, 2] = True
+    nodata[1, 3] = True
+    nodata[3, 3] = True
+    directions, sinks, _, _ = export_raster(values, nodata, 2)
+    # the pit is a sink and points to its lowest neighbour, uphill, north-west
+    assert sinks[1, 1] == 1
+    assert directions[1, 1] == 4
+    # no valid neighbour: no direction
+    assert directions[2, 3] == NO_DIRECTION
+    assert sinks[2, 3] == 1
+    assert directions[0, 0] == 8
+
+
+def test_map_bounded_keeps_order_and_bounds_pending():
+    pulled = []
+
+    def items():
+        for i in range(20):
+            pulled.append(i)
+            yield (i,)
+
+    with ThreadPoolExecutor(4) as executor:
+        results = map_bounded(executor, lambda i: i * i, items(), 3)
+        assert next(results) == 0
+        assert len(pulled) <= 3
+        assert list(results) == [i * i for i in range(1, 20)]
+
+
+def test_parallel_map_in_the_calling_thread():
+    assert list(parallel_map(lambda a, b: a + b, [(1, 2), (3, 4)], 1)) == [3, 7]
+    assert list(parallel_map(lambda a, b: a + b, [(1, 2), (3, 4)], 3)) == [3, 7]
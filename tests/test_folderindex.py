@@ -0,0 +1,67 @@
+"""Raster name lookups in a folder index, and its rescan when the folder changes."""
+import importlib
+import os
+import sys
+
+import pytest
+
+from rasterfromvectorfieldloader import folderindex
+
+
+def make_folder(path, names):
+    for name in names:
+        (path / name).write_text("")
+    return str(path)
+
+
+@pytest.fixture
+def case_insensitive_folderindex(monkeypatch):
+    """The module as imported on Windows, where names are matched regardless of case."""
+    monkeypatch.setattr(sys, "platform", "win32")
+    yield importlib.reload(folderindex)
+    monkeypatch.undo()
+    importlib.reload(folderindex)
+
+
+def test_exact_match(tmp_path):
+    folder = make_folder(tmp_path, ["dem.tif", "dem.tif.aux.xml", "dem_2020.tif"])
+    index = folderindex.FolderIndex.scan(folder)
+    assert index.resolve("dem.tif") == os.path.join(folder, "dem.tif")
+    # any entry, also one that is no raster file
+    assert index.resolve("dem.tif.aux.xml") == os.path.join(folder, "dem.tif.aux.xml")
+
+
+def test_prefix_match(tmp_path):
+    folder = make_folder(tmp_path, ["dem_2021.asc", "dem_2020.tif", "dem.txt", "slope.tif"])
+    index = folderindex.FolderIndex.scan(folder)
+    # the first raster file in sorted order, never the other files
+    assert index.resolve("dem") == os.path.join(folder, "dem_2020.tif")
+    assert index.resolve("dem_2021") == os.path.join(folder, "dem_2021.asc")
+    assert index.find_prefix("dem.t") is None
+    assert index.resolve("aspect") is None
+
+
+def test_case_insensitive_match(tmp_path, case_insensitive_folderindex):
+    folder = make_folder(tmp_path, ["Dem_2020.TIF", "Slope.tif"])
+    index = case_insensitive_folderindex.FolderIndex.scan(folder)
+    assert index.case_insensitive
+    # the entry name found is used, not the name looked up
+    assert index.resolve("dem_2020.tif") == os.path.join(folder, "Dem_2020.TIF")
+    assert index.resolve("SLOPE.TIF") == os.path.join(folder, "Slope.tif")
+    assert index.resolve("DEM") == os.path.join(folder, "Dem_2020.TIF")
+
+
+def test_rebuilt_when_the_folder_mtime_changes(tmp_path):
+    folder = make_folder(tmp_path, ["dem.tif"])
+    index = folderindex.folder_index(folder)
+    assert folderindex.folder_index(folder) is index
+    assert index.resolve("slope") is None
+
+    make_folder(tmp_path, ["slope.tif"])
+    # the mtime may not have ticked on a coarse file system clock
+    mtime = os.stat(folder).st_mtime_ns
+    os.utime(folder, ns=(mtime, mtime + 1_000_000_000))
+    rebuilt = folderindex.folder_index(folder)
+    assert rebuilt is not index
+    assert rebuilt.resolve("slope") == os.path.join(folder, "slope.tif")
+    assert folderindex.folder_index(folder) is rebuilt